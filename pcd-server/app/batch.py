@@ -0,0 +1,93 @@
+"""
+Пакетная очистка локальных файлов (clearing_algorithm.py --in 'dir/*.pcd'):
+одни параметры, пул из jobs процессов, по файлу на процесс.
+
+Файлы отдаются в пул окном по jobs: пока очищаются текущие, следующие jobs
+файлов дочитываются ядром в кэш страниц (posix_fadvise WILLNEED) — локальный
+аналог скачивания впрок у пакетной задачи бэкенда (worker.clean_batch).
+Итог — время и точек в секунду по каждому файлу и по пакету.
+"""
+from __future__ import annotations
+import glob, os, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Dict, List
+
+try:
+    from .clearing_algorithm import log, report, Progress, process
+    from .parallel import make_pool
+except ImportError:  # запуск clearing_algorithm.py как скрипта
+    from clearing_algorithm import log, report, Progress, process
+    from parallel import make_pool
+
+
+def batch_paths(pattern: str) -> List[str]:
+    """Файлы .pcd по glob-шаблону или в каталоге, по имени."""
+    if os.path.isdir(pattern):
+        pattern=os.path.join(pattern, "*.pcd")
+    return sorted(p for p in glob.glob(pattern) if p.lower().endswith(".pcd") and os.path.isfile(p))
+
+
+def _readahead(path: str):
+    try:
+        fd=os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except (AttributeError, OSError):  # нет posix_fadvise (macOS, Windows)
+        pass
+    finally:
+        os.close(fd)
+
+
+def _clean_one(path: str, out_path: str, params: dict) -> dict:
+    t=time.perf_counter()
+    summary=process(path, out_path, **params)
+    return {"input_points": summary["input_points"], "removed_points": summary["removed_points"],
+            "seconds": time.perf_counter()-t, "peak_rss_mb": summary["peak_rss_mb"]}
+
+
+def process_batch(paths: List[str], out_dir: str, jobs: int = 2, progress: Progress | None = None,
+                  **params) -> dict:
+    """
+    Очистить paths в out_dir (<имя>_cleaned.pcd и <имя>_cleaned_summary.json);
+    params — как у process. Ошибка файла не прерывает пакет. Возвращает
+    {"files": [...], "input_points", "seconds", "points_per_s"}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    t0=time.perf_counter()
+    results: Dict[str, dict]={}
+    pending=deque(paths)
+    running={}
+    with make_pool(max(1, min(jobs, len(paths)))) as pool:
+        while pending or running:
+            while pending and len(running)<jobs:
+                path=pending.popleft()
+                base=os.path.splitext(os.path.basename(path))[0]
+                # у каждого файла свой каталог кэша растров
+                file_params=params
+                if params.get("cache_dir"):
+                    file_params=dict(params, cache_dir=os.path.join(params["cache_dir"], base))
+                running[pool.submit(_clean_one, path, os.path.join(out_dir, f"{base}_cleaned.pcd"), file_params)]=path
+                for nxt in list(pending)[:jobs]:
+                    _readahead(nxt)
+            done, _=wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                path=running.pop(fut)
+                try:
+                    r=fut.result()
+                    r["points_per_s"]=round(r["input_points"]/r["seconds"]) if r["seconds"]>0 else None
+                    log(f"{path}: {r['input_points']} точек, удалено {r['removed_points']}, {r['seconds']:.1f} с,"
+                        f" {r['input_points']/max(r['seconds'], 1e-9)/1e6:.2f} млн точек/с")
+                except Exception as e:
+                    r={"error": f"{type(e).__name__}: {e}"}
+                    log(f"{path}: ошибка {r['error']}")
+                results[path]={"path": path, **r}
+                report(progress, len(results)/len(paths), "clean")
+    seconds=time.perf_counter()-t0
+    points=sum(r.get("input_points", 0) for r in results.values())
+    out={"files": [results[p] for p in paths], "input_points": points, "seconds": round(seconds, 3),
+         "points_per_s": round(points/seconds) if seconds>0 else 0}
+    log(f"Пакет: {len(paths)} файлов, {points} точек за {seconds:.1f} с, {points/max(seconds, 1e-9)/1e6:.2f} млн точек/с")
+    return out
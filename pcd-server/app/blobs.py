@@ -0,0 +1,140 @@
+"""
+Хранение оригиналов по содержимому и кэш результатов очистки.
+
+Оригинал с данным sha256 хранится в MinIO один раз (blobs/<uuid>.pcd), на него
+ссылаются записи files; blobs.refcount — число таких записей. Результаты
+очистки (cleaned/delta/summary или маска, см. masks.py) кэшируются по (sha256, нормализованный
+CleanRequest) под results/<sha256>/<ключ параметров>/ и живут, пока жив
+оригинал: при освобождении последней ссылки удаляются объект, результаты,
+их октодеревья LOD (lod/<ключ объекта>/) и локальный кэш растров.
+"""
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from .db import get_db
+from .raster_cache import get_raster_cache
+from .schemas import CleanRequest
+from .settings import get_settings
+from .storage import get_minio_client, remove_keys
+
+# поля CleanRequest, не влияющие на результат
+_NOT_IN_KEY = {"debug_dump", "keep_state"}
+
+
+def new_blob_key() -> str:
+    """Ключ для загрузки нового оригинала (sha256 станет известен после загрузки)."""
+    return f"blobs/{uuid.uuid4()}.pcd"
+
+
+def params_key(params: CleanRequest) -> str:
+    """Ключ параметров очистки: sha256 канонического JSON без полей, не влияющих на результат."""
+    data = params.model_dump(exclude=_NOT_IN_KEY)
+    # поля, добавленные позже, без значения в ключ не входят: сохранённые результаты остаются найденными
+    if data.get("coord_quantum") is None:
+        data.pop("coord_quantum", None)
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def result_prefix(sha256: str, pkey: str) -> str:
+    return f"results/{sha256}/{pkey}/"
+
+
+def lod_prefix(key: str) -> str:
+    """Префикс октодерева LOD объекта key: lod/<key без расширения>/."""
+    return f"lod/{os.path.splitext(key)[0]}/"
+
+
+def acquire_blob(con, sha256: str, key: str, size: int) -> str:
+    """
+    Ссылка на оригинал с данным содержимым; key — только что загруженный объект.
+    Возвращает ключ, который надо записать в files: уже хранящийся (тогда key
+    лишний и его нужно удалить) или key. Вызывать внутри транзакции con.
+    """
+    con.execute(
+        "INSERT OR IGNORE INTO blobs (sha256, s3_key, size, refcount, created_at) VALUES (?,?,?,0,?)",
+        (sha256, key, size, datetime.utcnow().isoformat()),
+    )
+    con.execute("UPDATE blobs SET refcount=refcount+1 WHERE sha256=?", (sha256,))
+    return con.execute("SELECT s3_key FROM blobs WHERE sha256=?", (sha256,)).fetchone()["s3_key"]
+
+
+def release_blob(con, sha256: Optional[str], key: Optional[str]) -> List[str]:
+    """
+    Снять ссылку записи files на оригинал (внутри транзакции con). Если ссылок
+    не осталось — удалить записи блоба и его результатов; возвращает ключи и
+    префиксы MinIO, которые нужно удалить после commit (см. purge). Оригиналы,
+    загруженные до появления blobs, лежат под pcd/<id>/ и здесь не учитываются.
+    """
+    if not sha256:
+        return []
+    cur = con.execute("UPDATE blobs SET refcount=refcount-1 WHERE sha256=? AND s3_key=?", (sha256, key))
+    if cur.rowcount == 0:
+        return []
+    r = con.execute("SELECT s3_key, refcount FROM blobs WHERE sha256=?", (sha256,)).fetchone()
+    if not r or r["refcount"] > 0:
+        return []
+    con.execute("DELETE FROM blobs WHERE sha256=?", (sha256,))
+    con.execute("DELETE FROM clean_results WHERE sha256=?", (sha256,))
+    return [r["s3_key"], lod_prefix(r["s3_key"]), f"results/{sha256}/", f"lod/results/{sha256}/"]
+
+
+def purge(keys: List[str]) -> List[str]:
+    """
+    Удалить объекты и префиксы (ключи на '/') из MinIO пакетами (storage.remove_keys);
+    для префикса results/<sha256>/ — и локальный кэш растров этого содержимого.
+    Возвращает то, что удалить не удалось (ошибки уже в логе).
+    """
+    if not keys:
+        return []
+    settings = get_settings()
+    cache = get_raster_cache()
+    if cache:
+        for key in keys:
+            if key.startswith("results/") and key.endswith("/"):
+                cache.drop(key.split("/")[1])
+    return remove_keys(get_minio_client(settings), settings.minio_bucket, keys)
+
+
+def content_sha(r) -> Optional[str]:
+    """sha256 оригинала записи files, если он хранится как блоб (иначе результаты не кэшируются)."""
+    if not r["sha256"]:
+        return None
+    con = get_db(get_settings())
+    try:
+        b = con.execute("SELECT 1 FROM blobs WHERE sha256=? AND s3_key=?", (r["sha256"], r["s3_key_original"])).fetchone()
+    finally:
+        con.close()
+    return r["sha256"] if b else None
+
+
+def lookup_clean_result(sha256: Optional[str], params: CleanRequest):
+    """Строка clean_results для содержимого и параметров или None."""
+    if not sha256:
+        return None
+    con = get_db(get_settings())
+    try:
+        return con.execute(
+            "SELECT * FROM clean_results WHERE sha256=? AND params_key=?", (sha256, params_key(params))
+        ).fetchone()
+    finally:
+        con.close()
+
+
+def store_clean_result(sha256: str, params: CleanRequest, cleaned_key: Optional[str], delta_key: Optional[str],
+                       summary: dict, mask_key: Optional[str] = None):
+    """Запомнить результат; не записывается, если оригинал уже освобождён, пока шла очистка."""
+    con = get_db(get_settings())
+    try:
+        con.execute(
+            "INSERT OR REPLACE INTO clean_results (sha256, params_key, s3_key_cleaned, s3_key_delta, s3_key_mask,"
+            " summary_json, created_at) SELECT ?,?,?,?,?,?,? WHERE EXISTS (SELECT 1 FROM blobs WHERE sha256=?)",
+            (sha256, params_key(params), cleaned_key, delta_key, mask_key, json.dumps(summary, ensure_ascii=False),
+             datetime.utcnow().isoformat(), sha256),
+        )
+        con.commit()
+    finally:
+        con.close()
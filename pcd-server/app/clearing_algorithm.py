@@ -1,17 +1,27 @@
 from __future__ import annotations
-import argparse, os, sys, math, json
+import argparse, glob, os, sys, math, json
+from contextlib import nullcontext
 from dataclasses import dataclass
-from typing import Tuple, List
+from typing import BinaryIO, Callable, ContextManager, Tuple, List, Union
 import numpy as np
-import open3d as o3d
 
 np.random.seed(42)
 def log(m): print(m, file=sys.stderr)
-def to_np(pcd): return np.asarray(pcd.points, dtype=np.float64)
-def from_np(xyz):
-    p=o3d.geometry.PointCloud()
-    p.points=o3d.utility.Vector3dVector(xyz.astype(np.float64))
-    return p
+# обратный вызов прогресса: (доля 0..1, этап)
+Progress = Callable[[float, str], None]
+def report(progress: Progress | None, frac: float, stage: str):
+    if progress is not None: progress(frac, stage)
+try:
+    from .pcd_io import read_pcd, write_pcd, as_records, iter_records
+    from .coords import Coords, from_records, read_coords
+    from .profiling import count, dump_profile, peak_rss_mb, profiled, stage, stages
+except ImportError:  # запуск как скрипта
+    from pcd_io import read_pcd, write_pcd, as_records, iter_records
+    from coords import Coords, from_records, read_coords
+    from profiling import count, dump_profile, peak_rss_mb, profiled, stage, stages
+# источник облака: путь, бинарный поток или функция, открывающая поток
+# (вызывается, только если точек нет в кэше)
+Source = Union[str, BinaryIO, Callable[[], ContextManager[BinaryIO]]]
 
 # ---------- 2.5D квантильная сетка ----------
 @dataclass
@@ -19,75 +29,310 @@ class Grid2p5D:
     grid: float; origin: Tuple[float,float]; W:int; H:int
     z_low: np.ndarray; z_high: np.ndarray; count: np.ndarray
 
-def build_grid(points: np.ndarray, grid: float, q_low=0.02, q_high=0.90) -> Grid2p5D:
-    xy=points[:,:2]; z=points[:,2]
-    mn=xy.min(axis=0); mx=xy.max(axis=0); origin=mn
+def _segment_quantile(z_s: np.ndarray, start: np.ndarray, cnt: np.ndarray, q: float) -> np.ndarray:
+    """
+    Квантиль q (method="linear", как np.quantile) сразу для всех сегментов
+    z_s[start:start+cnt]; внутри сегмента z_s уже отсортирован по возрастанию.
+    """
+    n=cnt.astype(np.float64)
+    vi=(n-1.0)*q                    # виртуальный индекс method="linear", как у NumPy
+    prev=np.floor(vi)
+    gamma=vi-prev
+    prev=prev.astype(np.int64)
+    nxt=prev+1
+    last=cnt-1
+    np.clip(prev,0,last,out=prev); np.clip(nxt,0,last,out=nxt)
+    a=z_s[start+prev]; b=z_s[start+nxt]
+    diff=b-a
+    out=a+diff*gamma
+    hi=gamma>=0.5
+    out[hi]=b[hi]-diff[hi]*(1.0-gamma[hi])
+    # NaN в сегменте сортируется в конец и, как у np.quantile, «заражает» результат
+    nan_seg=np.isnan(z_s[start+last])
+    out[nan_seg]=np.nan
+    return out
+
+def grid_shape(mn, mx, grid: float) -> Tuple[int,int]:
+    """(W, H) сетки, покрывающей прямоугольник [mn, mx] с началом в mn."""
     W=int(math.ceil((mx[0]-mn[0])/grid))+1
     H=int(math.ceil((mx[1]-mn[1])/grid))+1
+    return W,H
+
+def cell_index(xy: np.ndarray, origin: Tuple[float,float], grid: float, W:int, H:int) -> Tuple[np.ndarray,np.ndarray]:
+    """Индексы клеток точек, прижатые к границам сетки (как при построении сетки)."""
     ix=np.floor((xy[:,0]-origin[0])/grid).astype(np.int64); ix=np.clip(ix,0,W-1)
     iy=np.floor((xy[:,1]-origin[1])/grid).astype(np.int64); iy=np.clip(iy,0,H-1)
-    gid=iy*W+ix
-    order=np.argsort(gid); gid_s=gid[order]; z_s=z[order]
-    uniq, start, cnt=np.unique(gid_s, return_index=True, return_counts=True)
-
-    z_low=np.full((H,W), np.nan, dtype=np.float32)
-    z_high=np.full((H,W), np.nan, dtype=np.float32)
-    count=np.zeros((H,W), dtype=np.int32)
-    for u,s,c in zip(uniq,start,cnt):
-        seg=z_s[s:s+c]
-        low=np.quantile(seg, q_low)
-        high=np.quantile(seg, q_high)
-        iyc=int(u//W); ixc=int(u%W)
-        z_low[iyc,ixc]=low; z_high[iyc,ixc]=high; count[iyc,ixc]=c
-    return Grid2p5D(grid,(origin[0],origin[1]),W,H,z_low,z_high,count)
+    return ix,iy
+
+def _cell_quantiles(gid: np.ndarray, z: np.ndarray, q_low: float, q_high: float,
+                    z_low: np.ndarray, z_high: np.ndarray, count: np.ndarray):
+    """Квантили z и число точек по клеткам gid в плоские z_low, z_high, count (пустые клетки не трогаются)."""
+    # сортировка по (клетка, z): argsort по z + устойчивый argsort по клетке (быстрее lexsort);
+    # сегменты клеток идут подряд и внутри уже упорядочены по z
+    order=np.argsort(z)
+    order=order[np.argsort(gid[order], kind="stable")]
+    gid_s=gid[order]; z_s=z[order]
+    del order
+    start=np.flatnonzero(np.r_[True, gid_s[1:]!=gid_s[:-1]])
+    cnt=np.diff(np.r_[start, gid_s.size])
+    uniq=gid_s[start]
+    z_low[uniq]=_segment_quantile(z_s, start, cnt, q_low)
+    z_high[uniq]=_segment_quantile(z_s, start, cnt, q_high)
+    count[uniq]=cnt
+
+def _empty_grid(grid: float, origin: Tuple[float,float], W:int, H:int) -> Grid2p5D:
+    return Grid2p5D(grid,(origin[0],origin[1]),W,H,
+                    np.full((H,W), np.nan, dtype=np.float32), np.full((H,W), np.nan, dtype=np.float32),
+                    np.zeros((H,W), dtype=np.int32))
+
+def grid_from_cells(ix: np.ndarray, iy: np.ndarray, z: np.ndarray, grid: float,
+                    origin: Tuple[float,float], W:int, H:int, q_low=0.02, q_high=0.90) -> Grid2p5D:
+    """Квантильная сетка по готовым индексам клеток (0<=ix<W, 0<=iy<H)."""
+    G=_empty_grid(grid, origin, W, H)
+    _cell_quantiles(iy*W+ix, z, q_low, q_high, G.z_low.reshape(-1), G.z_high.reshape(-1), G.count.reshape(-1))
+    return G
+
+# ---------- одна клетка на точку, сетка полосами строк ----------
+# полоса — не меньше _BAND_MIN_POINTS точек и не больше ~1/_BANDS облака:
+# временные массивы сортировки (≈48 байт на точку полосы) — малая доля облака
+_BANDS=32
+_BAND_MIN_POINTS=1<<20
+
+def cell_ids(C: Coords, origin: Tuple[float,float], grid: float, W:int, H:int) -> np.ndarray:
+    """
+    Номер клетки iy*W+ix каждой точки (int32, если сетка позволяет), порциями;
+    индексы прижаты к границам, как в cell_index; -1 — не-финитные x или y.
+    """
+    out=np.empty(C.n, dtype=np.int32 if W*H<2**31 else np.int64)
+    for i,j in C.spans():
+        x=C.get(0,i,j); y=C.get(1,i,j)
+        bad=~(np.isfinite(x)&np.isfinite(y))
+        x[bad]=origin[0]; y[bad]=origin[1]
+        ix,iy=cell_index(np.column_stack([x,y]), origin, grid, W, H)
+        c=iy*W+ix
+        c[bad]=-1
+        out[i:j]=c
+    return out
+
+def _row_bands(rows: np.ndarray, per_band: int) -> List[Tuple[int,int]]:
+    """Полосы строк [r0, r1) примерно по per_band точек (строка не делится)."""
+    cum=np.cumsum(rows)
+    cuts=np.searchsorted(cum, np.arange(per_band, int(cum[-1]), per_band), side="right")
+    edges=np.unique(np.r_[0, cuts, rows.size])
+    return [(int(a),int(b)) for a,b in zip(edges[:-1], edges[1:])]
+
+def grid_from_ids(C: Coords, cell: np.ndarray, grid: float, origin: Tuple[float,float], W:int, H:int,
+                  q_low=0.02, q_high=0.90) -> Grid2p5D:
+    """
+    Квантильная сетка по номерам клеток из cell_ids. Клетки независимы, поэтому
+    сортировка идёт полосами строк: номера клеток и z (float64) точек полосы
+    собираются порциями, и память сортировки — на полосу, а не на облако.
+    """
+    G=_empty_grid(grid, origin, W, H)
+    rows=np.zeros(H, dtype=np.int64)
+    for i,j in C.spans():
+        c=cell[i:j]
+        rows+=np.bincount(c[c>=0]//W, minlength=H)
+    z_low=G.z_low.reshape(-1); z_high=G.z_high.reshape(-1); count=G.count.reshape(-1)
+    for r0,r1 in _row_bands(rows, max(_BAND_MIN_POINTS, C.n//_BANDS)):
+        m=int(rows[r0:r1].sum())
+        if m==0: continue
+        lo,hi=r0*W, r1*W
+        gid=np.empty(m, dtype=np.int64); z=np.empty(m, dtype=np.float64); k=0
+        for i,j in C.spans():
+            c=cell[i:j]
+            sel=(c>=lo)&(c<hi)
+            s=int(np.count_nonzero(sel))
+            if s==0: continue
+            gid[k:k+s]=c[sel]; gid[k:k+s]-=lo
+            z[k:k+s]=C.get(2,i,j,sel)
+            k+=s
+        _cell_quantiles(gid, z, q_low, q_high, z_low[lo:hi], z_high[lo:hi], count[lo:hi])
+        del gid, z
+    return G
+
+def build_grid(points: np.ndarray, grid: float, q_low=0.02, q_high=0.90) -> Grid2p5D:
+    return grid_cells(Coords.of(points), grid, q_low, q_high)[0]
 
 # ---------- фильтр по окну (без SciPy) ----------
+def _window_bounds(n: int, radius: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Границы окна [i-r, i+r] в координатах интегрального изображения (со сдвигом на 1), обрезанные по краю."""
+    i=np.arange(n)
+    return np.clip(i-radius,0,n), np.clip(i+radius+1,0,n)
+
 def nanmean_filter(A: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Среднее по окну (2r+1)x(2r+1) без учёта NaN; у края окно обрезается.
+    Считается по интегральным изображениям (суммы значений и числа не-NaN),
+    поэтому стоимость не зависит от радиуса.
+    """
     if radius<=0: return A.copy()
     H,W=A.shape
-    acc=np.zeros((H,W), dtype=np.float64)
-    cnt=np.zeros((H,W), dtype=np.float64)
-    for dy in range(-radius, radius+1):
-        y0=max(0,-dy); y1=min(H,H-dy)
-        for dx in range(-radius, radius+1):
-            x0=max(0,-dx); x1=min(W,W-dx)
-            src=A[y0:y1, x0:x1]
-            tgt=acc[y0+dy:y1+dy, x0+dx:x1+dx]
-            tcnt=cnt[y0+dy:y1+dy, x0+dx:x1+dx]
-            m=~np.isnan(src)
-            tgt[m]+=src[m]; tcnt[m]+=1.0
-    out=np.full_like(A, np.nan, dtype=np.float64)
-    m=cnt>0; out[m]=acc[m]/cnt[m]
+    m=~np.isnan(A)
+    if not m.any(): return np.full((H,W), np.nan, dtype=np.float64)
+    # сдвиг к среднему уменьшает накопление ошибки в кумулятивных суммах
+    off=float(A[m].mean(dtype=np.float64))
+    S=np.zeros((H+1,W+1), dtype=np.float64)
+    N=np.zeros((H+1,W+1), dtype=np.int64)
+    np.subtract(A, off, out=S[1:,1:], where=m, dtype=np.float64)
+    N[1:,1:]=m
+    for T in (S,N):
+        np.cumsum(T[1:,1:], axis=0, out=T[1:,1:])
+        np.cumsum(T[1:,1:], axis=1, out=T[1:,1:])
+    y0,y1=_window_bounds(H, radius); x0,x1=_window_bounds(W, radius)
+    Sy=S[y1]; Sy-=S[y0]
+    acc=Sy[:,x1]; acc-=Sy[:,x0]
+    del Sy, S
+    Ny=N[y1]; Ny-=N[y0]
+    cnt=Ny[:,x1]; cnt-=Ny[:,x0]
+    del Ny, N
+    out=np.full((H,W), np.nan, dtype=np.float64)
+    np.divide(acc, cnt, out=out, where=cnt>0)
+    np.add(out, off, out=out, where=cnt>0)
     return out
 
 # ---------- связные компоненты ----------
-def connected_components(mask: np.ndarray) -> List[np.ndarray]:
+# половина 8-соседства: каждая пара соседних клеток встречается ровно один раз
+_HALF_NEIGH=((0,1),(1,-1),(1,0),(1,1))
+
+def label_components(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Разметка 8-связных компонент маски без циклов по клеткам: рёбра между соседними
+    клетками собираются срезами, затем union-find «подвешиванием» к меньшему корню
+    и сжатием путей (pointer jumping) на массивах NumPy.
+    Возвращает (labels, n): labels[y,x]=0 для фона и 1..n для компонент,
+    нумерация — в порядке первой клетки при построчном обходе.
+    """
     H,W=mask.shape
-    seen=np.zeros_like(mask, dtype=bool)
-    comps=[]
-    neigh=[(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
-    for y in range(H):
-        xs=np.where(mask[y] & (~seen[y]))[0]
-        for x in xs:
-            if seen[y,x]: continue
-            q=[(y,x)]; seen[y,x]=True; comp=[]
-            while q:
-                cy,cx=q.pop(); comp.append(cy*W+cx)
-                for dy,dx in neigh:
-                    ny=cy+dy; nx=cx+dx
-                    if ny<0 or nx<0 or ny>=H or nx>=W: continue
-                    if mask[ny,nx] and not seen[ny,nx]:
-                        seen[ny,nx]=True; q.append((ny,nx))
-            comps.append(np.array(comp, dtype=np.int64))
-    return comps
-
-def xy_to_cell(xy: np.ndarray, origin: Tuple[float,float], grid: float, W:int, H:int):
-    ix=np.floor((xy[:,0]-origin[0])/grid).astype(np.int64)
-    iy=np.floor((xy[:,1]-origin[1])/grid).astype(np.int64)
-    valid=(ix>=0)&(iy>=0)&(ix<W)&(iy<H)
-    return ix,iy,valid
+    idx=np.flatnonzero(mask)
+    n=idx.size
+    labels=np.zeros((H,W), dtype=np.int32)
+    if n==0: return labels, 0
+    L=np.full((H,W), -1, dtype=np.int64)
+    L.reshape(-1)[idx]=np.arange(n)
+
+    ea=[]; eb=[]
+    for dy,dx in _HALF_NEIGH:
+        xa0=max(0,-dx); xa1=W-max(0,dx)
+        A=L[0:H-dy, xa0:xa1]; B=L[dy:H, xa0+dx:xa1+dx]
+        m=(A>=0)&(B>=0)
+        ea.append(A[m]); eb.append(B[m])
+    ea=np.concatenate(ea); eb=np.concatenate(eb)
+    del L
+
+    parent=np.arange(n, dtype=np.int64)
+    while ea.size:
+        ra=parent[ea]; rb=parent[eb]
+        d=ra!=rb
+        if not d.any(): break
+        ea=ea[d]; eb=eb[d]; ra=ra[d]; rb=rb[d]
+        # больший корень подвешиваем к меньшему — циклов не бывает
+        np.minimum.at(parent, np.maximum(ra,rb), np.minimum(ra,rb))
+        while True:
+            pp=parent[parent]
+            if np.array_equal(pp,parent): break
+            parent=pp
+    # корень компоненты — её клетка с минимальным индексом, поэтому unique сохраняет порядок обхода
+    _, comp=np.unique(parent, return_inverse=True)
+    labels.reshape(-1)[idx]=comp.astype(np.int32)+1
+    return labels, int(comp.max())+1
+
+def connected_components(mask: np.ndarray) -> List[np.ndarray]:
+    """Список компонент как массивов линейных индексов клеток (поверх label_components)."""
+    labels, n=label_components(mask)
+    if n==0: return []
+    flat=labels.reshape(-1)
+    idx=np.flatnonzero(flat)
+    lab=flat[idx]
+    order=np.argsort(lab, kind="stable")
+    bounds=np.cumsum(np.bincount(lab, minlength=n+1)[1:])
+    return np.split(idx[order], bounds[:-1])
+
+@dataclass
+class ComponentStats:
+    size: np.ndarray            # (n,)   число клеток
+    mean: np.ndarray            # (n,2)  центр масс центров клеток, м
+    cov: np.ndarray             # (n,3)  ковариация (xx, xy, yy), несмещённая как у np.cov
+    evals: np.ndarray           # (n,2)  собственные числа λ1<=λ2
+
+def component_stats(labels: np.ndarray, n: int, G: Grid2p5D) -> ComponentStats:
+    """
+    Размер, центр, ковариация и собственные числа центров клеток сразу для всех
+    компонент: суммы через bincount, 2x2 собственные числа в замкнутом виде.
+    """
+    flat=labels.reshape(-1)
+    idx=np.flatnonzero(flat)
+    lab=flat[idx]
+    ys=idx//G.W; xs=idx%G.W
+    X=G.origin[0] + (xs + 0.5)*G.grid
+    Y=G.origin[1] + (ys + 0.5)*G.grid
+    size=np.bincount(lab, minlength=n+1)[1:]
+    sz=np.maximum(size,1).astype(np.float64)
+    mx=np.bincount(lab, weights=X, minlength=n+1)[1:]/sz
+    my=np.bincount(lab, weights=Y, minlength=n+1)[1:]/sz
+    # два прохода: отклонения от среднего, чтобы не терять точность на больших координатах
+    dx=X-mx[lab-1]; dy=Y-my[lab-1]
+    ddof=np.maximum(size-1,1).astype(np.float64)
+    cxx=np.bincount(lab, weights=dx*dx, minlength=n+1)[1:]/ddof
+    cxy=np.bincount(lab, weights=dx*dy, minlength=n+1)[1:]/ddof
+    cyy=np.bincount(lab, weights=dy*dy, minlength=n+1)[1:]/ddof
+    half_tr=0.5*(cxx+cyy)
+    disc=np.sqrt((0.5*(cxx-cyy))**2 + cxy**2)
+    evals=np.column_stack([half_tr-disc, half_tr+disc])
+    return ComponentStats(size, np.column_stack([mx,my]), np.column_stack([cxx,cxy,cyy]), evals)
 
 # ---------- НОВОЕ: Hough-полосы ----------
+# окрестность подавления пика: ±1 шаг угла, ±3 бина rho
+_HOUGH_NMS=(1,3)
+# сколько элементов (клетки × углы) голосуют за один проход bincount
+_HOUGH_CHUNK=1<<22
+
+def hough_accumulate(C: np.ndarray, thetas: np.ndarray, rho_bin_m: float) -> Tuple[np.ndarray, float]:
+    """
+    Аккумулятор (nT, Nrho) голосов центров C за все углы сразу: плоский индекс
+    ti*Nrho+ridx и один bincount на порцию клеток. Возвращает (A, rho_min).
+    """
+    cs=np.stack([np.cos(thetas), np.sin(thetas)])            # (2, nT)
+    lo=C.min(axis=0); hi=C.max(axis=0)
+    # диапазон rho консервативно по bbox для всех углов
+    bbox=np.array([[lo[0],lo[1]],[lo[0],hi[1]],[hi[0],lo[1]],[hi[0],hi[1]]])
+    rb=bbox @ cs
+    rho_min=float(rb.min()); rho_max=float(rb.max())
+    nT=thetas.size
+    Nrho=max(1, int(math.ceil((rho_max - rho_min) / rho_bin_m)) + 1)
+    flat=np.zeros(nT*Nrho, dtype=np.int64)
+    base=(np.arange(nT, dtype=np.int64)*Nrho)[None,:]
+    step=max(1, _HOUGH_CHUNK//max(nT,1))
+    for i in range(0, C.shape[0], step):
+        ridx=np.floor((C[i:i+step] @ cs - rho_min) / rho_bin_m).astype(np.int64)
+        np.clip(ridx, 0, Nrho-1, out=ridx)
+        ridx+=base
+        flat+=np.bincount(ridx.ravel(), minlength=flat.size)
+    return flat.reshape(nT, Nrho).astype(np.int32), rho_min
+
+def hough_peaks(A: np.ndarray, topk: int, min_votes: int) -> List[Tuple[int,int]]:
+    """
+    До topk пиков с числом голосов >= min_votes, от сильнейшего к слабому; вокруг
+    взятого пика окрестность _HOUGH_NMS подавляется. Порог отсекается векторно,
+    сортируются и обходятся только клетки выше него, а не весь аккумулятор.
+    """
+    Nrho=A.shape[1]
+    rt,rr=_HOUGH_NMS
+    flat=A.reshape(-1).astype(np.int64)
+    cand=np.flatnonzero(flat >= min_votes)
+    # при равных голосах первым идёт меньший плоский индекс (детерминированно)
+    cand=cand[np.argsort(-flat[cand], kind="stable")]
+    used=np.zeros_like(A, dtype=bool)
+    peaks=[]
+    for idx in cand:
+        if len(peaks) >= topk: break
+        ti=int(idx // Nrho); ri=int(idx % Nrho)
+        if used[ti, ri]: continue
+        peaks.append((ti, ri))
+        # глушим окрестность, чтобы не брать почти те же линии
+        used[max(0,ti-rt):ti+rt+1, max(0,ri-rr):ri+rr+1] = True
+    return peaks
+
 def detect_hough_bands(G: Grid2p5D, cand: np.ndarray,
                        theta_step_deg: float = 5.0,
                        rho_bin_m: float = 0.5,
@@ -109,77 +354,40 @@ def detect_hough_bands(G: Grid2p5D, cand: np.ndarray,
                          G.origin[1] + (ys + 0.5)*G.grid])
 
     thetas = np.deg2rad(np.arange(0.0, 180.0, theta_step_deg))
-    nT = len(thetas)
-
-    # диапазон rho
-    x_all = C[:,0]; y_all = C[:,1]
-    rho_min = +np.inf; rho_max = -np.inf
-    # оценим по всем углам сразу (консервативно по bbox)
-    bbox = np.array([[x_all.min(), y_all.min()],
-                     [x_all.min(), y_all.max()],
-                     [x_all.max(), y_all.min()],
-                     [x_all.max(), y_all.max()]])
-    for th in thetas:
-        c, s = math.cos(th), math.sin(th)
-        rhos = bbox @ np.array([c, s])
-        rho_min = min(rho_min, float(rhos.min()))
-        rho_max = max(rho_max, float(rhos.max()))
-    Nrho = max(1, int(math.ceil((rho_max - rho_min) / rho_bin_m)) + 1)
-
-    A = np.zeros((nT, Nrho), dtype=np.int32)  # аккумулятор
-    # накидываем голоса
-    for ti, th in enumerate(thetas):
-        c, s = math.cos(th), math.sin(th)
-        rho = C @ np.array([c, s])
-        ridx = np.floor((rho - rho_min) / rho_bin_m).astype(np.int32)
-        ridx = np.clip(ridx, 0, Nrho-1)
-        # каждый центр дает один голос
-        np.add.at(A[ti], ridx, 1)
-
-    # выбираем top-K пиков (без близких дублей)
-    peaks = []
-    flat_idx = np.argsort(A.ravel())[::-1]
-    used = np.zeros_like(A, dtype=bool)
-    for idx in flat_idx:
-        if len(peaks) >= topk:
-            break
-        ti = int(idx // Nrho); ri = int(idx % Nrho)
-        if used[ti, ri]: 
-            continue
-        if A[ti, ri] < max(20, int(0.25 * A.max())):
-            break
-        peaks.append((ti, ri))
-        # глушим окрестность, чтобы не брать почти те же линии
-        t0 = max(0, ti-1); t1 = min(nT, ti+2)
-        r0 = max(0, ri-3); r1 = min(Nrho, ri+4)
-        used[t0:t1, r0:r1] = True
+    A, rho_min = hough_accumulate(C, thetas, rho_bin_m)
 
+    # top-K пиков (без близких дублей)
+    peaks = hough_peaks(A, topk, max(20, int(0.25 * A.max())))
+    count("hough", peaks=len(peaks))
     band_mask = np.zeros_like(cand, dtype=bool)
     if not peaks:
         return band_mask
 
-    # для каждой линии собираем клетки в полосу нужной ширины и длины
-    for ti, ri in peaks:
-        th = float(thetas[ti]); c, s = math.cos(th), math.sin(th)
-        rho = rho_min + ri * rho_bin_m
-        n = np.array([c, s])                   # нормаль
-        u = np.array([-s, c])                  # вдоль линии
-        # расстояние от центров до линии
-        d = np.abs(C @ n - rho)
-        in_band = d <= (max_width_m/2.0)
-        if in_band.sum() < 30:
-            continue
-        t = C @ u
-        L = t[in_band].max() - t[in_band].min()
-        if L < min_len_m:
-            continue
-        # оценим фактическую ширину по 90-му процентилю
-        w_est = 2.0 * np.quantile(d[in_band], 0.9)
-        if not (min_width_m <= w_est <= max_width_m):
-            continue
-        # отметим клетки
-        idx_lin = ys*G.W + xs
-        band_mask.reshape(-1)[idx_lin[in_band]] = True
+    # все линии разом: столбец k матриц — k-я линия
+    ti = np.array([p[0] for p in peaks]); ri = np.array([p[1] for p in peaks])
+    th = thetas[ti]
+    n = np.stack([np.cos(th), np.sin(th)])      # нормали (2, K)
+    u = np.stack([-np.sin(th), np.cos(th)])     # вдоль линий (2, K)
+    rho = rho_min + ri * rho_bin_m
+    # расстояние от центров до линий и полосы нужной ширины
+    d = np.abs(C @ n - rho)
+    in_band = d <= (max_width_m/2.0)
+    nin = in_band.sum(axis=0)
+    ok = nin >= 30
+    if not ok.any():
+        return band_mask
+    t = C @ u
+    L = np.where(in_band, t, -np.inf).max(axis=0) - np.where(in_band, t, np.inf).min(axis=0)
+    ok &= L >= min_len_m
+    if ok.any():
+        # фактическая ширина по 90-му процентилю расстояний внутри полосы
+        w_est = np.full(len(peaks), np.nan)
+        w_est[ok] = 2.0 * np.nanquantile(np.where(in_band[:,ok], d[:,ok], np.nan), 0.9, axis=0)
+        ok &= (min_width_m <= w_est) & (w_est <= max_width_m)
+    # отметим клетки
+    count("hough", bands=np.count_nonzero(ok))
+    hit = in_band[:, ok].any(axis=1)
+    band_mask.reshape(-1)[(ys*G.W + xs)[hit]] = True
 
     if dilate_cells > 0:
         band_mask = binary_dilate(band_mask, dilate_cells)
@@ -197,6 +405,236 @@ def binary_dilate(mask, r):
             out[y0+dy:y1+dy, x0+dx:x1+dx] |= mask[y0:y1, x0:x1]
     return out
 
+# ---------- этапы: клетки -> удаляемые точки ----------
+def candidate_cells(G: Grid2p5D, z_ground: np.ndarray, h_min: float, h_max: float, density_min: int) -> np.ndarray:
+    dh = G.z_high - z_ground
+    valid = (~np.isnan(dh)) & (G.count >= density_min)
+    return valid & (dh >= h_min) & (dh <= h_max)
+
+def select_components(G: Grid2p5D, cand: np.ndarray, min_len: float, min_width: float,
+                      max_width: float, min_elong: float) -> Tuple[np.ndarray, int]:
+    """PCA-фильтр сразу по всем компонентам; возвращает (маска клеток, число компонент)."""
+    labels, ncomp = label_components(cand)
+    st = component_stats(labels, ncomp, G)
+    length = 2.0 * np.sqrt(np.maximum(st.evals[:,1], 1e-12))
+    width  = 2.0 * np.sqrt(np.maximum(st.evals[:,0], 1e-12))
+    ok = ((st.size >= 4) & (length >= min_len) &
+          (width >= min_width) & (width <= max_width) &
+          (length / np.maximum(width, 1e-6) >= min_elong))
+    return np.r_[False, ok][labels], int(ok.sum())
+
+def classify_cells(G: Grid2p5D, z_ground: np.ndarray,
+                   h_min: float=0.20, h_max: float=3.0,
+                   min_len: float=3.0, min_width: float=1.4, max_width: float=3.5,
+                   min_elong: float=2.2, density_min: int=5,
+                   use_hough: bool=False,
+                   hough_theta_step: float=5.0, hough_rho_bin: float=0.5, hough_topk: int=8,
+                   hough_min_len: float=8.0, hough_min_w: float=1.0, hough_max_w: float=4.5,
+                   hough_dilate: int=1) -> np.ndarray:
+    """Маска клеток, точки которых подлежат удалению (компоненты + опционально Hough-полосы)."""
+    with stage("components"):
+        cand = candidate_cells(G, z_ground, h_min, h_max, density_min)
+
+        # компонентная логика (как была)
+        keep, sel = select_components(G, cand, min_len, min_width, max_width, min_elong)
+    count("components", candidate_cells=np.count_nonzero(cand), components=sel, cells=np.count_nonzero(keep))
+    log(f"Компонент после фильтров (PCA): {sel}")
+
+    # НОВОЕ: Hough-полосы (добавляем к keep)
+    if use_hough:
+        with stage("hough"):
+            band_mask = detect_hough_bands(
+                G, cand,
+                theta_step_deg=hough_theta_step,
+                rho_bin_m=hough_rho_bin,
+                topk=hough_topk,
+                min_len_m=hough_min_len,
+                min_width_m=hough_min_w,
+                max_width_m=hough_max_w,
+                dilate_cells=hough_dilate
+            )
+        count("hough", cells=np.count_nonzero(band_mask))
+        log(f"Hough-полосы: клеток в маске = {int(band_mask.sum())}")
+        keep |= band_mask
+    return keep
+
+def removal_mask(C: Coords, cell: np.ndarray, keep: np.ndarray, z_ground: np.ndarray,
+                 h_min: float, h_max: float) -> np.ndarray:
+    """
+    Точки в отмеченных клетках с высотой над «землёй» в [h_min, h_max]. Считается
+    порциями по номерам клеток (cell_ids, -1 — вне сетки): кроме результата
+    массивов размера облака нет, высота — только у точек отмеченных клеток.
+    """
+    out = np.zeros(C.n, dtype=bool)
+    keep_f = keep.reshape(-1); zg_f = z_ground.reshape(-1)
+    for i,j in C.spans():
+        c = cell[i:j]
+        m = c >= 0
+        m[m] = keep_f[c[m]]
+        h = C.get(2, i, j, m)
+        h -= zg_f[c[m]]
+        # NaN (нет «земли» или z) не проходит ни одно сравнение
+        out[i:j][m] = (h >= h_min) & (h <= h_max)
+    return out
+
+# ---------- кэш промежуточных данных ----------
+# points.npy — точки облака (все поля); ground*.npz — сетка, сглаженная «земля»
+# и номера клеток точек для набора (grid, q_low, q_high, smooth_cells). Пороги h_*,
+# фильтры компонент и Hough их не меняют, поэтому при подборе порогов
+# пересчитываются только classify_cells и removal_mask.
+POINTS_CACHE="points.npy"
+
+def ground_cache_name(grid: float, q_low: float, q_high: float, smooth_cells: int) -> str:
+    # ground2: номера клеток cell_ids вместо пар ix, iy
+    return f"ground2_g{float(grid)!r}_ql{float(q_low)!r}_qh{float(q_high)!r}_s{int(smooth_cells)}.npz"
+
+def _cache_save(path: str, save):
+    """Запись через временный файл: кэш читают параллельные задачи."""
+    tmp=f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f: save(f)
+        os.replace(tmp, path)
+    except OSError as e:  # каталог вытеснен или диск полон — работаем без кэша
+        log(f"Кэш не записан ({path}): {e}")
+        try: os.remove(tmp)
+        except OSError: pass
+
+class _CacheTee:
+    """points.npy, записываемый порциями по мере чтения облака (через временный файл, как _cache_save)."""
+
+    def __init__(self, path: str, dtype: np.dtype, n: int):
+        self.path=path
+        self.tmp=f"{path}.{os.getpid()}.tmp"
+        self.f=None
+        try:
+            self.f=open(self.tmp, "wb")
+            np.lib.format.write_array_header_1_0(
+                self.f, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (n,)})
+        except OSError as e:
+            self._fail(e)
+
+    def _fail(self, e: OSError):
+        log(f"Кэш не записан ({self.path}): {e}")
+        self.close(False)
+
+    def write(self, part: np.ndarray):
+        if self.f is None: return
+        try: self.f.write(np.ascontiguousarray(part).tobytes())
+        except OSError as e: self._fail(e)
+
+    def close(self, ok: bool):
+        if self.f is None: return
+        f, self.f = self.f, None
+        try:
+            f.close()
+            if ok:
+                os.replace(self.tmp, self.path)
+                return
+        except OSError as e:
+            log(f"Кэш не записан ({self.path}): {e}")
+        try: os.remove(self.tmp)
+        except OSError: pass
+
+def _open_source(source: Source):
+    """Бинарный поток облака source как контекст."""
+    if callable(source): return source()
+    if isinstance(source, (str, os.PathLike)): return open(source, "rb")
+    return nullcontext(source)
+
+def _npy_chunks(f, chunk_points: int = 1<<20):
+    """(число точек, dtype, порции) массива кэша точек из потока, без отображения в память."""
+    version=np.lib.format.read_magic(f)
+    read=np.lib.format.read_array_header_1_0 if version==(1,0) else np.lib.format.read_array_header_2_0
+    shape, _, dtype=read(f)
+    n=int(shape[0])
+    def chunks():
+        for i in range(0, n, chunk_points):
+            part=np.fromfile(f, dtype=dtype, count=min(chunk_points, n-i))
+            if part.shape[0]==0: return
+            yield part
+    return n, dtype, chunks()
+
+def cached_points(source: Source, cache_dir: str | None) -> np.ndarray:
+    """Точки облака структурным массивом со всеми полями PCD (из кэша, если есть)."""
+    path=os.path.join(cache_dir, POINTS_CACHE) if cache_dir else None
+    if path and os.path.exists(path):
+        log(f"Точки из кэша: {path}")
+        return as_records(np.load(path, mmap_mode="r"))
+    if callable(source):
+        log("Чтение из потока")
+        with source() as f: rec=read_pcd(f)
+    else:
+        log(f"Чтение: {source}")
+        rec=read_pcd(source)
+    if rec.shape[0]==0: raise RuntimeError("Пустое облако")
+    if path: _cache_save(path, lambda f: np.save(f, rec))
+    return rec
+
+def cached_coords(source: Source, cache_dir: str | None, quantum: float | None = None) -> Coords:
+    """
+    Только координаты облака (coords.Coords; остальные поля в памяти не
+    держатся), порциями из кэша точек или из source — тогда кэш пишется попутно.
+    """
+    path=os.path.join(cache_dir, POINTS_CACHE) if cache_dir else None
+    if path and os.path.exists(path):
+        log(f"Координаты из кэша: {path}")
+        with open(path, "rb") as f:
+            n, dtype, chunks=_npy_chunks(f)
+            return read_coords(n, dtype, chunks, quantum)
+    log("Чтение координат из потока" if callable(source) else f"Чтение координат: {source}")
+    with _open_source(source) as f:
+        hdr, chunks=iter_records(f)
+        if hdr.points==0: raise RuntimeError("Пустое облако")
+        tee=_CacheTee(path, hdr.dtype, hdr.points) if path else None
+        C=None
+        try:
+            C=read_coords(hdr.points, hdr.dtype, (tee.write(p) or p for p in chunks) if tee else chunks, quantum)
+        finally:
+            if tee: tee.close(C is not None and C.n==hdr.points)
+    return C
+
+def load_ground(path: str):
+    """(G, z_ground, cell) из файла кэша ground*.npz."""
+    with np.load(path) as d:
+        G=Grid2p5D(float(d["grid"]), (float(d["origin"][0]), float(d["origin"][1])),
+                   int(d["W"]), int(d["H"]), d["z_low"], d["z_high"], d["count"])
+        return G, d["z_ground"], d["cell"]
+
+def save_ground(path: str, G: Grid2p5D, z_ground: np.ndarray, cell: np.ndarray):
+    _cache_save(path, lambda f: np.savez(
+        f, grid=G.grid, origin=np.asarray(G.origin), W=G.W, H=G.H,
+        z_low=G.z_low, z_high=G.z_high, count=G.count, z_ground=z_ground, cell=cell))
+
+def grid_cells(C: Coords, grid: float, q_low: float, q_high: float):
+    """2.5D сетка и номера клеток точек (G, cell): клетка точки считается один раз и идёт в removal_mask."""
+    log("Строим 2.5D сетку…")
+    with stage("grid"):
+        mn,mx=C.bounds(); origin=(mn[0],mn[1])
+        W,H=grid_shape(mn, mx, grid)
+        cell=cell_ids(C, origin, grid, W, H)
+        G=grid_from_ids(C, cell, grid, origin, W, H, q_low, q_high)
+    count("grid", points=C.n, cells=W*H, occupied_cells=np.count_nonzero(G.count))
+    return G, cell
+
+def ground_cache_path(cache_dir: str | None, grid: float, q_low: float, q_high: float, smooth_cells: int) -> str | None:
+    return os.path.join(cache_dir, ground_cache_name(grid, q_low, q_high, smooth_cells)) if cache_dir else None
+
+def cached_ground(C: Coords, grid: float, q_low: float, q_high: float, smooth_cells: int,
+                  cache_dir: str | None):
+    """(G, z_ground, cell) — из кэша или посчитанные заново."""
+    path=ground_cache_path(cache_dir, grid, q_low, q_high, smooth_cells)
+    if path and os.path.exists(path):
+        log(f"Сетка из кэша: {path}")
+        with stage("ground_cache"):
+            return load_ground(path)
+    G, cell = grid_cells(C, grid, q_low, q_high)
+    with stage("ground"):
+        z_ground=nanmean_filter(G.z_low, radius=smooth_cells)
+    if path:
+        with stage("ground_cache"):
+            save_ground(path, G, z_ground, cell)
+    return G, z_ground, cell
+
 # ---------- основной процесс ----------
 def process(in_path: str, out_path: str,
             grid: float=0.35, q_low: float=0.02, q_high: float=0.90,
@@ -209,138 +647,277 @@ def process(in_path: str, out_path: str,
             hough_min_len: float=8.0, hough_min_w: float=1.0, hough_max_w: float=4.5,
             hough_dilate: int=1,
             debug_dump: bool=False,
-            delta_out_path: str | None = None):
+            delta_out_path: str | None = None,
+            memory_budget_mb: float | None = None,
+            tile_halo: float | None = None,
+            workers: int = 1,
+            progress: Progress | None = None,
+            cache_dir: str | None = None,
+            coord_quantum: float | None = None):
 
-    log(f"Чтение: {in_path}")
-    pcd=o3d.io.read_point_cloud(in_path)
-    if len(pcd.points)==0: raise RuntimeError("Пустое облако")
     if os.path.isdir(out_path): out_path=os.path.join(out_path,"cleaned.pcd")
     if not out_path.lower().endswith(".pcd"): out_path=out_path+".pcd"
-    P=to_np(pcd)
-
-    # 1) карта низов/верхов и dh
-    log("Строим 2.5D сетку…")
-    G=build_grid(P, grid=grid, q_low=q_low, q_high=q_high)
-    z_ground = nanmean_filter(G.z_low, radius=smooth_cells)
-    dh = G.z_high - z_ground
-
-    valid = (~np.isnan(dh)) & (G.count >= density_min)
-    cand = valid & (dh >= h_min) & (dh <= h_max)
-
-    # 2) компонентная логика (как была)
-    comps = connected_components(cand)
-    keep = np.zeros_like(cand, dtype=bool)
-    sel = 0
-    for comp in comps:
-        if comp.size < 4:
-            continue
-        ys = comp // G.W; xs = comp % G.W
-        X = np.column_stack([G.origin[0] + (xs + 0.5)*G.grid,
-                             G.origin[1] + (ys + 0.5)*G.grid])
-        mu = X.mean(axis=0)
-        C = np.cov((X - mu).T)
-        evals, _ = np.linalg.eigh(C)           # λ1<=λ2
-        lam1, lam2 = float(evals[0]), float(evals[1])
-        length = 2.0 * math.sqrt(max(lam2, 1e-12))
-        width  = 2.0 * math.sqrt(max(lam1, 1e-12))
-        if length < min_len:            continue
-        if width  < min_width:          continue
-        if width  > max_width:          continue
-        if (length / max(width,1e-6)) < min_elong: continue
-        keep.reshape(-1)[comp] = True
-        sel += 1
-    log(f"Компонент после фильтров (PCA): {sel}")
-
-    # 3) НОВОЕ: Hough-полосы (добавляем к keep)
-    if use_hough:
-        band_mask = detect_hough_bands(
-            G, cand,
-            theta_step_deg=hough_theta_step,
-            rho_bin_m=hough_rho_bin,
-            topk=hough_topk,
-            min_len_m=hough_min_len,
-            min_width_m=hough_min_w,
-            max_width_m=hough_max_w,
-            dilate_cells=hough_dilate
-        )
-        log(f"Hough-полосы: клеток в маске = {int(band_mask.sum())}")
-        keep |= band_mask
-
-    # 4) перенос на точки и удаление
-    ix,iy,valid_pts = xy_to_cell(P[:,:2], G.origin, G.grid, G.W, G.H)
-    inside_cells = np.zeros(P.shape[0], dtype=bool)
-    m = valid_pts & keep[iy, ix]
-    inside_cells[m] = True
+    cell_params = dict(
+        h_min=h_min, h_max=h_max,
+        min_len=min_len, min_width=min_width, max_width=max_width,
+        min_elong=min_elong, density_min=density_min,
+        use_hough=use_hough,
+        hough_theta_step=hough_theta_step, hough_rho_bin=hough_rho_bin, hough_topk=hough_topk,
+        hough_min_len=hough_min_len, hough_min_w=hough_min_w, hough_max_w=hough_max_w,
+        hough_dilate=hough_dilate)
+    extra = {}
+
+    with profiled():
+        if memory_budget_mb:
+            # тайловый режим: облако не загружается целиком
+            try:
+                from .tiling import process_tiled
+            except ImportError:  # запуск как скрипта
+                from tiling import process_tiled
+            if debug_dump:
+                log("debug_dump в тайловом режиме не поддерживается")
+            if coord_quantum:
+                log("coord_quantum в тайловом режиме не используется")
+            input_points, removed, extra = process_tiled(
+                in_path, out_path, delta_out_path,
+                grid=grid, q_low=q_low, q_high=q_high, smooth_cells=smooth_cells,
+                memory_budget_mb=memory_budget_mb, tile_halo=tile_halo, workers=workers,
+                progress=progress, **cell_params)
+        else:
+            input_points, removed, extra = _process_in_memory(
+                in_path, out_path, delta_out_path,
+                grid=grid, q_low=q_low, q_high=q_high, smooth_cells=smooth_cells,
+                debug_dump=debug_dump, workers=workers, tile_halo=tile_halo,
+                progress=progress, cache_dir=cache_dir, coord_quantum=coord_quantum, **cell_params)
+
+        summary = _summary(input_points, removed, extra, grid=grid, q_low=q_low, q_high=q_high,
+                           smooth_cells=smooth_cells, **cell_params)
+    with open(os.path.splitext(out_path)[0]+"_summary.json","w",encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    report(progress, 1.0, "done")
+    return summary
 
-    z_ground_pt = np.full(P.shape[0], np.nan, dtype=np.float64)
-    z_ground_pt[valid_pts] = z_ground[iy[valid_pts], ix[valid_pts]]
-    h_pt = P[:,2] - z_ground_pt
-    h_ok = (~np.isnan(h_pt)) & (h_pt >= h_min) & (h_pt <= h_max)
+def _summary(input_points: int, removed: int, extra: dict, **params) -> dict:
+    p=params
+    return {
+        "input_points": input_points,
+        "removed_points": removed,
+        "grid": p["grid"], "q_low": p["q_low"], "q_high": p["q_high"],
+        "smooth_cells": p["smooth_cells"],
+        "h_min": p["h_min"], "h_max": p["h_max"],
+        "min_len": p["min_len"], "min_width": p["min_width"], "max_width": p["max_width"],
+        "min_elong": p["min_elong"], "density_min": p["density_min"],
+        "hough_used": bool(p["use_hough"]),
+        "hough_theta_step": p["hough_theta_step"],
+        "hough_rho_bin": p["hough_rho_bin"],
+        "hough_topk": p["hough_topk"],
+        "hough_min_len": p["hough_min_len"],
+        "hough_min_w": p["hough_min_w"],
+        "hough_max_w": p["hough_max_w"],
+        "peak_rss_mb": peak_rss_mb(),
+        # время, память и счётчики этапов (profiling.py)
+        "stages": stages(),
+        **extra
+    }
 
-    del_mask = inside_cells & h_ok
+def clean_mask(source: Source,
+               grid: float=0.35, q_low: float=0.02, q_high: float=0.90,
+               smooth_cells: int=7,
+               h_min: float=0.20, h_max: float=3.0,
+               min_len: float=3.0, min_width: float=1.4, max_width: float=3.5,
+               min_elong: float=2.2, density_min: int=5,
+               use_hough: bool=False,
+               hough_theta_step: float=5.0, hough_rho_bin: float=0.5, hough_topk: int=8,
+               hough_min_len: float=8.0, hough_min_w: float=1.0, hough_max_w: float=4.5,
+               hough_dilate: int=1,
+               tile_halo: float | None = None,
+               workers: int = 1,
+               progress: Progress | None = None,
+               cache_dir: str | None = None,
+               coord_quantum: float | None = None,
+               records: bool = True,
+               prev_state=None,
+               return_state: bool = False) -> Tuple[Union[np.ndarray, Coords], np.ndarray, dict]:
+    """
+    Как clean, но без копий: (rec, drop, summary) — все точки source, маска
+    точек, не попадающих в cleaned (удалённые и не-финитные), и сводка.
+    records=False — вместо rec только координаты (Coords): прочие поля не
+    загружаются, память — около 17 байт на точку. coord_quantum — шаг
+    int32-квантования координат, м (см. coords.py).
+
+    return_state — четвёртым элементом вернуть состояние очистки для
+    инкрементальной переочистки (incremental.CleanState; None при workers>1);
+    prev_state — состояние прежней версии облака: квантильная сетка
+    пересчитывается только в изменившихся тайлах (если это невозможно — целиком).
+    """
+    cell_params = dict(
+        h_min=h_min, h_max=h_max,
+        min_len=min_len, min_width=min_width, max_width=max_width,
+        min_elong=min_elong, density_min=density_min,
+        use_hough=use_hough,
+        hough_theta_step=hough_theta_step, hough_rho_bin=hough_rho_bin, hough_topk=hough_topk,
+        hough_min_len=hough_min_len, hough_min_w=hough_min_w, hough_max_w=hough_max_w,
+        hough_dilate=hough_dilate)
+    with profiled():
+        rec, C, del_mask, extra, _, state = _removal(source, grid, q_low, q_high, smooth_cells, workers, tile_halo,
+                                                     progress, cache_dir, coord_quantum, records,
+                                                     prev_state, return_state, **cell_params)
+        removed = int(del_mask.sum())
+        log(f"К удалению намечено точек: {removed}")
+        nonfinite = _drop_nonfinite(C, del_mask)
+        if nonfinite:
+            log(f"Предупреждение: удаляем не-финитные точки: {nonfinite}")
+        summary = _summary(C.n, removed, extra, grid=grid, q_low=q_low, q_high=q_high,
+                           smooth_cells=smooth_cells, **cell_params)
+    report(progress, 1.0, "done")
+    if return_state:
+        return (rec if records else C), del_mask, summary, state
+    return (rec if records else C), del_mask, summary
+
+def _drop_nonfinite(C: Coords, mask: np.ndarray) -> int:
+    """Отметить в mask (на месте) точки с не-финитными координатами; возвращает их число."""
+    n=0
+    for i,j in C.spans():
+        bad=~C.finite(i,j)
+        n+=int(np.count_nonzero(bad))
+        mask[i:j]|=bad
+    return n
+
+def clean(source: Source, **kw) -> Tuple[np.ndarray, np.ndarray, dict]:
+    """
+    process без файлов: облако из source (параметры — как у clean_mask),
+    результат в памяти. Возвращает (cleaned, delta, summary) — структурные
+    массивы точек (delta может быть пустым) и ту же сводку, что process.
+    """
+    rec, drop, summary = clean_mask(source, **kw)
+    # в drop и не-финитные точки, в delta их нет (как в process)
+    return rec[~drop], rec[drop & from_records(rec).finite()], summary
+
+def _removal(source: Source, grid: float, q_low: float, q_high: float, smooth_cells: int,
+             workers: int, tile_halo: float | None, progress: Progress | None, cache_dir: str | None,
+             coord_quantum: float | None = None, records: bool = True,
+             prev_state=None, return_state: bool = False, **cell_params):
+    """
+    (rec, C, del_mask, extra, (G, keep, z_ground), state) — точки, их координаты
+    и маска удаления; rec — None при records=False, G и др. — только при
+    workers=1. state — CleanState (incremental.py) при return_state и
+    workers=1; с prev_state сетка пересчитывается только в изменившихся тайлах.
+    """
+    report(progress, 0.0, "read")
+    with stage("read"):
+        if records:
+            rec=cached_points(source, cache_dir)
+            C=from_records(rec, coord_quantum)
+        else:
+            rec=None
+            C=cached_coords(source, cache_dir, coord_quantum)
+    count("read", points=C.n)
+    log(f"Координаты: {C.n} точек, {C.nbytes/2**20:.1f} МБ")
+    h_min=cell_params["h_min"]; h_max=cell_params["h_max"]
+    extra={}
+    state=None
+
+    if workers>1:
+        # 1-4) по тайлам в пуле процессов
+        try:
+            from .parallel import clean_points_parallel
+        except ImportError:  # запуск как скрипта
+            from parallel import clean_points_parallel
+        with stage("tiles"):
+            del_mask, extra = clean_points_parallel(C, grid, q_low, q_high, smooth_cells, workers,
+                                                    tile_halo=tile_halo, progress=progress, **cell_params)
+        count("tiles", tiles=extra["tiles"])
+        G = keep = z_ground = None
+    else:
+        if prev_state is not None or return_state:
+            try:
+                from .incremental import clean_state, reclean
+            except ImportError:  # запуск как скрипта
+                from incremental import clean_state, reclean
+        # 1) карта низов/верхов и клетки точек; с prev_state — сетка прежней версии
+        # облака, пересчитанная только в изменившихся тайлах (incremental.py)
+        report(progress, 0.15, "grid")
+        path = ground_cache_path(cache_dir, grid, q_low, q_high, smooth_cells)
+        inc = None
+        if prev_state is not None and not (path and os.path.exists(path)):
+            inc = reclean(C, prev_state, grid, q_low, q_high)
+        if inc is not None:
+            G, cell, state, inc_extra = inc
+            extra.update(inc_extra)
+            with stage("ground"):
+                z_ground = nanmean_filter(G.z_low, radius=smooth_cells)
+            if path:
+                with stage("ground_cache"):
+                    save_ground(path, G, z_ground, cell)
+        else:
+            G, z_ground, cell = cached_ground(C, grid, q_low, q_high, smooth_cells, cache_dir)
+
+        # 2-3) компоненты и Hough-полосы
+        report(progress, 0.4, "cells")
+        keep = classify_cells(G, z_ground, **cell_params)
+
+        # 4) перенос на точки и удаление
+        report(progress, 0.6, "mask")
+        with stage("mask"):
+            del_mask = removal_mask(C, cell, keep, z_ground, h_min, h_max)
+        if return_state and state is None:
+            with stage("state"):
+                state = clean_state(C, cell, G, q_low, q_high)
+        del cell
+    count("mask", removed=np.count_nonzero(del_mask))
+    return rec, C, del_mask, extra, (G, keep, z_ground), state
+
+def _process_in_memory(in_path: str, out_path: str, delta_out_path: str | None,
+                       grid: float, q_low: float, q_high: float, smooth_cells: int,
+                       debug_dump: bool, workers: int = 1, tile_halo: float | None = None,
+                       progress: Progress | None = None, cache_dir: str | None = None,
+                       coord_quantum: float | None = None, **cell_params) -> Tuple[int,int,dict]:
+    rec, C, del_mask, extra, (G, keep, z_ground), _ = _removal(
+        in_path, grid, q_low, q_high, smooth_cells, workers, tile_halo, progress, cache_dir,
+        coord_quantum, **cell_params)
     removed = int(del_mask.sum())
     log(f"К удалению намечено точек: {removed}")
 
-    static_pts = P[~del_mask]
-    removed_pts = P[del_mask]
-    # безопасное сохранение: фильтруем NaN/Inf; PLY-фолбэк при необходимости
-    finite = np.isfinite(static_pts).all(axis=1)
-    if not finite.all():
-        log(f"Предупреждение: удаляем не-финитные точки: {(~finite).sum()}")
-        static_pts = static_pts[finite]
-    # Write binary (optionally compressed) PCD to reduce file size
-    ok = o3d.io.write_point_cloud(out_path, from_np(static_pts), write_ascii=False, compressed=True)
-    if not ok:
-        alt = os.path.splitext(out_path)[0]+".ply"
-        log("PCD не записался, сохраняю как PLY…")
-        o3d.io.write_point_cloud(alt, from_np(static_pts), write_ascii=True)
-        log(f"Сохранено: {alt}")
-    else:
+    report(progress, 0.7, "write")
+    with stage("write"):
+        # не-финитные точки в cleaned не пишем; в delta их нет (высота NaN не проходит h_ok)
+        drop = del_mask.copy()
+        nonfinite = _drop_nonfinite(C, drop)
+        if nonfinite:
+            log(f"Предупреждение: удаляем не-финитные точки: {nonfinite}")
+        # все поля исходного облака (intensity, ring, ...) сохраняются; пишется выборка из rec без копии
+        np.logical_not(drop, out=drop)
+        write_pcd(out_path, rec, select=drop)
+        kept = int(np.count_nonzero(drop))
+        del drop
         log(f"Сохранение: {out_path}")
 
-    # Always write delta if requested
-    if delta_out_path is not None:
-        try:
-            if removed_pts.size > 0:
-                o3d.io.write_point_cloud(delta_out_path, from_np(removed_pts), write_ascii=False, compressed=True)
-        except Exception as e:
-            log(f"Не удалось записать delta: {e}")
+        # Always write delta if requested
+        if delta_out_path is not None and removed > 0:
+            try:
+                write_pcd(delta_out_path, rec, select=del_mask)
+            except Exception as e:
+                log(f"Не удалось записать delta: {e}")
+    count("write", points=kept + (removed if delta_out_path is not None else 0))
 
     if debug_dump:
         base=os.path.splitext(out_path)[0]
-        try: o3d.io.write_point_cloud(base+"_removed.pcd", from_np(P[del_mask]))
-        except: pass
-        ys, xs = np.where(keep)
+        try: write_pcd(base+"_removed.pcd", rec, data="binary", select=del_mask)
+        except Exception: pass
+        ys, xs = np.where(keep) if keep is not None else (np.zeros(0), np.zeros(0))
         if ys.size>0:
             centers = np.column_stack([G.origin[0] + (xs + 0.5)*G.grid,
                                        G.origin[1] + (ys + 0.5)*G.grid,
-                                       np.full(xs.shape[0], float(np.nanmean(z_ground)))])
-            try: o3d.io.write_point_cloud(base+"_keepcells_centers.pcd", from_np(centers))
-            except: pass
+                                       np.full(xs.shape[0], float(np.nanmean(z_ground)))]).astype(np.float32)
+            try: write_pcd(base+"_keepcells_centers.pcd", centers, data="binary")
+            except Exception: pass
 
-    summary = {
-        "input_points": int(P.shape[0]),
-        "removed_points": removed,
-        "grid": grid, "q_low": q_low, "q_high": q_high,
-        "smooth_cells": smooth_cells,
-        "h_min": h_min, "h_max": h_max,
-        "min_len": min_len, "min_width": min_width, "max_width": max_width,
-        "min_elong": min_elong, "density_min": density_min,
-        "hough_used": bool(use_hough),
-        "hough_theta_step": hough_theta_step,
-        "hough_rho_bin": hough_rho_bin,
-        "hough_topk": hough_topk,
-        "hough_min_len": hough_min_len,
-        "hough_min_w": hough_min_w,
-        "hough_max_w": hough_max_w
-    }
-    with open(os.path.splitext(out_path)[0]+"_summary.json","w",encoding="utf-8") as f:
-        json.dump(summary, f, ensure_ascii=False, indent=2)
-    return summary
+    return C.n, removed, extra
 
 def main():
     ap=argparse.ArgumentParser(description="2.5D + Hough-полосы для удаления длинных лент")
-    ap.add_argument("--in",  required=True, dest="in_path")
+    ap.add_argument("--in",  required=True, dest="in_path",
+                    help="файл .pcd; glob-шаблон или каталог — пакетная очистка (--out — каталог)")
     ap.add_argument("--out", required=True, dest="out_path")
     ap.add_argument("--grid", type=float, default=0.35)
     ap.add_argument("--q_low", type=float, default=0.02)
@@ -362,23 +939,59 @@ def main():
     ap.add_argument("--hough_max_w", type=float, default=4.5)
     ap.add_argument("--hough_dilate", type=int, default=1)
     ap.add_argument("--debug_dump", action="store_true")
+    ap.add_argument("--memory_budget_mb", type=float, default=None,
+                    help="тайловый режим с ограничением памяти (МБ); по умолчанию облако грузится целиком")
+    ap.add_argument("--tile_halo", type=float, default=None,
+                    help="ширина перекрытия тайлов (м) сверх smooth_cells; по умолчанию по размерам объектов")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="число процессов; при >1 облако обрабатывается по тайлам параллельно")
+    ap.add_argument("--cache_dir", default=None,
+                    help="каталог кэша точек и 2.5D сетки для повторных запусков с другими порогами")
+    ap.add_argument("--coord_quantum", type=float, default=None,
+                    help="шаг квантования координат в int32, м (например 0.001); по умолчанию координаты как в файле")
+    ap.add_argument("--profile_dir", default=None,
+                    help="каталог для снимков cProfile и tracemalloc запуска (замедляет расчёт)")
+    ap.add_argument("--jobs", type=int, default=2,
+                    help="пакетная очистка: файлов одновременно (процессов)")
     args=ap.parse_args()
 
-    process(args.in_path, args.out_path,
-            grid=args.grid, q_low=args.q_low, q_high=args.q_high,
-            smooth_cells=args.smooth_cells,
-            h_min=args.h_min, h_max=args.h_max,
-            min_len=args.min_len, min_width=args.min_width, max_width=args.max_width,
-            min_elong=args.min_elong, density_min=args.density_min,
-            use_hough=args.use_hough,
-            hough_theta_step=args.hough_theta_step,
-            hough_rho_bin=args.hough_rho_bin,
-            hough_topk=args.hough_topk,
-            hough_min_len=args.hough_min_len,
-            hough_min_w=args.hough_min_w,
-            hough_max_w=args.hough_max_w,
-            hough_dilate=args.hough_dilate,
-            debug_dump=args.debug_dump)
+    name=os.path.splitext(os.path.basename(args.out_path))[0] or "clean"
+    with dump_profile(args.profile_dir, name):
+        _main(args)
+
+def _main(args):
+    params=dict(grid=args.grid, q_low=args.q_low, q_high=args.q_high,
+                smooth_cells=args.smooth_cells,
+                h_min=args.h_min, h_max=args.h_max,
+                min_len=args.min_len, min_width=args.min_width, max_width=args.max_width,
+                min_elong=args.min_elong, density_min=args.density_min,
+                use_hough=args.use_hough,
+                hough_theta_step=args.hough_theta_step,
+                hough_rho_bin=args.hough_rho_bin,
+                hough_topk=args.hough_topk,
+                hough_min_len=args.hough_min_len,
+                hough_min_w=args.hough_min_w,
+                hough_max_w=args.hough_max_w,
+                hough_dilate=args.hough_dilate,
+                debug_dump=args.debug_dump,
+                memory_budget_mb=args.memory_budget_mb,
+                tile_halo=args.tile_halo,
+                workers=args.workers,
+                cache_dir=args.cache_dir,
+                coord_quantum=args.coord_quantum)
+    if glob.has_magic(args.in_path) or os.path.isdir(args.in_path):
+        try:
+            from .batch import batch_paths, process_batch
+        except ImportError:  # запуск как скрипта
+            from batch import batch_paths, process_batch
+        paths=batch_paths(args.in_path)
+        if not paths:
+            sys.exit(f"нет файлов .pcd: {args.in_path}")
+        result=process_batch(paths, args.out_path, jobs=args.jobs, **params)
+        with open(os.path.join(args.out_path, "batch_summary.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    else:
+        process(args.in_path, args.out_path, **params)
 
 if __name__=="__main__":
     main()
\ No newline at end of file
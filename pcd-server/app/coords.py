@@ -0,0 +1,152 @@
+"""
+Координаты облака для очистки в памяти без копии (N,3) float64.
+
+Coords держит три столбца x y z: срезы полей структурного массива точек (без
+копии, обычно float32), отдельные массивы в типе полей файла или, с шагом
+квантования quantum, int32-смещения от локального начала — 12 байт на точку
+при любой разрядности полей, ошибка не больше quantum/2. Вычисления идут
+порциями по CHUNK точек в float64, так что временные массивы не растут с
+облаком.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Tuple
+import numpy as np
+
+# порция точек для поэлементных расчётов
+CHUNK = 1 << 20
+# не-финитная координата в int32-смещениях
+_NAN_Q = np.iinfo(np.int32).min
+_AXES = ("x", "y", "z")
+
+
+@dataclass
+class Coords:
+    cols: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    origin: Tuple[float, float, float] = (0.0, 0.0, 0.0)
+    quantum: Optional[float] = None     # шаг int32-смещений; None — столбцы в плавающей точке
+
+    @classmethod
+    def of(cls, P: np.ndarray) -> "Coords":
+        """Столбцы массива (N,3) без копии."""
+        return cls((P[:, 0], P[:, 1], P[:, 2]))
+
+    @property
+    def n(self) -> int:
+        return int(self.cols[0].shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        """Байт под координаты (у срезов полей — их доля в структурном массиве)."""
+        return sum(c.dtype.itemsize for c in self.cols) * self.n
+
+    def spans(self, chunk: int = CHUNK) -> Iterator[Tuple[int, int]]:
+        """Границы порций [i, j)."""
+        return ((i, min(i + chunk, self.n)) for i in range(0, self.n, chunk))
+
+    def get(self, k: int, i: int = 0, j: Optional[int] = None, select: Optional[np.ndarray] = None) -> np.ndarray:
+        """Столбец k (0 — x, 1 — y, 2 — z) точек [i, j) в float64; select — маска среди них."""
+        c = self.cols[k][i:j]
+        if select is not None:
+            c = c[select]
+        if self.quantum is None:
+            return c.astype(np.float64)
+        out = c * self.quantum
+        out += self.origin[k]
+        out[c == _NAN_Q] = np.nan
+        return out
+
+    def xyz(self, i: int = 0, j: Optional[int] = None, select: Optional[np.ndarray] = None) -> np.ndarray:
+        """Точки [i, j) как (n,3) float64."""
+        return np.column_stack([self.get(k, i, j, select) for k in range(3)])
+
+    def finite(self, i: int = 0, j: Optional[int] = None) -> np.ndarray:
+        """Маска точек [i, j) с конечными x y z."""
+        if self.quantum is not None:
+            ok = self.cols[0][i:j] != _NAN_Q
+            ok &= self.cols[1][i:j] != _NAN_Q
+            ok &= self.cols[2][i:j] != _NAN_Q
+            return ok
+        ok = np.isfinite(self.cols[0][i:j])
+        ok &= np.isfinite(self.cols[1][i:j])
+        ok &= np.isfinite(self.cols[2][i:j])
+        return ok
+
+    def bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(min, max) по x и y среди точек с конечными x, y (NaN, если таких нет)."""
+        mn = np.full(2, np.nan); mx = np.full(2, np.nan)
+        for i, j in self.spans():
+            x = self.get(0, i, j); y = self.get(1, i, j)
+            ok = np.isfinite(x) & np.isfinite(y)
+            if not ok.any():
+                continue
+            mn = np.fmin(mn, [x[ok].min(), y[ok].min()])
+            mx = np.fmax(mx, [x[ok].max(), y[ok].max()])
+        return mn, mx
+
+
+class _Quantizer:
+    """Заполнение int32-смещений порциями; начало — минимум первой порции с конечными точками."""
+
+    def __init__(self, n: int, quantum: float):
+        self.quantum = float(quantum)
+        self.origin: Optional[np.ndarray] = None
+        self.cols = tuple(np.empty(n, dtype=np.int32) for _ in _AXES)
+
+    def put(self, i: int, xyz: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        vals = [np.asarray(v, dtype=np.float64) for v in xyz]
+        ok = np.isfinite(vals[0]) & np.isfinite(vals[1]) & np.isfinite(vals[2])
+        if self.origin is None and ok.any():
+            self.origin = np.array([np.floor(v[ok].min() / self.quantum) * self.quantum for v in vals])
+        for k, v in enumerate(vals):
+            q = np.rint((v - (0.0 if self.origin is None else self.origin[k])) / self.quantum)
+            q[~ok] = 0
+            if q.size and np.abs(q).max() >= -_NAN_Q:
+                raise ValueError(f"шаг квантования {self.quantum} м мал для протяжённости облака")
+            c = q.astype(np.int32)
+            c[~ok] = _NAN_Q
+            self.cols[k][i:i + c.shape[0]] = c
+
+    def coords(self) -> Coords:
+        origin = (0.0, 0.0, 0.0) if self.origin is None else tuple(float(o) for o in self.origin)
+        return Coords(self.cols, origin, self.quantum)
+
+
+def from_records(rec: np.ndarray, quantum: Optional[float] = None) -> Coords:
+    """Координаты структурного массива: срезы полей без копии или, с quantum, int32-смещения."""
+    for k in _AXES:
+        if k not in (rec.dtype.names or ()):
+            raise ValueError(f"в облаке нет поля {k}")
+    if quantum is None:
+        return Coords(tuple(rec[k] for k in _AXES))
+    q = _Quantizer(rec.shape[0], quantum)
+    for i in range(0, rec.shape[0], CHUNK):
+        part = rec[i:i + CHUNK]
+        q.put(i, tuple(part[k] for k in _AXES))
+    return q.coords()
+
+
+def read_coords(n: int, dtype: np.dtype, chunks: Iterable[np.ndarray], quantum: Optional[float] = None) -> Coords:
+    """
+    Координаты n точек из порций (pcd_io.iter_records): в памяти остаются
+    только столбцы x y z — в типе полей файла или int32-смещения с шагом quantum.
+    """
+    for k in _AXES:
+        if k not in (dtype.names or ()):
+            raise ValueError(f"в облаке нет поля {k}")
+    q = _Quantizer(n, quantum) if quantum is not None else None
+    cols = None if q is not None else tuple(np.empty(n, dtype=dtype.fields[k][0]) for k in _AXES)
+    i = 0
+    for part in chunks:
+        m = part.shape[0]
+        if q is not None:
+            q.put(i, tuple(part[k] for k in _AXES))
+        else:
+            for c, k in zip(cols, _AXES):
+                c[i:i + m] = part[k]
+        i += m
+    # ascii может оборваться раньше заголовка — как read_pcd, берём прочитанное
+    out = q.coords() if q is not None else Coords(cols)
+    if i < n:
+        out.cols = tuple(c[:i] for c in out.cols)
+    return out
@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+from .settings import Settings
+
+# соединений в простое на процесс и базу; лишние при возврате закрываются
+POOL_IDLE = 8
+
+_pools: Dict[Tuple[int, str], List["PooledConnection"]] = {}
+_pools_lock = threading.Lock()
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Соединение из пула get_db: close() откатывает незавершённую транзакцию и
+    возвращает соединение в пул процесса вместо закрытия. Пользоваться им,
+    как и раньше, может только один поток за раз.
+    """
+    _pool_key: Tuple[int, str]
+    _idle = False
+
+    def close(self):
+        if self._idle:
+            return
+        if self.in_transaction:
+            self.rollback()
+        with _pools_lock:
+            idle = _pools.setdefault(self._pool_key, [])
+            if len(idle) < POOL_IDLE:
+                self._idle = True
+                idle.append(self)
+                return
+        super().close()
+
+
+def get_db(settings: Settings):
+    """Соединение с базой метаданных из пула процесса (после работы — close())."""
+    key = (os.getpid(), settings.sqlite_path)
+    with _pools_lock:
+        idle = _pools.get(key)
+        if idle:
+            con = idle.pop()
+            con._idle = False
+            return con
+    # timeout: задачи очистки пишут прогресс из отдельных процессов
+    con = sqlite3.connect(settings.sqlite_path, timeout=30, factory=PooledConnection, check_same_thread=False)
+    con._pool_key = key
+    con.row_factory = sqlite3.Row
+    # в режиме WAL (см. init_db) синхронизации при commit достаточно NORMAL
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
+def _add_column(con, table: str, column: str, decl: str):
+    """Миграция таблиц, созданных до появления столбца."""
+    if column not in {c["name"] for c in con.execute(f"PRAGMA table_info({table})")}:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _drop_not_null(con, table: str, column: str):
+    """Миграция: снять NOT NULL со столбца (SQLite умеет это только пересозданием таблицы)."""
+    row = con.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    decl = f"{column} TEXT NOT NULL"
+    if not row or decl not in row["sql"]:
+        return
+    con.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    con.execute(row["sql"].replace(decl, f"{column} TEXT"))
+    con.execute(f"INSERT INTO {table} SELECT * FROM {table}_old")
+    con.execute(f"DROP TABLE {table}_old")
+
+
+def init_db(settings: Settings):
+    os.makedirs(os.path.dirname(settings.sqlite_path), exist_ok=True)
+    con = get_db(settings)
+    try:
+        # WAL: чтение не ждёт записи, запись — только другую запись; режим хранится в файле базы
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                content_type TEXT,
+                size INTEGER,
+                created_at TEXT NOT NULL,
+                s3_key_original TEXT NOT NULL,
+                s3_key_cleaned TEXT,
+                s3_key_delta TEXT,
+                summary_json TEXT,
+                sha256 TEXT
+            )
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'clean',
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                stage TEXT,
+                params_json TEXT NOT NULL,
+                result_json TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )
+            """
+        )
+        # оригиналы по содержимому и кэш результатов очистки (см. blobs.py)
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                s3_key TEXT NOT NULL,
+                size INTEGER,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS clean_results (
+                sha256 TEXT NOT NULL,
+                params_key TEXT NOT NULL,
+                s3_key_cleaned TEXT,
+                s3_key_delta TEXT,
+                summary_json TEXT,
+                created_at TEXT NOT NULL,
+                s3_key_mask TEXT,
+                PRIMARY KEY (sha256, params_key)
+            )
+            """
+        )
+        # журнал правок облаков патчами (см. patches.py)
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS patches (
+                file_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                base_json TEXT,
+                base_sha256 TEXT,
+                patch_key TEXT NOT NULL,
+                result_key TEXT NOT NULL,
+                points_before INTEGER,
+                removed INTEGER,
+                added INTEGER,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (file_id, kind, seq)
+            )
+            """
+        )
+        _add_column(con, "files", "sha256", "TEXT")
+        _add_column(con, "jobs", "kind", "TEXT NOT NULL DEFAULT 'clean'")
+        # результат-маска (masks.py): cleaned/delta не хранятся
+        _add_column(con, "files", "s3_key_mask", "TEXT")
+        _add_column(con, "clean_results", "s3_key_mask", "TEXT")
+        _drop_not_null(con, "clean_results", "s3_key_cleaned")
+        # метрики процесса задачи (metrics.py), переносятся в реестр API по её завершении
+        _add_column(con, "jobs", "metrics_json", "TEXT")
+        # список файлов: постраничный по (created_at, id), фильтры по имени и содержимому
+        con.execute("CREATE INDEX IF NOT EXISTS files_created ON files(created_at, id)")
+        con.execute("CREATE INDEX IF NOT EXISTS files_filename ON files(filename COLLATE NOCASE)")
+        con.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256)")
+        con.execute("CREATE INDEX IF NOT EXISTS jobs_file_id ON jobs(file_id)")
+        con.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+        con.commit()
+        # статистика индексов для планировщика (дёшево, если обновлять нечего)
+        con.execute("PRAGMA optimize")
+    finally:
+        con.close()
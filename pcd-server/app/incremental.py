@@ -0,0 +1,208 @@
+"""
+Инкрементальная переочистка после правки оригинала.
+
+Дорогой этап очистки в памяти — квантильная 2.5D-сетка (сортировка точек по
+клеткам); «земля», компоненты, Hough и перенос на точки работают по растрам
+и дёшевы. Клетка сетки зависит только от своих точек, поэтому после правки
+достаточно пересчитать клетки, точки которых изменились.
+
+Полная очистка (workers=1) может вернуть состояние CleanState: сетку G и
+«отпечатки» тайлов сетки по _TILE клеток — число точек тайла и сумму хэшей
+их координат, не зависящую от порядка точек. Когда оригинал заменён
+(save_original, патч оригинала), reclean раскладывает новое облако по той же
+сетке за один проход, находит тайлы с другими отпечатками и пересчитывает
+клетки только в них. Сглаживание «земли» (smooth_cells) и компоненты с
+полосами Hough, которых правка касается через соседние клетки, затем
+считаются по всей склеенной сетке заново — без перекрытий и обрезанных
+объектов.
+
+Полная очистка нужна (reclean возвращает None), если у нового облака другие
+начало или размер сетки (сдвинулись min/max x, y), изменились grid или
+квантили или изменилось больше _MAX_DIRTY тайлов с точками. Поэтому сетка
+совпадает с сеткой полной очистки нового облака, а с ней и результат.
+"""
+from __future__ import annotations
+import io
+import sys
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Tuple
+import numpy as np
+
+try:
+    from .clearing_algorithm import log, Coords, Grid2p5D, _cell_quantiles, grid_shape
+    from .profiling import count, stage
+except ImportError:  # запуск clearing_algorithm.py как скрипта
+    from clearing_algorithm import log, Coords, Grid2p5D, _cell_quantiles, grid_shape
+    from profiling import count, stage
+
+# сторона тайла отпечатков, клеток
+_TILE=64
+# доля изменившихся тайлов с точками, выше которой пересчёт не быстрее полной сетки
+_MAX_DIRTY=0.5
+# версия формата CleanState.to_bytes
+_VERSION=1
+# точек на один bincount отпечатков: суммы 32-битных половин хэшей (< 2**53) точны во float64
+_EXACT=1<<21
+# индексы младшей и старшей 32-битных половин uint64
+_LO,_HI=(0,1) if sys.byteorder=="little" else (1,0)
+_MIX=(np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F),
+      np.uint64(0x165667B19E3779F9), np.uint64(0xFF51AFD7ED558CCD))
+
+
+@dataclass
+class CleanState:
+    """Квантильная сетка очищенного облака, её квантили и отпечатки тайлов."""
+    G: Grid2p5D
+    q_low: float; q_high: float
+    fingerprints: np.ndarray    # (2, ny*nx) uint64: число точек тайла и сумма их хэшей
+    tile: int = _TILE
+
+    @property
+    def nx(self) -> int: return -(-self.G.W // self.tile)
+    @property
+    def ny(self) -> int: return -(-self.G.H // self.tile)
+
+    def to_bytes(self) -> bytes:
+        G=self.G
+        buf=io.BytesIO()
+        np.savez_compressed(buf, version=_VERSION, grid=G.grid, origin=np.asarray(G.origin), W=G.W, H=G.H,
+                            z_low=G.z_low, z_high=G.z_high, count=G.count, q_low=self.q_low, q_high=self.q_high,
+                            fingerprints=self.fingerprints, tile=self.tile)
+        return buf.getvalue()
+
+    @classmethod
+    def load(cls, f: BinaryIO) -> Optional["CleanState"]:
+        """Состояние из потока to_bytes; None — другая версия формата."""
+        with np.load(io.BytesIO(f.read())) as d:
+            if int(d["version"])!=_VERSION:
+                return None
+            G=Grid2p5D(float(d["grid"]), tuple(float(v) for v in d["origin"]), int(d["W"]), int(d["H"]),
+                       d["z_low"], d["z_high"], d["count"])
+            return cls(G, float(d["q_low"]), float(d["q_high"]), d["fingerprints"], int(d["tile"]))
+
+
+def _point_hash(x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """64-битный хэш точек по битам float64 координат."""
+    h=x.view(np.uint64)*_MIX[0]
+    h^=y.view(np.uint64)*_MIX[1]
+    h^=z.view(np.uint64)*_MIX[2]
+    h^=h>>np.uint64(33); h*=_MIX[3]; h^=h>>np.uint64(33)
+    return h
+
+
+def _add_fingerprints(fp: np.ndarray, tid: np.ndarray, h: np.ndarray):
+    """
+    Добавить в fp точки тайлов tid с хэшами h: число и сумму хэшей по модулю
+    2**64 (bincount по 32-битным половинам хэшей, без поэлементного np.add.at).
+    """
+    T=fp.shape[1]
+    fp[0]+=np.bincount(tid, minlength=T).astype(np.uint64)
+    for i in range(0, tid.size, _EXACT):
+        t=tid[i:i+_EXACT]; v=h[i:i+_EXACT].view(np.uint32).reshape(-1,2)
+        lo=np.bincount(t, v[:,_LO], T).astype(np.uint64)
+        hi=np.bincount(t, v[:,_HI], T).astype(np.uint64)
+        fp[1]+=lo+(hi<<np.uint64(32))
+
+
+def clean_state(C: Coords, cell: np.ndarray, G: Grid2p5D, q_low: float, q_high: float) -> CleanState:
+    """Состояние полной очистки: сетка G и номера клеток точек cell (cell_ids)."""
+    state=CleanState(G, q_low, q_high, None)
+    fp=np.zeros((2, state.ny*state.nx), dtype=np.uint64)
+    for i,j in C.spans():
+        c=cell[i:j]
+        m=c>=0
+        sel=None if m.all() else m
+        if sel is not None:
+            c=c[m]
+        h=_point_hash(*(C.get(k, i, j, sel) for k in range(3)))
+        _add_fingerprints(fp, (c//G.W//state.tile)*state.nx + (c%G.W)//state.tile, h)
+    state.fingerprints=fp
+    return state
+
+
+def _diff(C: Coords, prev: CleanState) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Номера клеток точек C в сетке prev (как cell_ids) и отпечатки тайлов за
+    один проход; None — полная очистка построила бы другую сетку: конечные
+    точки вне prev или другие min/max x, y (начало и размер сетки, как в
+    grid_cells).
+    """
+    G=prev.G
+    cell=np.empty(C.n, dtype=np.int32 if G.W*G.H<2**31 else np.int64)
+    fp=np.zeros_like(prev.fingerprints)
+    mn=np.full(2, np.nan); mx=np.full(2, np.nan)
+    for i,j in C.spans():
+        x=C.get(0,i,j); y=C.get(1,i,j)
+        m=np.isfinite(x)&np.isfinite(y)
+        if not m.all():
+            x=x[m]; y=y[m]
+        h=_point_hash(x, y, C.get(2, i, j, None if x.size==j-i else m))
+        if x.size:
+            lo=np.array([x.min(), y.min()]); hi=np.array([x.max(), y.max()])
+            # floor монотонна: клетки крайних точек порции — границы её клеток
+            if (np.floor((lo-G.origin)/G.grid)<0).any() or (np.floor((hi-G.origin)/G.grid)>=(G.W, G.H)).any():
+                return None
+            mn=np.fmin(mn, lo); mx=np.fmax(mx, hi)
+        x-=G.origin[0]; x/=G.grid; np.floor(x, out=x)
+        y-=G.origin[1]; y/=G.grid; np.floor(y, out=y)
+        ix=x.astype(np.int64); iy=y.astype(np.int64)
+        if x.size==j-i:
+            cell[i:j]=iy*G.W+ix
+        else:
+            c=np.full(j-i, -1, dtype=cell.dtype)
+            c[m]=iy*G.W+ix
+            cell[i:j]=c
+        _add_fingerprints(fp, (iy//prev.tile)*prev.nx + ix//prev.tile, h)
+    if np.isnan(mn).any() or tuple(mn)!=tuple(G.origin) or grid_shape(mn, mx, G.grid)!=(G.W, G.H):
+        return None
+    return cell, fp
+
+
+def reclean(C: Coords, prev: CleanState, grid: float, q_low: float, q_high: float
+            ) -> Optional[Tuple[Grid2p5D, np.ndarray, CleanState, dict]]:
+    """
+    Сетка облака C из сетки prev с пересчётом клеток изменившихся тайлов.
+    Возвращает (G, номера клеток точек, новое состояние, доп. поля summary)
+    или None, если нужна полная очистка.
+    """
+    P=prev.G
+    if P.grid!=grid or prev.q_low!=q_low or prev.q_high!=q_high:
+        log("Инкрементальная очистка: изменились grid или квантили, нужна полная")
+        return None
+    with stage("diff"):
+        r=_diff(C, prev)
+    if r is None:
+        log("Инкрементальная очистка: у облака другие начало или размер сетки, нужна полная")
+        return None
+    cell, fp=r
+    occupied=int(np.count_nonzero(fp[0]))
+    dirty=np.flatnonzero((fp!=prev.fingerprints).any(axis=0))
+    count("diff", points=C.n, tiles=occupied, dirty_tiles=dirty.size)
+    if dirty.size>_MAX_DIRTY*max(1, occupied):
+        log(f"Инкрементальная очистка: изменились {dirty.size} тайлов из {occupied}, нужна полная")
+        return None
+    log(f"Инкрементальная очистка: изменились {dirty.size} тайлов из {occupied}")
+
+    with stage("grid"):
+        G=Grid2p5D(P.grid, P.origin, P.W, P.H, P.z_low.copy(), P.z_high.copy(), P.count.copy())
+        # клетки изменившихся тайлов считаются заново: сначала пустые
+        in_dirty=np.zeros((P.H, P.W), dtype=bool)
+        for t in dirty:
+            ty,tx=divmod(int(t), prev.nx)
+            win=np.s_[ty*prev.tile:(ty+1)*prev.tile, tx*prev.tile:(tx+1)*prev.tile]
+            in_dirty[win]=True
+            G.z_low[win]=np.nan; G.z_high[win]=np.nan; G.count[win]=0
+        if dirty.size:
+            in_dirty=in_dirty.reshape(-1)
+            gids=[]; zs=[]
+            for i,j in C.spans():
+                c=cell[i:j]
+                m=c>=0
+                m[m]=in_dirty[c[m]]
+                gids.append(c[m].astype(np.int64)); zs.append(C.get(2,i,j,m))
+            gid=np.concatenate(gids); z=np.concatenate(zs)
+            del gids, zs
+            _cell_quantiles(gid, z, q_low, q_high, G.z_low.reshape(-1), G.z_high.reshape(-1), G.count.reshape(-1))
+            count("grid", points=gid.size, cells=int(in_dirty.sum()))
+    extra={"incremental": {"tiles": occupied, "dirty_tiles": int(dirty.size), "tile_cells": prev.tile}}
+    return G, cell, CleanState(G, q_low, q_high, fp, prev.tile), extra
@@ -0,0 +1,273 @@
+"""
+Очередь задач очистки: записи в таблице jobs (SQLite), выполнение в отдельных
+процессах, не более settings.clean_max_jobs одновременно.
+
+HTTP-обработчик только ставит задачу в очередь; диспетчер (поток в процессе
+API) запускает процессы по мере освобождения мест, процесс задачи сам пишет
+прогресс и результат в БД. Отмена: задача из очереди просто помечается,
+у выполняющейся завершается процесс.
+
+Метрики процесса задачи (этапы, передачи MinIO) процесс пишет в
+jobs.metrics_json, диспетчер по завершении переносит их в реестр API
+(metrics.py) вместе с итогом и длительностью задачи.
+"""
+import json
+import signal
+import threading
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from typing import Deque, Dict, Optional, Union
+
+from .db import get_db
+from .metrics import REGISTRY, record_stages
+from .parallel import mp_context
+from .profiling import dump_profile, profiled
+from .schemas import (BatchCleanRequest, BatchCleanResponse, CleanRequest, CleanResponse, JobRecord, LodRequest,
+                      LodResponse, SweepRequest, SweepResponse)
+from .settings import get_settings
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL = (DONE, FAILED, CANCELLED)
+
+# вид задачи -> (схема параметров, схема результата, имя функции в worker)
+KINDS = {
+    "clean": (CleanRequest, CleanResponse, "clean_and_store"),
+    "sweep": (SweepRequest, SweepResponse, "sweep_file"),
+    "lod": (LodRequest, LodResponse, "build_lod_file"),
+    # file_id пакетной задачи пуст: файлы — в BatchCleanRequest.file_ids
+    "batch": (BatchCleanRequest, BatchCleanResponse, "clean_batch"),
+}
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _update(job_id: str, only_if: Optional[str] = None, **fields) -> bool:
+    """UPDATE jobs; only_if — ожидаемый текущий статус (защита от гонок с отменой)."""
+    settings = get_settings()
+    cols = ", ".join(f"{k}=?" for k in fields)
+    sql = f"UPDATE jobs SET {cols} WHERE id=?"
+    args = list(fields.values()) + [job_id]
+    if only_if is not None:
+        sql += " AND status=?"
+        args.append(only_if)
+    con = get_db(settings)
+    try:
+        cur = con.execute(sql, args)
+        con.commit()
+        return cur.rowcount == 1
+    finally:
+        con.close()
+
+
+def job_record(r) -> JobRecord:
+    result = KINDS[r["kind"]][1].model_validate_json(r["result_json"]) if r["result_json"] else None
+    return JobRecord(
+        id=r["id"], file_id=r["file_id"], kind=r["kind"], status=r["status"], progress=r["progress"], stage=r["stage"],
+        created_at=r["created_at"], started_at=r["started_at"], finished_at=r["finished_at"],
+        error=r["error"], result=result,
+    )
+
+
+def get_job(job_id: str):
+    con = get_db(get_settings())
+    try:
+        return con.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    finally:
+        con.close()
+
+
+def _sigterm(signum, frame):
+    raise SystemExit(1)
+
+
+def _run_job(job_id: str, file_id: str, kind: str, params_json: str):
+    """Точка входа процесса задачи."""
+    # отмена приходит SIGTERM: раскручиваем стек, чтобы отработали finally (временные файлы, пулы)
+    signal.signal(signal.SIGTERM, _sigterm)
+    from . import worker
+    schema, _, func = KINDS[kind]
+
+    last = {"frac": -1.0, "stage": None}
+
+    def progress(frac: float, stage: str):
+        # в БД пишем только смену этапа или шаг от 1%
+        if stage == last["stage"] and frac - last["frac"] < 0.01:
+            return
+        last.update(frac=frac, stage=stage)
+        _update(job_id, only_if=RUNNING, progress=round(frac, 4), stage=stage)
+
+    with profiled() as prof:
+        try:
+            with dump_profile(get_settings().profile_dir, f"{kind}-{job_id}"):
+                res = getattr(worker, func)(file_id, schema.model_validate_json(params_json), progress)
+            _update(job_id, only_if=RUNNING, status=DONE, progress=1.0, stage="done",
+                    result_json=res.model_dump_json(), finished_at=_now())
+        except Exception as e:
+            traceback.print_exc()
+            _update(job_id, only_if=RUNNING, status=FAILED, error=f"{type(e).__name__}: {e}", finished_at=_now())
+        finally:
+            record_stages(kind, prof.as_dict())
+            _update(job_id, metrics_json=json.dumps(REGISTRY.export()))
+
+
+def _finished(r):
+    """Итог задачи в реестре метрик API: статус, длительность и метрики её процесса."""
+    if r is None:
+        return
+    REGISTRY.inc("pcd_jobs_total", kind=r["kind"], status=r["status"])
+    if r["started_at"] and r["finished_at"]:
+        seconds = (datetime.fromisoformat(r["finished_at"]) - datetime.fromisoformat(r["started_at"])).total_seconds()
+        REGISTRY.observe("pcd_job_duration_seconds", seconds, kind=r["kind"])
+    if r["metrics_json"]:
+        REGISTRY.merge(json.loads(r["metrics_json"]))
+
+
+class JobManager:
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max(1, int(max_jobs))
+        self._queue: Deque[str] = deque()
+        self._running: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        con = get_db(get_settings())
+        try:
+            # процессы прошлого запуска сервера не пережили рестарт
+            con.execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE status=?",
+                        (FAILED, "interrupted by server restart", _now(), RUNNING))
+            con.commit()
+            queued = con.execute("SELECT id FROM jobs WHERE status=? ORDER BY created_at", (QUEUED,)).fetchall()
+        finally:
+            con.close()
+        with self._lock:
+            self._queue.extend(r["id"] for r in queued)
+        self._thread = threading.Thread(target=self._loop, name="clean-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        with self._lock:
+            for job_id, p in list(self._running.items()):
+                if _update(job_id, only_if=RUNNING, status=FAILED, error="server shutdown", finished_at=_now()):
+                    p.terminate()
+
+    def submit(self, file_id: str, params: Union[CleanRequest, SweepRequest, LodRequest, BatchCleanRequest],
+               kind: str = "clean") -> str:
+        job_id = str(uuid.uuid4())
+        con = get_db(get_settings())
+        try:
+            con.execute(
+                "INSERT INTO jobs (id, file_id, kind, status, progress, params_json, created_at) VALUES (?,?,?,?,?,?,?)",
+                (job_id, file_id, kind, QUEUED, 0.0, params.model_dump_json(), _now()),
+            )
+            con.commit()
+        finally:
+            con.close()
+        with self._lock:
+            self._queue.append(job_id)
+        self._wake.set()
+        return job_id
+
+    def record_done(self, file_id: str, params: CleanRequest, result: CleanResponse) -> str:
+        """Задача, выполненная без запуска процесса (результат взят из кэша)."""
+        job_id = str(uuid.uuid4())
+        now = _now()
+        con = get_db(get_settings())
+        try:
+            con.execute(
+                "INSERT INTO jobs (id, file_id, kind, status, progress, stage, params_json, result_json,"
+                " created_at, started_at, finished_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                (job_id, file_id, "clean", DONE, 1.0, "cached", params.model_dump_json(), result.model_dump_json(),
+                 now, now, now),
+            )
+            con.commit()
+        finally:
+            con.close()
+        REGISTRY.inc("pcd_clean_cache_hits_total")
+        return job_id
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"queued": len(self._queue), "running": len(self._running)}
+
+    def cancel(self, job_id: str) -> bool:
+        """True, если задача была в очереди или выполнялась и теперь отменена."""
+        with self._lock:
+            if _update(job_id, only_if=QUEUED, status=CANCELLED, finished_at=_now()):
+                try:
+                    self._queue.remove(job_id)
+                except ValueError:
+                    pass
+                _finished(get_job(job_id))
+                return True
+            if _update(job_id, only_if=RUNNING, status=CANCELLED, finished_at=_now()):
+                p = self._running.get(job_id)
+                if p is not None:
+                    p.terminate()
+                return True
+        return False
+
+    def cancel_file(self, file_id: str):
+        """Отменить все незавершённые задачи файла (файл удалён или заменён)."""
+        con = get_db(get_settings())
+        try:
+            rows = con.execute("SELECT id FROM jobs WHERE file_id=? AND status IN (?,?)",
+                               (file_id, QUEUED, RUNNING)).fetchall()
+        finally:
+            con.close()
+        for r in rows:
+            self.cancel(r["id"])
+
+    def _loop(self):
+        ctx = mp_context()
+        while not self._stop:
+            claimed = []
+            with self._lock:
+                for job_id, p in list(self._running.items()):
+                    if p.is_alive():
+                        continue
+                    p.join()
+                    del self._running[job_id]
+                    if p.exitcode != 0:
+                        _update(job_id, only_if=RUNNING, status=FAILED,
+                                error=f"worker exited with code {p.exitcode}", finished_at=_now())
+                    _finished(get_job(job_id))
+                while self._queue and len(self._running) + len(claimed) < self.max_jobs:
+                    job_id = self._queue.popleft()
+                    # захват задачи: из очереди её могли отменить
+                    if _update(job_id, only_if=QUEUED, status=RUNNING, started_at=_now(), stage="start"):
+                        claimed.append(job_id)
+            # запуск процесса может ждать forkserver — вне блокировки, чтобы не держать submit/cancel
+            for job_id in claimed:
+                r = get_job(job_id)
+                # не daemon: процесс задачи может сам запускать пул (workers > 1)
+                p = ctx.Process(target=_run_job, args=(job_id, r["file_id"], r["kind"], r["params_json"]),
+                                name=f"clean-{job_id}")
+                p.start()
+                with self._lock:
+                    self._running[job_id] = p
+                    # отменена, пока процесс запускался
+                    if get_job(job_id)["status"] != RUNNING:
+                        p.terminate()
+            self._wake.wait(0.5)
+            self._wake.clear()
+
+
+@lru_cache()
+def get_job_manager() -> JobManager:
+    return JobManager(get_settings().clean_max_jobs)
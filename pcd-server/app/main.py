@@ -2,7 +2,11 @@ import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .routes.files import router as files_router
-from .routes.files import init_db
+from .routes.jobs import router as jobs_router
+from .routes.metrics import router as metrics_router
+from .db import init_db
+from .jobs import get_job_manager
+from .metrics import MetricsMiddleware
 from .settings import get_settings
 from .storage import get_minio_client, ensure_bucket
 
@@ -18,16 +22,28 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # pagination cursor of GET /files and download validators
+        expose_headers=["X-Next-Cursor", "Link", "ETag", "Content-Range"],
     )
 
+    # request latency by route template (GET /api/metrics)
+    app.add_middleware(MetricsMiddleware)
+
     @app.on_event("startup")
     def _startup():
         settings = get_settings()
         init_db(settings)
         client = get_minio_client(settings)
         ensure_bucket(client, settings.minio_bucket)
+        get_job_manager().start()
+
+    @app.on_event("shutdown")
+    def _shutdown():
+        get_job_manager().stop()
 
     app.include_router(files_router, prefix="/api")
+    app.include_router(jobs_router, prefix="/api")
+    app.include_router(metrics_router, prefix="/api")
     return app
 
 
@@ -0,0 +1,153 @@
+"""
+Результат очистки как маска удаления над порядком точек оригинала.
+
+Вместо полных cleaned.pcd и delta.pcd хранится один объект mask.bin:
+длины чередующихся серий «оставлена / удалена» (uint32, первая — оставленные,
+может быть нулевой), сжатые deflate. cleaned и delta при чтении собираются
+потоком из оригинала и маски (pcd_io.select_pcd). Маска — drop из
+clearing_algorithm.clean_mask, в который входят и не-финитные точки
+оригинала; их номера (обычно их нет) записаны отдельно (версия 2), и
+производная delta, как delta process/clean, их не содержит.
+
+Облако файла (Cloud) — либо объект MinIO, либо такое производное облако;
+скачивание, превью и октодеревья LOD работают с обоими одинаково.
+"""
+import io
+import json
+import os
+import struct
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from .pcd_io import ChunkReader, select_pcd
+from .storage import open_object
+
+_MAGIC = b"PCDM"
+_HEAD = struct.Struct("<4sBQQ")     # магия, версия, точек, удалено
+_VERSION = 1
+# версия 2: за _HEAD — число не-финитных точек и длина сжатых серий, затем серии и номера точек (uint64)
+_VERSION_NONFINITE = 2
+_NONFINITE = struct.Struct("<QQ")
+
+# облако -> столбец files с его ключом в MinIO
+CLOUD_COLUMNS = {"original": "s3_key_original", "cleaned": "s3_key_cleaned", "delta": "s3_key_delta"}
+
+
+def encode_mask(del_mask: np.ndarray, nonfinite: Optional[np.ndarray] = None) -> bytes:
+    """
+    Маска удаления (bool по точкам оригинала) -> содержимое mask.bin.
+    nonfinite — маска не-финитных точек (они удалены, но не входят в delta);
+    без таких точек пишется версия 1.
+    """
+    m = np.asarray(del_mask, dtype=bool)
+    edges = np.flatnonzero(m[1:] != m[:-1]) + 1
+    bounds = np.concatenate([[0], edges, [m.shape[0]]])
+    runs = np.diff(bounds).astype(np.uint32)
+    if m.shape[0] and m[0]:
+        runs = np.concatenate([[0], runs]).astype(np.uint32)
+    body = zlib.compress(runs.tobytes(), 6)
+    bad = np.flatnonzero(nonfinite).astype(np.uint64) if nonfinite is not None else np.zeros(0, dtype=np.uint64)
+    if not bad.size:
+        return _HEAD.pack(_MAGIC, _VERSION, m.shape[0], int(m.sum())) + body
+    return (_HEAD.pack(_MAGIC, _VERSION_NONFINITE, m.shape[0], int(m.sum())) + _NONFINITE.pack(bad.size, len(body))
+            + body + zlib.compress(bad.tobytes(), 6))
+
+
+def decode_mask(data: bytes, delta: bool = False) -> np.ndarray:
+    """Содержимое mask.bin -> маска удаления; delta — маска точек delta (без не-финитных)."""
+    magic, version, n, removed = _HEAD.unpack_from(data)
+    if magic != _MAGIC or version not in (_VERSION, _VERSION_NONFINITE):
+        raise ValueError("mask.bin: неизвестный формат")
+    body = data[_HEAD.size:]
+    bad = None
+    if version == _VERSION_NONFINITE:
+        nbad, nbody = _NONFINITE.unpack_from(body)
+        body = body[_NONFINITE.size:]
+        bad = np.frombuffer(zlib.decompress(body[nbody:]), dtype=np.uint64)
+        body = body[:nbody]
+        if bad.shape[0] != nbad or (nbad and bad.max() >= n):
+            raise ValueError("mask.bin: повреждённые данные")
+    runs = np.frombuffer(zlib.decompress(body), dtype=np.uint32)
+    m = np.repeat(np.arange(runs.shape[0]) % 2 == 1, runs)
+    if m.shape[0] != n or int(m.sum()) != removed:
+        raise ValueError("mask.bin: повреждённые данные")
+    if delta and bad is not None:
+        m[bad] = False
+    return m
+
+
+@dataclass(frozen=True)
+class Cloud:
+    """
+    Облако файла. key — ключ объекта или, для производного облака, условный
+    ключ <маска без расширения>/<cleaned|delta> (по нему живёт октодерево LOD).
+    """
+    key: str
+    source: Optional[str] = None     # оригинал производного облака
+    mask: Optional[str] = None       # его маска
+    keep: bool = True                # True — оставленные точки (cleaned), False — удалённые (delta)
+
+
+def mask_cloud(source: str, mask: str, kind: str) -> Cloud:
+    """Производное облако kind ("cleaned" или "delta") оригинала source по маске mask."""
+    return Cloud(f"{os.path.splitext(mask)[0]}/{kind}", source, mask, kind == "cleaned")
+
+
+def file_cloud(r, kind: str) -> Optional[Cloud]:
+    """Облако kind записи files: сохранённый объект или производное из маски; None, если его нет."""
+    key = r[CLOUD_COLUMNS[kind]]
+    if key:
+        return Cloud(key)
+    if kind == "original" or not r["s3_key_mask"]:
+        return None
+    if kind == "delta" and not mask_removed(r):
+        return None
+    return mask_cloud(r["s3_key_original"], r["s3_key_mask"], kind)
+
+
+def mask_removed(r) -> int:
+    """Число удалённых точек по summary записи (delta из маски есть, только если оно > 0)."""
+    summary = json.loads(r["summary_json"]) if r["summary_json"] else {}
+    return int(summary.get("removed_points") or 0)
+
+
+def cloud_etag(client, bucket: str, cloud: Cloud) -> str:
+    """Версия облака: ETag объекта или ETag оригинала и маски."""
+    if cloud.mask is None:
+        return client.stat_object(bucket, cloud.key).etag
+    return (f"{client.stat_object(bucket, cloud.source).etag}-{client.stat_object(bucket, cloud.mask).etag}"
+            f"-{'c' if cloud.keep else 'd'}")
+
+
+def _load_mask(client, bucket: str, key: str, delta: bool = False) -> np.ndarray:
+    with open_object(client, bucket, key) as f:
+        return decode_mask(f.read(), delta)
+
+
+@contextmanager
+def cloud_pcd(client, bucket: str, cloud: Cloud) -> Iterator[Tuple[int, Iterator[bytes]]]:
+    """
+    Производное облако как binary PCD: (размер, порции), собирается из потока
+    оригинала по маске. Соединение с MinIO закрывается при выходе.
+    """
+    if cloud.keep:
+        select = ~_load_mask(client, bucket, cloud.mask)
+    else:
+        select = _load_mask(client, bucket, cloud.mask, delta=True)
+    with open_object(client, bucket, cloud.source) as f:
+        yield select_pcd(f, select)
+
+
+@contextmanager
+def open_cloud(client, bucket: str, cloud: Cloud):
+    """Облако как бинарный поток PCD (объект — как есть, производное — binary)."""
+    if cloud.mask is None:
+        with open_object(client, bucket, cloud.key) as f:
+            yield f
+        return
+    with cloud_pcd(client, bucket, cloud) as (_, chunks):
+        yield io.BufferedReader(ChunkReader(chunks), buffer_size=1 << 20)
@@ -0,0 +1,199 @@
+"""
+Метрики бэкенда в текстовом формате Prometheus (GET /api/metrics), без
+зависимостей: счётчики, гистограммы и максимумы в памяти процесса.
+
+Процесс API сам записывает задержки HTTP-запросов (по шаблону маршрута) и
+передачи MinIO; процесс задачи копит свои метрики (этапы очистки из
+profiling.py, передачи) и при завершении сохраняет их в jobs.metrics_json,
+откуда диспетчер задач переносит их в реестр API (merge). Значения
+сбрасываются при перезапуске сервера, как у обычных счётчиков Prometheus.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_JOB_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+# имя -> (тип, описание, границы гистограммы)
+METRICS = {
+    "pcd_http_request_duration_seconds": (
+        "histogram", "HTTP request duration until the last response byte, by route template", _LATENCY_BUCKETS),
+    "pcd_minio_transfer_bytes_total": ("counter", "Bytes transferred to (upload) or from (download) MinIO", None),
+    "pcd_minio_transfers_total": ("counter", "Object uploads and downloads", None),
+    "pcd_jobs_total": ("counter", "Finished jobs by kind and final status", None),
+    "pcd_job_duration_seconds": ("histogram", "Job run time from start to finish", _JOB_BUCKETS),
+    "pcd_clean_cache_hits_total": ("counter", "Clean requests answered from stored results without a job", None),
+    "pcd_stage_seconds_total": ("counter", "Wall time spent in a processing stage", None),
+    "pcd_stage_cpu_seconds_total": ("counter", "Process CPU time spent in a processing stage", None),
+    "pcd_stage_calls_total": ("counter", "Runs of a processing stage", None),
+    "pcd_stage_items_total": ("counter", "Items handled by a processing stage (points, cells, components, peaks)", None),
+    "pcd_stage_peak_rss_bytes": ("gauge", "Largest process peak RSS seen at the end of a processing stage", None),
+}
+
+# поля этапа profiling.Profile, которые не являются счётчиками элементов
+_STAGE_FIELDS = {"calls", "wall_s", "cpu_s", "peak_rss_mb", "peak_rss_grow_mb", "traced_peak_mb"}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, Labels], object] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set_max(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def observe(self, name: str, value: float, **labels):
+        bounds = METRICS[name][2]
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = [[0] * (len(bounds) + 1), 0.0]
+            h[0][bisect_left(bounds, value)] += 1
+            h[1] += value
+
+    def take(self) -> list:
+        """export() с обнулением: для процессов пула, которые отдают метрики после каждой задачи."""
+        with self._lock:
+            state = [[name, dict(labels), v] for (name, labels), v in self._values.items()]
+            self._values.clear()
+        return state
+
+    def export(self) -> list:
+        """Состояние для merge в другом процессе: [[имя, метки, значение], …]."""
+        with self._lock:
+            return [[name, dict(labels), v] for (name, labels), v in self._values.items()]
+
+    def merge(self, state: Iterable[list]):
+        for name, labels, v in state:
+            if name not in METRICS:
+                continue
+            kind = METRICS[name][0]
+            key = (name, _labels(labels))
+            with self._lock:
+                cur = self._values.get(key)
+                if cur is None:
+                    self._values[key] = v
+                elif kind == "histogram":
+                    cur[0] = [a + b for a, b in zip(cur[0], v[0])]
+                    cur[1] += v[1]
+                elif kind == "gauge":
+                    self._values[key] = max(cur, v)
+                else:
+                    self._values[key] = cur + v
+
+    def render(self, gauges: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+        """Текстовый формат Prometheus 0.0.4; gauges — мгновенные значения {имя: (описание, значение)}."""
+        with self._lock:
+            values = {k: ([list(v[0]), v[1]] if isinstance(v, list) else v) for k, v in self._values.items()}
+        out: List[str] = []
+        for name, (kind, help_, bounds) in METRICS.items():
+            rows = sorted((labels, v) for (n, labels), v in values.items() if n == name)
+            if not rows:
+                continue
+            out += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+            for labels, v in rows:
+                if kind != "histogram":
+                    out.append(f"{name}{_fmt_labels(labels)} {_num(v)}")
+                    continue
+                cum = 0
+                for le, c in zip(list(bounds) + ["+Inf"], v[0]):
+                    cum += c
+                    out.append(f"{name}_bucket{_fmt_labels(labels + (('le', _num(le) if le != '+Inf' else le),))} {cum}")
+                out.append(f"{name}_sum{_fmt_labels(labels)} {_num(v[1])}")
+                out.append(f"{name}_count{_fmt_labels(labels)} {cum}")
+        for name, (help_, v) in _process_gauges(gauges).items():
+            kind = "counter" if name.endswith("_total") else "gauge"
+            out += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}", f"{name} {_num(v)}"]
+        return "\n".join(out) + "\n"
+
+
+def _fmt_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    esc = lambda s: s.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def _num(v) -> str:
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+_START = time.time()
+
+
+def _process_gauges(extra: Optional[Dict[str, Tuple[str, float]]]) -> Dict[str, Tuple[str, float]]:
+    g = {"process_cpu_seconds_total": ("CPU time of the API process", time.process_time()),
+         "process_start_time_seconds": ("Start time of the API process since the Unix epoch", _START)}
+    try:
+        with open("/proc/self/statm") as f:
+            g["process_resident_memory_bytes"] = ("Resident memory of the API process",
+                                                  int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except OSError:
+        pass
+    g.update(extra or {})
+    return g
+
+
+REGISTRY = Registry()
+
+
+def record_transfer(direction: str, nbytes: int):
+    """Передача объекта MinIO: direction — upload или download."""
+    REGISTRY.inc("pcd_minio_transfer_bytes_total", nbytes, direction=direction)
+    REGISTRY.inc("pcd_minio_transfers_total", direction=direction)
+
+
+def record_stages(kind: str, stages: dict):
+    """Этапы profiling.Profile.as_dict() задачи вида kind."""
+    for stage, e in stages.items():
+        REGISTRY.inc("pcd_stage_seconds_total", e.get("wall_s", 0.0), kind=kind, stage=stage)
+        REGISTRY.inc("pcd_stage_cpu_seconds_total", e.get("cpu_s", 0.0), kind=kind, stage=stage)
+        REGISTRY.inc("pcd_stage_calls_total", e.get("calls", 0), kind=kind, stage=stage)
+        if e.get("peak_rss_mb") is not None:
+            REGISTRY.set_max("pcd_stage_peak_rss_bytes", int(e["peak_rss_mb"] * 2**20), kind=kind, stage=stage)
+        for item, n in e.items():
+            if item not in _STAGE_FIELDS:
+                REGISTRY.inc("pcd_stage_items_total", n, kind=kind, stage=stage, item=item)
+
+
+class MetricsMiddleware:
+    """ASGI: длительность запроса до последнего байта ответа по шаблону маршрута (без id в метках)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REGISTRY.observe("pcd_http_request_duration_seconds", time.perf_counter() - t0,
+                             method=scope["method"], route=getattr(route, "path", "unmatched"),
+                             status=status["code"])
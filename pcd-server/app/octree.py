@@ -0,0 +1,174 @@
+"""
+Октодерево уровней детализации (LOD) облака в духе Potree: узел хранит
+разреженную выборку своих точек (не больше одной на клетку сетки _GRID³
+внутри куба узла), остальные точки уходят в дочерние узлы. Каждая точка
+лежит ровно в одном узле, так что клиент рисует корень, затем догружает
+потомков, видимых в кадре, пока не исчерпан бюджет точек.
+
+Имена узлов: "r" — корень, далее цифры 0..7 — номер октанта (бит 2 — x,
+бит 1 — y, бит 0 — z), как в Potree.
+
+Построение потоковое, облако целиком в памяти не держится:
+  1) проход по порциям — границы и число точек;
+  2) проход по порциям — точки раскладываются по кубам уровня D0 во
+     временные файлы (D0 такой, что куб в среднем не больше bucket_points);
+  3) каждый куб строится в памяти как поддерево, готовые узлы сразу
+     отдаются в put_node;
+  4) узлы выше D0 строятся снизу вверх из выборок своих детей.
+"""
+from __future__ import annotations
+import os, time
+from typing import Callable, Dict, Iterator, Tuple
+import numpy as np
+
+try:
+    from .clearing_algorithm import log
+except ImportError:  # запуск как скрипта
+    from clearing_algorithm import log
+
+# клеток выборки на ребро куба узла
+_GRID=128
+# предельная глубина: дальше узел хранит все свои точки
+_MAX_DEPTH=24
+# предельный уровень раскладки по временным файлам (8^4 файлов)
+_MAX_SPLIT=4
+
+NODE_POINTS=20_000
+BUCKET_POINTS=4_000_000
+
+Chunks = Callable[[], Iterator[np.ndarray]]
+PutNode = Callable[[str, np.ndarray], None]
+
+
+def _bounds(chunks: Chunks) -> Tuple[np.ndarray, np.ndarray, int]:
+    mn=np.full(3, np.inf); mx=np.full(3, -np.inf); n=0
+    for P in chunks():
+        P=P[np.isfinite(P).all(axis=1)]
+        if P.shape[0]==0: continue
+        mn=np.minimum(mn, P.min(axis=0)); mx=np.maximum(mx, P.max(axis=0)); n+=P.shape[0]
+    return mn, mx, n
+
+
+def _codes(P: np.ndarray, lo: np.ndarray, size: float, depth: int) -> np.ndarray:
+    """Номер куба уровня depth (цифры имени как восьмеричное число) для точек P."""
+    k=1<<depth
+    c=np.clip(((P-lo)*(k/size)).astype(np.int64), 0, k-1)
+    code=np.zeros(P.shape[0], dtype=np.int64)
+    for level in range(depth-1, -1, -1):
+        code=code*8+(((c[:,0]>>level)&1)<<2 | ((c[:,1]>>level)&1)<<1 | ((c[:,2]>>level)&1))
+    return code
+
+
+def node_name(code: int, depth: int) -> str:
+    digits=[]
+    for _ in range(depth):
+        code, d=divmod(code, 8); digits.append(str(d))
+    return "r"+"".join(reversed(digits))
+
+
+def node_box(name: str, origin: np.ndarray, size: float) -> Tuple[np.ndarray, float]:
+    """Нижний угол и ребро куба узла."""
+    lo=np.array(origin, dtype=np.float64)
+    for d in name[1:]:
+        size/=2; d=int(d)
+        lo=lo+size*np.array([(d>>2)&1, (d>>1)&1, d&1])
+    return lo, size
+
+
+def _sample(P: np.ndarray, lo: np.ndarray, size: float) -> np.ndarray:
+    """Маска выборки узла: первая точка в каждой занятой клетке сетки _GRID³."""
+    c=np.clip(((P-lo)*(_GRID/size)).astype(np.int64), 0, _GRID-1)
+    key=(c[:,0]*_GRID+c[:,1])*_GRID+c[:,2]
+    _, first=np.unique(key, return_index=True)
+    m=np.zeros(P.shape[0], dtype=bool); m[first]=True
+    return m
+
+
+def _subtree(name: str, P: np.ndarray, lo: np.ndarray, size: float, node_points: int, put: PutNode) -> np.ndarray:
+    """Строит поддерево узла name, отдаёт потомков в put; возвращает точки самого узла."""
+    if P.shape[0]<=node_points or len(name)>_MAX_DEPTH:
+        return P
+    keep=_sample(P, lo, size)
+    rest=P[~keep]
+    half=size/2
+    child=_codes(rest, lo, size, 1)
+    order=np.argsort(child, kind="stable")
+    bounds=np.searchsorted(child[order], np.arange(9))
+    for k in range(8):
+        a, b=bounds[k], bounds[k+1]
+        if a==b: continue
+        clo=lo+half*np.array([(k>>2)&1, (k>>1)&1, k&1])
+        put(name+str(k), _subtree(name+str(k), rest[order[a:b]], clo, half, node_points, put))
+    return P[keep]
+
+
+def build_octree(chunks: Chunks, put_node: PutNode, workdir: str,
+                 node_points: int = NODE_POINTS, bucket_points: int = BUCKET_POINTS,
+                 progress: Callable[[float], None] | None = None) -> dict:
+    """
+    Строит октодерево по порциям координат (n,3), которые chunks() выдаёт
+    заново при каждом вызове (вызывается дважды). Узлы — массивы float32
+    (m,3) — передаются в put_node(имя, точки) по мере готовности; временные
+    файлы раскладки пишутся в workdir. Возвращает индекс: границы куба,
+    шаг выборки корня и число точек каждого узла.
+    """
+    t0=time.perf_counter()
+    mn, mx, n=_bounds(chunks)
+    index={"points": n, "node_points": node_points, "grid": _GRID, "nodes": {}}
+    if n==0:
+        return index
+    size=float((mx-mn).max())*(1+1e-9) or 1.0
+    origin=mn
+    index.update(bounds={"min": mn.tolist(), "max": mx.tolist()},
+                 cube={"min": origin.tolist(), "size": size}, spacing=size/_GRID)
+    nodes=index["nodes"]
+    def put(name: str, P: np.ndarray):
+        nodes[name]=int(P.shape[0])
+        put_node(name, np.ascontiguousarray(P, dtype=np.float32))
+
+    depth=0
+    while n/8**depth>bucket_points and depth<_MAX_SPLIT: depth+=1
+    log(f"LOD: {n} точек, куб {size:.1f} м, раскладка на уровне {depth}")
+
+    # 2) раскладка по кубам уровня depth
+    seen=set()
+    for P in chunks():
+        P=P[np.isfinite(P).all(axis=1)].astype(np.float32)
+        code=_codes(P, origin, size, depth)
+        order=np.argsort(code, kind="stable")
+        code=code[order]; P=P[order]
+        cut=np.flatnonzero(np.diff(code))+1
+        for a, b in zip(np.r_[0, cut], np.r_[cut, code.shape[0]]):
+            c=int(code[a]); seen.add(c)
+            with open(os.path.join(workdir, f"b{c}.bin"), "ab") as f: P[a:b].tofile(f)
+
+    # 3) поддеревья кубов; их корни остаются в памяти для верхних уровней
+    level: Dict[str, np.ndarray]={}
+    for i, c in enumerate(sorted(seen)):
+        path=os.path.join(workdir, f"b{c}.bin")
+        P=np.fromfile(path, dtype=np.float32).reshape(-1, 3); os.remove(path)
+        name=node_name(c, depth)
+        lo, sz=node_box(name, origin, size)
+        level[name]=_subtree(name, P, lo, sz, node_points, put)
+        if progress: progress(0.9*(i+1)/len(seen))
+
+    # 4) верхние уровни: выборка узла берётся из точек детей и из них удаляется
+    while depth>0:
+        depth-=1
+        parents: Dict[str, list]={}
+        for name in sorted(level): parents.setdefault(name[:-1], []).append(name)
+        upper: Dict[str, np.ndarray]={}
+        for parent, kids in parents.items():
+            P=np.concatenate([level[k] for k in kids])
+            owner=np.repeat(np.arange(len(kids)), [level[k].shape[0] for k in kids])
+            lo, sz=node_box(parent, origin, size)
+            keep=_sample(P, lo, sz)
+            # ребёнок записывается и пустым: у него могут быть потомки
+            for j, k in enumerate(kids):
+                put(k, P[(owner==j) & ~keep])
+            upper[parent]=P[keep]
+        level=upper
+    put("r", level["r"])
+    if progress: progress(1.0)
+    log(f"LOD: {len(nodes)} узлов за {time.perf_counter()-t0:.1f} с")
+    return index
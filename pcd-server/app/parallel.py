@@ -0,0 +1,147 @@
+"""
+Многопроцессная очистка: облако делится на тайлы с перекрытием (как в тайловом
+режиме), тайлы обрабатываются в пуле процессов.
+
+Точки, индексы точек по тайлам и итоговая маска удаления лежат в разделяемой
+памяти (multiprocessing.shared_memory), задачи передают только номер тайла и
+границы среза, так что крупные массивы не сериализуются.
+"""
+from __future__ import annotations
+import math, multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple, Union
+import numpy as np
+
+try:
+    from .clearing_algorithm import log, report, Progress, Coords, grid_shape, cell_index
+    from .tiling import TilePlan, halo_cells, clean_tile, _MIN_TILE
+except ImportError:  # запуск clearing_algorithm.py как скрипта
+    from clearing_algorithm import log, report, Progress, Coords, grid_shape, cell_index
+    from tiling import TilePlan, halo_cells, clean_tile, _MIN_TILE
+
+# тайлов на процесс: запас для балансировки неравномерной плотности
+_TILES_PER_WORKER=4
+
+
+def mp_context():
+    """
+    Контекст multiprocessing для пулов и отдельных процессов задач. forkserver:
+    дочерние процессы не наследуют потоки родителя (uvicorn, OpenMP Open3D),
+    а тяжёлый импорт алгоритма выполняется один раз в процессе-сервере.
+    """
+    if "forkserver" in mp.get_all_start_methods():
+        ctx=mp.get_context("forkserver")
+        ctx.set_forkserver_preload([clean_tile.__module__, __name__])
+        return ctx
+    return mp.get_context("spawn")
+
+
+def make_pool(workers: int, initializer=None, initargs=()) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context(),
+                               initializer=initializer, initargs=initargs)
+
+
+class _Shared:
+    """Массив NumPy в именованном сегменте разделяемой памяти."""
+
+    def __init__(self, shape, dtype, name: str | None = None):
+        dtype=np.dtype(dtype)
+        nbytes=max(1, int(np.prod(shape))*dtype.itemsize)
+        self.shm=shared_memory.SharedMemory(name=name, create=name is None, size=nbytes)
+        self.array=np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec=(self.shm.name, tuple(shape), dtype.str)
+
+    @classmethod
+    def attach(cls, spec) -> "_Shared":
+        name, shape, dtype=spec
+        return cls(shape, dtype, name=name)
+
+    def close(self, unlink: bool = False):
+        self.array=None
+        self.shm.close()
+        if unlink: self.shm.unlink()
+
+
+# состояние процесса-исполнителя (заполняется в _init_worker)
+_W: Dict[str, object] = {}
+
+def _init_worker(specs: dict, plan: TilePlan, q_low: float, q_high: float,
+                 smooth_cells: int, cell_params: dict):
+    _W.update({k: _Shared.attach(v) for k,v in specs.items()})
+    _W.update(plan=plan, q_low=q_low, q_high=q_high, smooth_cells=smooth_cells, cell_params=cell_params)
+
+def _run_tile(t: int, a: int, b: int) -> int:
+    P=_W["points"].array; pids=_W["pids"].array[a:b]; out=_W["del_mask"].array
+    core, del_mask=clean_tile(P[pids], _W["plan"], t, _W["q_low"], _W["q_high"],
+                              _W["smooth_cells"], _W["cell_params"])
+    # ядра тайлов не пересекаются — запись в общую маску без гонок
+    out[pids[core][del_mask]]=True
+    return int(del_mask.sum())
+
+
+def plan_parallel(n_cells_w: int, n_cells_h: int, mn, grid: float, halo: int, workers: int) -> TilePlan:
+    """Тайлы по числу процессов: ~_TILES_PER_WORKER на процесс, но не мельче перекрытия."""
+    tile=int(math.ceil(math.sqrt(n_cells_w*n_cells_h/float(_TILES_PER_WORKER*workers))))
+    tile=min(max(tile, halo, _MIN_TILE), max(n_cells_w, n_cells_h))
+    return TilePlan(grid, (float(mn[0]),float(mn[1])), n_cells_w, n_cells_h, tile, halo)
+
+
+def _fill(out: np.ndarray, P: Union[np.ndarray, Coords]):
+    """Точки P в массив out (N,3) float64: Coords — порциями по столбцам, без промежуточной копии (N,3)."""
+    if not isinstance(P, Coords):
+        out[:]=P
+        return
+    for i,j in P.spans():
+        for k in range(3):
+            out[i:j,k]=P.get(k, i, j)
+
+
+def clean_points_parallel(P: Union[np.ndarray, Coords], grid: float, q_low: float, q_high: float,
+                          smooth_cells: int, workers: int, tile_halo: float | None = None,
+                          progress: Progress | None = None, **cell_params) -> Tuple[np.ndarray, dict]:
+    """
+    Маска удаления точек P ((N,3) или Coords), посчитанная по тайлам в workers
+    процессах. Возвращает (del_mask, доп. поля summary). Вдали от стыков тайлов
+    совпадает с обычным режимом; не-финитные точки не удаляются.
+    """
+    n=P.n if isinstance(P, Coords) else P.shape[0]
+    shared: List[_Shared]=[]
+    try:
+        # точки копируются один раз — сразу в разделяемую память, дальше читаются оттуда
+        sp=_Shared((n,3), np.float64); shared.append(sp); _fill(sp.array, P)
+        P=sp.array
+        finite=np.isfinite(P).all(axis=1)
+        xy=P[finite,:2]
+        mn=xy.min(axis=0); mx=xy.max(axis=0)
+        W,H=grid_shape(mn, mx, grid)
+        halo=halo_cells(grid, smooth_cells, tile_halo, cell_params["min_len"], cell_params["max_width"],
+                        cell_params["use_hough"], cell_params["hough_min_len"], cell_params["hough_dilate"])
+        plan=plan_parallel(W, H, mn, grid, halo, workers)
+        log(f"Параллельно: {workers} процессов, тайлы {plan.nx}x{plan.ny} по {plan.tile} клеток, перекрытие {plan.halo}")
+
+        # точки окон тайлов подряд: pids[off[t]:off[t+1]] — индексы точек тайла t
+        idx_t=np.int32 if n<2**31 else np.int64
+        fidx=np.flatnonzero(finite).astype(idx_t)
+        ix,iy=cell_index(xy, plan.origin, grid, W, H)
+        tids,pids=plan.tiles_of(ix, iy)
+        del ix, iy, xy, finite
+        order=np.argsort(tids, kind="stable")
+        off=np.searchsorted(tids[order], np.arange(plan.ntiles+1))
+        si=_Shared((pids.size,), idx_t); shared.append(si); np.take(fidx, pids[order], out=si.array)
+        del tids, pids, order, fidx
+        sm=_Shared((n,), np.bool_); shared.append(sm); sm.array[:]=False
+        specs={"points": sp.spec, "pids": si.spec, "del_mask": sm.spec}
+        jobs=[(t, int(off[t]), int(off[t+1])) for t in range(plan.ntiles) if off[t+1]>off[t]]
+        # крупные тайлы первыми — меньше простоя в конце
+        jobs.sort(key=lambda j: j[1]-j[2])
+        with make_pool(workers, _init_worker, (specs, plan, q_low, q_high, smooth_cells, cell_params)) as pool:
+            for i,fut in enumerate(as_completed([pool.submit(_run_tile, *j) for j in jobs])):
+                fut.result()
+                report(progress, 0.15 + 0.5*(i+1)/len(jobs), "tiles")
+        del_mask=sm.array.copy()
+    finally:
+        P=None
+        for s in shared: s.close(unlink=True)
+    return del_mask, {"workers": workers, "tiles": plan.ntiles, "tile_cells": plan.tile,
+                      "tile_halo_cells": plan.halo}
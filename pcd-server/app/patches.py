@@ -0,0 +1,249 @@
+"""
+Правки облака патчами вместо перезагрузки облака целиком: клиент присылает
+индексы удалённых точек (или маску) и дописанные точки, сервер применяет их
+потоком к хранимой версии и ведёт журнал патчей.
+
+Тело патча (little-endian):
+  заголовок _HEAD: магия "PCDP", версия, вид удаления (0 — индексы, 1 — маска),
+    n_base — точек в версии, к которой применяется патч, длина блока
+    удаления в байтах, число дописанных точек;
+  удаление: возрастающие индексы uint32 или mask.bin (masks.encode_mask);
+  дописанные точки: float32 x y z (прочие поля в результате нулевые).
+
+Журнал — таблица patches, по цепочке на (файл, облако): seq = 1, 2, …; тела
+хранятся в MinIO (pcd/<id>/patches/<облако>/<seq>.bin), так что версия seq —
+это база цепочки (облако до первого патча) с применёнными патчами 1..seq.
+Промежуточные результаты не хранятся, база удерживается цепочкой (для
+оригинала — ссылкой на блоб). Цепочка сбрасывается, когда облако меняется не
+патчем: новая очистка, save_original/save_cleaned, удаление файла.
+"""
+import io
+import json
+import struct
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from .blobs import acquire_blob, lod_prefix, new_blob_key, purge, release_blob
+from .db import get_db
+from .masks import Cloud, decode_mask, encode_mask, file_cloud, open_cloud
+from .pcd_io import ChunkReader, select_pcd
+from .settings import get_settings
+from .storage import get_minio_client, open_object, upload_bytes, upload_stream
+
+_MAGIC = b"PCDP"
+_HEAD = struct.Struct("<4sBBQQQ")
+_VERSION = 1
+REMOVED_INDICES, REMOVED_MASK = 0, 1
+
+# облака, которые правятся патчами (delta — производное очистки)
+EDIT_KINDS = ("original", "cleaned")
+
+
+class PatchConflict(Exception):
+    """Патч составлен не к текущей версии облака."""
+
+
+@dataclass
+class Patch:
+    n_base: int
+    removed: np.ndarray     # маска удаления по точкам базы
+    added: np.ndarray       # (m,3) float32
+
+
+def encode_patch(n_base: int, removed: np.ndarray, added: Optional[np.ndarray] = None) -> bytes:
+    """Тело патча; removed — индексы или маска по точкам базы (маска кодируется сериями)."""
+    added = np.zeros((0, 3), np.float32) if added is None else np.ascontiguousarray(added, dtype="<f4")
+    if removed.dtype == bool:
+        kind, body = REMOVED_MASK, encode_mask(removed)
+    else:
+        kind, body = REMOVED_INDICES, np.unique(removed).astype("<u4").tobytes()
+    return _HEAD.pack(_MAGIC, _VERSION, kind, n_base, len(body), added.shape[0]) + body + added.tobytes()
+
+
+def decode_patch(data: bytes) -> Patch:
+    """Разбор тела патча; ValueError при неверном формате."""
+    if len(data) < _HEAD.size:
+        raise ValueError("patch: short header")
+    magic, version, kind, n_base, nbody, nadd = _HEAD.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("patch: unknown format")
+    if len(data) != _HEAD.size + nbody + 12 * nadd:
+        raise ValueError("patch: size does not match the header")
+    body = data[_HEAD.size:_HEAD.size + nbody]
+    if kind == REMOVED_INDICES:
+        if nbody % 4:
+            raise ValueError("patch: truncated index list")
+        idx = np.frombuffer(body, dtype="<u4")
+        if idx.size and (int(idx.max()) >= n_base or (np.diff(idx.astype(np.int64)) <= 0).any()):
+            raise ValueError("patch: indices must be increasing and below n_base")
+        removed = np.zeros(n_base, dtype=bool)
+        removed[idx] = True
+    elif kind == REMOVED_MASK:
+        removed = decode_mask(body)
+        if removed.shape[0] != n_base:
+            raise ValueError("patch: mask size does not match n_base")
+    else:
+        raise ValueError(f"patch: unknown removal kind {kind}")
+    added = np.frombuffer(data, dtype="<f4", offset=_HEAD.size + nbody).reshape(-1, 3)
+    return Patch(int(n_base), removed, added)
+
+
+def apply_patch(f, patch: Patch):
+    """Патч к облаку из потока f: (размер, порции) результата как binary PCD."""
+    try:
+        return select_pcd(f, ~patch.removed, append=patch.added)
+    except ValueError as e:
+        raise PatchConflict(str(e))
+
+
+def _stream(size_chunks) -> io.BufferedReader:
+    return io.BufferedReader(ChunkReader(size_chunks[1]), buffer_size=1 << 20)
+
+
+def _chain_prefix(file_id: str, kind: str) -> str:
+    return f"pcd/{file_id}/patches/{kind}/"
+
+
+def _edits_prefix(file_id: str) -> str:
+    """Результаты патчей cleaned (оригинал после патча — обычный блоб)."""
+    return f"pcd/{file_id}/edits/cleaned/"
+
+
+def apply_file_patch(file_id: str, kind: str, data: bytes) -> dict:
+    """
+    Применить патч к текущей версии облака kind файла, сохранить результат
+    и записать патч в журнал. Возвращает запись журнала. LookupError — нет
+    файла или облака, ValueError — неверное тело, PatchConflict — патч не к
+    текущей версии (другое число точек или облако заменено, пока шла запись).
+    Патч оригинала, как save_original, сбрасывает результаты очистки.
+    """
+    settings = get_settings()
+    bucket = settings.minio_bucket
+    patch = decode_patch(data)
+    con = get_db(settings)
+    try:
+        r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
+        seq = con.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM patches WHERE file_id=? AND kind=?",
+                          (file_id, kind)).fetchone()[0]
+    finally:
+        con.close()
+    cloud = file_cloud(r, kind) if r else None
+    if cloud is None:
+        raise LookupError(f"file {file_id} has no {kind} cloud")
+
+    client = get_minio_client(settings)
+    patch_key = f"{_chain_prefix(file_id, kind)}{seq}.bin"
+    result_key = new_blob_key() if kind == "original" else f"{_edits_prefix(file_id)}{seq}.pcd"
+    with open_cloud(client, bucket, cloud) as f:
+        out = apply_patch(f, patch)
+        size, sha256 = upload_stream(client, bucket, result_key, _stream(out))
+    upload_bytes(client, bucket, patch_key, data, "application/octet-stream")
+
+    removed, added = int(patch.removed.sum()), int(patch.added.shape[0])
+    orphaned: List[str] = []
+    con = get_db(settings)
+    try:
+        # сравнение с прочитанным: облако не должно было смениться, пока писался результат
+        if kind == "original":
+            stored_key = acquire_blob(con, sha256, result_key, size)
+            if stored_key != result_key:
+                orphaned.append(result_key)
+            cur = con.execute(
+                "UPDATE files SET size=?, s3_key_original=?, sha256=?, s3_key_cleaned=NULL, s3_key_delta=NULL,"
+                " s3_key_mask=NULL, summary_json=NULL WHERE id=? AND s3_key_original=?",
+                (size, stored_key, sha256, file_id, r["s3_key_original"]),
+            )
+            new_key = stored_key
+        else:
+            cur = con.execute(
+                "UPDATE files SET s3_key_cleaned=? WHERE id=? AND s3_key_original=?"
+                " AND s3_key_cleaned IS ? AND s3_key_mask IS ?",
+                (result_key, file_id, r["s3_key_original"], r["s3_key_cleaned"], r["s3_key_mask"]),
+            )
+            new_key = result_key
+        if cur.rowcount == 0:
+            con.rollback()
+            purge([result_key, patch_key])
+            raise PatchConflict(f"{kind} of file {file_id} changed while the patch was applied")
+        if seq == 1:
+            # база остаётся за цепочкой: ссылка файла на блоб оригинала не освобождается
+            base_json, base_sha = json.dumps(asdict(cloud)), (r["sha256"] if kind == "original" else None)
+        else:
+            base_json, base_sha = None, None
+            # прежняя версия восстанавливается по журналу
+            if kind == "original":
+                orphaned += release_blob(con, r["sha256"], r["s3_key_original"])
+            else:
+                orphaned += [cloud.key, lod_prefix(cloud.key)]
+        if kind == "original":
+            orphaned += reset_patches(con, file_id, ["cleaned"])
+        con.execute(
+            "INSERT INTO patches (file_id, kind, seq, base_json, base_sha256, patch_key, result_key, points_before,"
+            " removed, added, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            (file_id, kind, seq, base_json, base_sha, patch_key, new_key, patch.n_base, removed, added,
+             datetime.utcnow().isoformat()),
+        )
+        con.commit()
+        row = con.execute("SELECT * FROM patches WHERE file_id=? AND kind=? AND seq=?", (file_id, kind, seq)).fetchone()
+    finally:
+        con.close()
+    purge(orphaned)
+    return dict(row)
+
+
+def reset_patches(con, file_id: str, kinds) -> List[str]:
+    """
+    Сбросить цепочки патчей (внутри транзакции con): удалить журнал и
+    освободить удерживаемую базу. Возвращает ключи и префиксы MinIO для
+    purge после commit; текущую версию облака освобождает вызывающий.
+    """
+    keys: List[str] = []
+    for kind in kinds:
+        base = con.execute("SELECT base_json, base_sha256 FROM patches WHERE file_id=? AND kind=? AND seq=1",
+                           (file_id, kind)).fetchone()
+        if base is None:
+            continue
+        if base["base_sha256"]:
+            keys += release_blob(con, base["base_sha256"], Cloud(**json.loads(base["base_json"])).key)
+        con.execute("DELETE FROM patches WHERE file_id=? AND kind=?", (file_id, kind))
+        keys.append(_chain_prefix(file_id, kind))
+        if kind == "cleaned":
+            keys += [_edits_prefix(file_id), lod_prefix(_edits_prefix(file_id))]
+    return keys
+
+
+def list_patches(file_id: str, kind: Optional[str] = None) -> list:
+    con = get_db(get_settings())
+    try:
+        if kind:
+            return con.execute("SELECT * FROM patches WHERE file_id=? AND kind=? ORDER BY seq", (file_id, kind)).fetchall()
+        return con.execute("SELECT * FROM patches WHERE file_id=? ORDER BY kind, seq", (file_id,)).fetchall()
+    finally:
+        con.close()
+
+
+def chain_base(rows) -> Cloud:
+    return Cloud(**json.loads(rows[0]["base_json"]))
+
+
+@contextmanager
+def version_pcd(client, bucket: str, rows):
+    """
+    Версия после патчей rows (цепочка с seq=1 подряд) как binary PCD:
+    (размер, порции). База и патчи читаются из MinIO потоком, патчи
+    применяются по очереди без промежуточных файлов.
+    """
+    with ExitStack() as stack:
+        f = stack.enter_context(open_cloud(client, bucket, chain_base(rows)))
+        out = None
+        for row in rows:
+            with open_object(client, bucket, row["patch_key"]) as p:
+                patch = decode_patch(p.read())
+            if out is not None:
+                f = _stream(out)
+            out = apply_patch(f, patch)
+        yield out
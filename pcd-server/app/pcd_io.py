@@ -0,0 +1,480 @@
+"""
+Чтение/запись PCD без Open3D, со всеми полями точки (intensity, ring, ...).
+
+Точки — структурный массив NumPy с полями из заголовка. binary отображается
+в память (np.memmap) без копирования, binary_compressed (LZF) распаковывается
+целиком, ascii разбирается порциями строк. Читать можно и из потока
+(ответ MinIO): данные копируются сразу в итоговый массив. Запись — в файл или
+в поток PCDStream для выгрузки без временного файла. Для больших облаков есть
+потоковые iter_xyz и PCDWriter.
+
+LZF — через python-lzf; без него распаковка идёт на чистом Python (медленно),
+а запись binary_compressed заменяется на binary.
+"""
+from __future__ import annotations
+import io, os, struct, sys
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, List, Tuple, Union
+import numpy as np
+from numpy.lib import recfunctions as rfn
+
+try:
+    import lzf
+except ImportError:  # необязательная зависимость
+    lzf = None
+
+_TYPES={("F",4):"<f4", ("F",8):"<f8",
+        ("I",1):"<i1", ("I",2):"<i2", ("I",4):"<i4", ("I",8):"<i8",
+        ("U",1):"<u1", ("U",2):"<u2", ("U",4):"<u4", ("U",8):"<u8"}
+
+
+@dataclass
+class PCDHeader:
+    fields: List[str]; size: List[int]; type: List[str]; count: List[int]
+    width: int; height: int; points: int
+    data: str            # ascii | binary | binary_compressed
+    offset: int          # смещение начала данных в файле, байт
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Структурный dtype одной точки (упакованный, как в binary PCD)."""
+        cols=[]
+        for i,(f,s,t,c) in enumerate(zip(self.fields, self.size, self.type, self.count)):
+            name=f if f!="_" else f"_pad{i}"
+            base=_TYPES[(t,s)]
+            cols.append((name, base) if c==1 else (name, base, (c,)))
+        return np.dtype(cols)
+
+
+# порция чтения из потока: readinto ответа HTTP копирует через промежуточный буфер
+_READ_CHUNK=16<<20
+
+
+def _name(f) -> str:
+    return getattr(f, "name", None) or "<stream>"
+
+
+def read_header(path: str) -> PCDHeader:
+    with open(path, "rb") as f:
+        return _parse_header(f)
+
+
+def _parse_header(f: BinaryIO) -> PCDHeader:
+    """Заголовок с текущей позиции потока; после вызова поток стоит на начале данных."""
+    vals={}
+    offset=0
+    while True:
+        line=f.readline()
+        if not line: raise ValueError(f"{_name(f)}: нет строки DATA в заголовке PCD")
+        offset+=len(line)
+        s=line.decode("ascii", errors="replace").strip()
+        if not s or s.startswith("#"): continue
+        key, _, rest=s.partition(" ")
+        vals[key.upper()]=rest.split()
+        if key.upper()=="DATA": break
+    fields=vals["FIELDS"]
+    n=len(fields)
+    size=[int(v) for v in vals.get("SIZE", ["4"]*n)]
+    typ=[v.upper() for v in vals.get("TYPE", ["F"]*n)]
+    count=[int(v) for v in vals.get("COUNT", ["1"]*n)]
+    width=int(vals.get("WIDTH", ["0"])[0]); height=int(vals.get("HEIGHT", ["1"])[0])
+    points=int(vals.get("POINTS", [str(width*height)])[0])
+    return PCDHeader(fields, size, typ, count, width, height, points, vals["DATA"][0].lower(), offset)
+
+
+def _lzf_decompress_py(src: bytes, out_len: int) -> bytes:
+    """Распаковка LZF (формат liblzf) на чистом Python."""
+    out=bytearray(out_len); i=0; o=0; n=len(src)
+    while i<n:
+        ctrl=src[i]; i+=1
+        if ctrl<32:                  # литералы: ctrl+1 байт
+            ln=ctrl+1
+            out[o:o+ln]=src[i:i+ln]; i+=ln; o+=ln
+            continue
+        ln=ctrl>>5                   # ссылка назад: длина ln+2, смещение 13 бит
+        if ln==7: ln+=src[i]; i+=1
+        ref=o-((ctrl&0x1f)<<8)-src[i]-1; i+=1
+        ln+=2
+        if ref<0: raise ValueError("LZF: ссылка за начало данных")
+        if ref+ln<=o:
+            out[o:o+ln]=out[ref:ref+ln]
+        else:                        # перекрытие — период повторяется
+            period=out[ref:o]
+            out[o:o+ln]=(period*(ln//len(period)+1))[:ln]
+        o+=ln
+    if o!=out_len: raise ValueError(f"LZF: распаковано {o} байт вместо {out_len}")
+    return bytes(out)
+
+
+def _lzf_decompress(src: bytes, out_len: int) -> bytes:
+    if lzf is None: return _lzf_decompress_py(src, out_len)
+    out=lzf.decompress(src, out_len)
+    if out is None or len(out)!=out_len: raise ValueError("LZF: повреждённые данные")
+    return out
+
+
+def _readinto(f: BinaryIO, rec: np.ndarray):
+    """Заполнить массив rec байтами из потока."""
+    buf=memoryview(rec.view(np.uint8))
+    got=0
+    while got<len(buf):
+        n=f.readinto(buf[got:got+_READ_CHUNK])
+        if not n: raise ValueError(f"{_name(f)}: данных меньше, чем указано в заголовке")
+        got+=n
+
+
+def _read_binary(f: BinaryIO, hdr: PCDHeader) -> np.ndarray:
+    """binary из потока: чтение прямо в память итогового массива."""
+    rec=np.empty(hdr.points, dtype=hdr.dtype)
+    _readinto(f, rec)
+    return rec
+
+
+def _read_compressed(f: BinaryIO, hdr: PCDHeader) -> np.ndarray:
+    """binary_compressed: [uint32 сжатый размер][uint32 исходный][LZF], поля лежат столбцами."""
+    dt=hdr.dtype
+    rec=np.empty(hdr.points, dtype=dt)
+    if hdr.points==0: return rec
+    csize, usize=struct.unpack("<II", f.read(8))
+    raw=_lzf_decompress(f.read(csize), usize)
+    if usize!=hdr.points*dt.itemsize: raise ValueError(f"{_name(f)}: размер данных не совпадает с заголовком")
+    off=0
+    for name in dt.names:
+        fdt=dt.fields[name][0]
+        nb=hdr.points*fdt.itemsize
+        rec[name]=np.frombuffer(raw, dtype=fdt.base, count=nb//fdt.base.itemsize, offset=off).reshape(rec[name].shape)
+        off+=nb
+    return rec
+
+
+def _read_ascii(f: BinaryIO, hdr: PCDHeader, chunk_points: int = 1<<20) -> np.ndarray:
+    dt=hdr.dtype
+    rec=np.empty(hdr.points, dtype=dt)
+    n=0
+    while n<hdr.points:
+        part=np.loadtxt(f, dtype=np.float64, max_rows=min(chunk_points, hdr.points-n), ndmin=2)
+        if part.shape[0]==0: break
+        rec[n:n+part.shape[0]]=rfn.unstructured_to_structured(part, dtype=dt, casting="unsafe")
+        n+=part.shape[0]
+    return rec[:n]
+
+
+def _read_data(f: BinaryIO, hdr: PCDHeader) -> np.ndarray:
+    if hdr.data=="binary": return _read_binary(f, hdr)
+    if hdr.data=="binary_compressed": return _read_compressed(f, hdr)
+    if hdr.data=="ascii": return _read_ascii(f, hdr)
+    raise ValueError(f"{_name(f)}: неизвестный формат DATA {hdr.data}")
+
+
+def iter_records(f: BinaryIO, chunk_points: int = 1<<20) -> Tuple[PCDHeader, Iterator[np.ndarray]]:
+    """
+    Заголовок PCD из потока f и порции точек (структурные массивы) по
+    chunk_points. binary читается порциями в один буфер (порция действительна
+    до следующей), binary_compressed распаковывается целиком, ascii — порциями.
+    """
+    hdr=_parse_header(f)
+    dt=hdr.dtype
+
+    def chunks() -> Iterator[np.ndarray]:
+        if hdr.data=="binary":
+            buf=np.empty(min(chunk_points, hdr.points), dtype=dt)
+            for i in range(0, hdr.points, chunk_points):
+                part=buf[:min(chunk_points, hdr.points-i)]
+                _readinto(f, part)
+                yield part
+        elif hdr.data=="binary_compressed":
+            if hdr.points==0: return
+            csize, usize=struct.unpack("<II", f.read(8))
+            raw=_lzf_decompress(f.read(csize), usize)
+            if usize!=hdr.points*dt.itemsize: raise ValueError(f"{_name(f)}: размер данных не совпадает с заголовком")
+            # поля лежат столбцами: порция собирается из срезов столбцов
+            cols={}; off=0
+            for name in dt.names:
+                fdt=dt.fields[name][0]
+                cols[name]=np.frombuffer(raw, dtype=fdt.base, count=hdr.points*int(np.prod(fdt.shape or 1)),
+                                         offset=off).reshape((hdr.points,)+fdt.shape)
+                off+=hdr.points*fdt.itemsize
+            for i in range(0, hdr.points, chunk_points):
+                part=np.empty(min(chunk_points, hdr.points-i), dtype=dt)
+                for name in dt.names: part[name]=cols[name][i:i+part.shape[0]]
+                yield part
+        elif hdr.data=="ascii":
+            n=0
+            while n<hdr.points:
+                part=np.loadtxt(f, dtype=np.float64, max_rows=min(chunk_points, hdr.points-n), ndmin=2)
+                if part.shape[0]==0: break
+                n+=part.shape[0]
+                yield rfn.unstructured_to_structured(part, dtype=dt, casting="unsafe")
+        else:
+            raise ValueError(f"{_name(f)}: неизвестный формат DATA {hdr.data}")
+    return hdr, chunks()
+
+
+def read_pcd(src: Union[str, os.PathLike, BinaryIO]) -> np.ndarray:
+    """
+    Все точки структурным массивом (поля как в заголовке). src — путь или
+    бинарный поток с начала PCD. Для файла binary — np.memmap только для
+    чтения: данные не копируются, пока их не изменят.
+    """
+    if not isinstance(src, (str, os.PathLike)):
+        return _read_data(src, _parse_header(src))
+    hdr=read_header(src)
+    if hdr.data=="binary":
+        if hdr.points==0: return np.empty(0, dtype=hdr.dtype)
+        return np.memmap(src, dtype=hdr.dtype, mode="r", offset=hdr.offset, shape=(hdr.points,))
+    with open(src, "rb") as f:
+        f.seek(hdr.offset)
+        return _read_data(f, hdr)
+
+
+def xyz(rec: np.ndarray) -> np.ndarray:
+    """Координаты (N,3) float64."""
+    out=np.empty((rec.shape[0], 3), dtype=np.float64)
+    for i,k in enumerate(("x","y","z")): out[:,i]=rec[k]
+    return out
+
+
+def as_records(arr: np.ndarray) -> np.ndarray:
+    """Структурный массив как есть; (N,3) — как поля x y z (без копии, если массив непрерывный)."""
+    if arr.dtype.names is not None: return arr
+    arr=np.ascontiguousarray(arr)
+    if arr.dtype.kind!="f" or arr.ndim!=2 or arr.shape[1]!=3:
+        raise ValueError(f"ожидался массив (N,3) float, получен {arr.shape} {arr.dtype}")
+    return arr.view(np.dtype([(k, arr.dtype) for k in ("x","y","z")])).reshape(-1)
+
+
+def _header_bytes(dt: np.dtype, n: int, data: str, num_width: int = 0) -> bytes:
+    fields=[]; size=[]; typ=[]; count=[]
+    for name in dt.names:
+        fdt=dt.fields[name][0]
+        base=fdt.base
+        fields.append("_" if name.startswith("_pad") else name)
+        size.append(str(base.itemsize)); typ.append({"f":"F","i":"I","u":"U"}[base.kind])
+        count.append(str(int(np.prod(fdt.shape)) if fdt.shape else 1))
+    num=f"{n:<{num_width}d}"
+    return ("# .PCD v0.7 - Point Cloud Data file format\nVERSION 0.7\n"
+            f"FIELDS {' '.join(fields)}\nSIZE {' '.join(size)}\nTYPE {' '.join(typ)}\nCOUNT {' '.join(count)}\n"
+            f"WIDTH {num}\nHEIGHT 1\nVIEWPOINT 0 0 0 1 0 0 0\nPOINTS {num}\nDATA {data}\n").encode("ascii")
+
+
+def _pcd_chunks(points: np.ndarray, data: str, chunk_points: int = 1<<20, name: str = "<stream>",
+                select: np.ndarray | None = None) -> Iterator[bytes]:
+    """
+    Содержимое PCD порциями: заголовок, затем данные (для binary — срезы массива
+    без копии). select — маска точек: пишутся только отмеченные, без копии
+    отобранных точек целиком (порциями, для binary_compressed — по столбцам).
+    """
+    rec=as_records(points)
+    # упакованный dtype без смещений/выравнивания, как в PCD
+    dt=np.dtype([(name, rec.dtype.fields[name][0]) for name in rec.dtype.names])
+    packed=dt==rec.dtype
+    if not packed and select is None: rec=rfn.repack_fields(rec.astype(dt)); packed=True
+    n=rec.shape[0] if select is None else int(np.count_nonzero(select))
+
+    def part(i: int, j: int) -> np.ndarray:
+        """Отобранные точки [i, j) в упакованном dtype."""
+        p=rec[i:j] if select is None else rec[i:j][select[i:j]]
+        return p if packed else rfn.repack_fields(p.astype(dt))
+
+    if data=="binary_compressed":
+        payload=None
+        if lzf is not None and n>0:
+            # поля столбцами, как ждёт PCL/Open3D
+            cols=np.empty(n*dt.itemsize, dtype=np.uint8)
+            off=0
+            for field in dt.names:
+                fdt=dt.fields[field][0]
+                col=cols[off:off+n*fdt.itemsize].view(fdt.base).reshape((n,)+fdt.shape)
+                if select is None:
+                    col[...]=rec[field]
+                else:
+                    k=0
+                    for i in range(0, rec.shape[0], chunk_points):
+                        v=rec[field][i:i+chunk_points][select[i:i+chunk_points]]
+                        col[k:k+v.shape[0]]=v; k+=v.shape[0]
+                off+=n*fdt.itemsize
+            comp=lzf.compress(cols, cols.nbytes+cols.nbytes//16+64)
+            if comp is not None: payload=struct.pack("<II", len(comp), cols.nbytes)+comp
+            del cols
+        if payload is None and n>0:
+            print(f"{name}: LZF недоступен, запись binary", file=sys.stderr)
+            data="binary"
+        elif n==0:
+            payload=struct.pack("<II", 0, 0)
+    if data not in ("binary", "binary_compressed", "ascii"):
+        raise ValueError(f"неизвестный формат DATA {data}")
+    yield _header_bytes(dt, n, data)
+    if data=="binary_compressed":
+        yield payload
+    elif data=="binary" and select is None:
+        raw=np.ascontiguousarray(rec).view(np.uint8)
+        step=chunk_points*dt.itemsize
+        for i in range(0, raw.shape[0], step):
+            yield memoryview(raw[i:i+step])
+    elif data=="binary":
+        for i in range(0, rec.shape[0], chunk_points):
+            p=part(i, i+chunk_points)
+            if p.shape[0]: yield p.tobytes()
+    else:
+        fmt=[("%d" if dt.fields[field][0].base.kind in "iu" else "%.9g")
+             for field in dt.names for _ in range(max(1, int(np.prod(dt.fields[field][0].shape))))]
+        for i in range(0, rec.shape[0], chunk_points):
+            p=part(i, i+chunk_points)
+            if not p.shape[0]: continue
+            buf=io.BytesIO()
+            np.savetxt(buf, rfn.structured_to_unstructured(p, dtype=np.float64), fmt=fmt)
+            yield buf.getvalue()
+
+
+def write_pcd(path: str, points: np.ndarray, data: str = "binary_compressed", chunk_points: int = 1<<20,
+              select: np.ndarray | None = None):
+    """
+    Запись структурного массива (или (N,3) float) в PCD. binary пишется из
+    массива напрямую, binary_compressed — одним блоком LZF. select — маска
+    записываемых точек (без копии points[select]).
+    """
+    with open(path, "wb") as f:
+        for b in _pcd_chunks(points, data, chunk_points, path, select):
+            f.write(b)
+
+
+class ChunkReader(io.RawIOBase):
+    """Файловый объект только для чтения над последовательностью порций байт."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks=iter(chunks)
+        self._buf=memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self) -> bool:
+        while not len(self._buf):
+            b=next(self._chunks, None)
+            if b is None: return False
+            self._buf=memoryview(b).cast("B")
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._fill(): return 0
+        n=min(len(b), len(self._buf))
+        b[:n]=self._buf[:n]; self._buf=self._buf[n:]
+        return n
+
+    def readall(self) -> bytes:
+        out=[bytes(self._buf)]+[bytes(b) for b in self._chunks]
+        self._buf=memoryview(b"")
+        return b"".join(out)
+
+
+class PCDStream(ChunkReader):
+    """
+    PCD как файловый объект только для чтения — для потоковой выгрузки
+    (storage.upload_stream) без временного файла. binary отдаётся срезами
+    массива; binary_compressed сжимается целиком при первом чтении.
+    """
+
+    def __init__(self, points: np.ndarray, data: str = "binary_compressed", chunk_points: int = 1<<20,
+                 select: np.ndarray | None = None):
+        super().__init__(_pcd_chunks(points, data, chunk_points, select=select))
+
+
+def select_pcd(f: BinaryIO, select: np.ndarray, chunk_points: int = 1<<20,
+               append: np.ndarray | None = None) -> Tuple[int, Iterator[bytes]]:
+    """
+    Точки PCD из потока f, отмеченные в select (по порядку точек), как binary
+    PCD: (размер в байтах, порции). append — координаты (m,3), дописываемые
+    в конец (прочие поля нулевые). Заголовок читается сразу; binary
+    фильтруется порциями по мере чтения, остальные форматы — целиком.
+    """
+    hdr=_parse_header(f)
+    if select.shape[0]!=hdr.points:
+        raise ValueError(f"{_name(f)}: маска на {select.shape[0]} точек, в облаке {hdr.points}")
+    dt=hdr.dtype
+    tail=np.zeros(0 if append is None else append.shape[0], dtype=dt)
+    if tail.shape[0]:
+        if not {"x", "y", "z"} <= set(dt.names):
+            raise ValueError(f"{_name(f)}: нет полей x y z")
+        for i, c in enumerate("xyz"): tail[c]=append[:, i]
+    n=int(np.count_nonzero(select))
+    head=_header_bytes(dt, n+tail.shape[0], "binary")
+
+    def chunks() -> Iterator[bytes]:
+        yield head
+        if hdr.data=="binary":
+            buf=np.empty(min(chunk_points, hdr.points), dtype=dt)
+            for i in range(0, hdr.points, chunk_points):
+                part=buf[:min(chunk_points, hdr.points-i)]
+                _readinto(f, part)
+                sel=part[select[i:i+part.shape[0]]]
+                if sel.shape[0]: yield sel.tobytes()
+        else:
+            rec=_read_data(f, hdr)[select]
+            for i in range(0, n, chunk_points):
+                yield rec[i:i+chunk_points].tobytes()
+        if tail.shape[0]: yield tail.tobytes()
+    return len(head)+(n+tail.shape[0])*dt.itemsize, chunks()
+
+
+def iter_xyz(path: str, chunk_points: int = 1<<20) -> Iterator[np.ndarray]:
+    """Порции координат (n,3) float64 в порядке точек файла."""
+    hdr=read_header(path)
+    for k in ("x","y","z"):
+        if k not in hdr.fields: raise ValueError(f"{path}: в PCD нет поля {k}")
+    if hdr.data=="binary":
+        rec=np.memmap(path, dtype=hdr.dtype, mode="r", offset=hdr.offset, shape=(hdr.points,))
+        for i in range(0, hdr.points, chunk_points):
+            part=rec[i:i+chunk_points]
+            yield np.column_stack([part["x"], part["y"], part["z"]]).astype(np.float64, copy=False)
+        del rec
+    elif hdr.data=="ascii":
+        # колонки x,y,z с учётом COUNT>1 у предшествующих полей
+        starts=np.cumsum([0]+hdr.count[:-1])
+        cols=[int(starts[hdr.fields.index(k)]) for k in ("x","y","z")]
+        with open(path, "rb") as f:
+            f.seek(hdr.offset)
+            left=hdr.points
+            while left>0:
+                part=np.loadtxt(f, dtype=np.float64, usecols=cols, max_rows=min(chunk_points,left), ndmin=2)
+                if part.shape[0]==0: break
+                left-=part.shape[0]
+                yield part
+    else:
+        # binary_compressed потоково не разобрать — распаковка целиком
+        rec=read_pcd(path)
+        for i in range(0, rec.shape[0], chunk_points):
+            yield xyz(rec[i:i+chunk_points])
+
+
+class PCDWriter:
+    """
+    Потоковая запись binary PCD (x y z float32). Число точек заранее неизвестно:
+    в заголовке под него оставлено поле фиксированной ширины, которое
+    переписывается при close().
+    """
+    _NUM_WIDTH=12
+
+    def __init__(self, path: str):
+        self.path=path
+        self.n=0
+        self._f=open(path, "wb")
+        self._f.write(self._header(0))
+
+    _DTYPE=np.dtype([("x","<f4"),("y","<f4"),("z","<f4")])
+
+    def _header(self, n: int) -> bytes:
+        return _header_bytes(self._DTYPE, n, "binary", self._NUM_WIDTH)
+
+    def write(self, xyz: np.ndarray):
+        if xyz.shape[0]==0: return
+        np.ascontiguousarray(xyz, dtype=np.float32).tofile(self._f)
+        self.n+=int(xyz.shape[0])
+
+    def close(self):
+        if self._f.closed: return
+        self._f.seek(0)
+        self._f.write(self._header(self.n))
+        self._f.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
@@ -0,0 +1,96 @@
+"""
+Превью облака: равномерное по пространству прореживание вокселями до бюджета
+точек и LRU-кэш готовых превью в памяти процесса API.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .settings import get_settings
+
+# предел шагов подбора размера вокселя
+_MAX_STEPS = 10
+# до стольких вокселей сетки занятость считается плотным массивом (O(N) без сортировки)
+_DENSE_CELLS = 1 << 27
+
+
+def _voxel_keys(P: np.ndarray, lo: np.ndarray, size: float) -> Tuple[np.ndarray, int]:
+    """Номер вокселя с ребром size для каждой точки и число вокселей сетки."""
+    c = ((P - lo) * (1.0 / size)).astype(np.int64)
+    # плотная нумерация: размеры сетки известны, коллизий нет
+    n = c.max(axis=0) + 1
+    return (c[:, 0] * n[1] + c[:, 1]) * n[2] + c[:, 2], int(n.prod())
+
+
+def _occupied(key: np.ndarray, ncells: int) -> np.ndarray:
+    """Индекс одной точки на каждый занятый воксель."""
+    if ncells <= _DENSE_CELLS:
+        # при повторах ключа остаётся какая-то из точек вокселя — для превью всё равно какая
+        rep = np.full(ncells, -1, dtype=np.int64)
+        rep[key] = np.arange(key.shape[0])
+        return rep[rep >= 0]
+    return np.unique(key, return_index=True)[1]
+
+
+def voxel_downsample(P: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Индексы (по возрастанию) не более max_points точек P (N,3), по одной на
+    воксель. Начальный размер вокселя — из площади XY в предположении 2.5D
+    сцены, затем он увеличивается по числу занятых вокселей, пока они не
+    уложатся в бюджет. Не-финитные точки отбрасываются.
+    """
+    finite = np.flatnonzero(np.isfinite(P).all(axis=1))
+    if finite.size <= max_points:
+        return finite
+    Q = P[finite] if finite.size < P.shape[0] else P
+    lo = Q.min(axis=0)
+    ext = Q.max(axis=0) - lo
+    size = float(np.sqrt(max(ext[0] * ext[1], 1e-12) / max_points)) or 1.0
+    for _ in range(_MAX_STEPS):
+        first = _occupied(*_voxel_keys(Q, lo, size))
+        if first.size <= max_points:
+            break
+        size *= max(1.05, float(np.sqrt(first.size / max_points)))
+    else:
+        # не сошлось (вырожденная геометрия) — равномерная выборка по индексам
+        first = np.linspace(0, Q.shape[0] - 1, max_points).astype(np.int64)
+    return finite[np.sort(first)]
+
+
+class PreviewCache:
+    """LRU по суммарному размеру: ключ — (ключ объекта, его ETag, бюджет) -> байты PCD."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[Tuple[str, str, int], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, int]) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key: Tuple[str, str, int], data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+@lru_cache()
+def get_preview_cache() -> PreviewCache:
+    return PreviewCache(int(get_settings().preview_cache_mb * 1024 * 1024))
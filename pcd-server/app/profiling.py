@@ -0,0 +1,156 @@
+"""
+Профиль очистки по этапам: стенное и процессорное время, память и счётчики
+(точки, клетки, компоненты, пики Hough) каждого этапа.
+
+Этапы отмечает сам код: with stage("grid"): …, count("grid", cells=…).
+Запись идёт в профиль, открытый profiled() выше по стеку вызовов (контекст
+вызова); без него stage/count ничего не делают — функции алгоритма
+вызываются и из тайлов, пула процессов и sweep. Повторный этап суммируется
+(calls — число входов); время вложенного этапа входит и во внешний (tiles
+тайлового режима включает components своих тайлов).
+
+Память этапа — пик RSS процесса к концу этапа и его рост за этап; при
+включённом tracemalloc (dump_profile) ещё пик аллокаций Python/NumPy внутри
+этапа.
+"""
+from __future__ import annotations
+import os, sys, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+_current: ContextVar[Optional["Profile"]] = ContextVar("pcd_profile", default=None)
+
+
+def peak_rss_mb() -> float | None:
+    """Пиковая резидентная память процесса, МБ (None, где resource недоступен)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb/1024.0 if sys.platform!="darwin" else kb/2**20, 1)
+
+
+class Profile:
+    def __init__(self):
+        self.stages: Dict[str, dict] = {}
+        # пики tracemalloc открытых этапов: stage сбрасывает общий пик, вложенный — поднимает внешние
+        self._peaks: List[int] = []
+
+    def _fold_peak(self, peak: int):
+        self._peaks[:]=[max(p, peak) for p in self._peaks]
+
+    def _entry(self, name: str) -> dict:
+        e=self.stages.get(name)
+        if e is None:
+            e=self.stages[name]={"calls": 0, "wall_s": 0.0, "cpu_s": 0.0}
+        return e
+
+    def add(self, name: str, wall: float, cpu: float, rss0: float | None, traced_peak: int | None):
+        e=self._entry(name)
+        e["calls"]+=1; e["wall_s"]+=wall; e["cpu_s"]+=cpu
+        rss=peak_rss_mb()
+        if rss is not None:
+            e["peak_rss_mb"]=rss
+            e["peak_rss_grow_mb"]=round(e.get("peak_rss_grow_mb", 0.0)+rss-(rss0 or rss), 1)
+        if traced_peak is not None:
+            e["traced_peak_mb"]=max(e.get("traced_peak_mb", 0.0), round(traced_peak/2**20, 1))
+
+    def count(self, name: str, **items):
+        e=self._entry(name)
+        for k,v in items.items():
+            e[k]=e.get(k, 0)+int(v)
+
+    def as_dict(self) -> dict:
+        return {k: {f: (round(v, 4) if isinstance(v, float) else v) for f,v in e.items()}
+                for k,e in self.stages.items()}
+
+
+@contextmanager
+def profiled():
+    """Профиль для этапов внутри блока; вложенный вызов пишет во внешний профиль."""
+    p=_current.get()
+    if p is not None:
+        yield p
+        return
+    p=Profile()
+    token=_current.set(p)
+    try:
+        yield p
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[Profile]:
+    return _current.get()
+
+
+def stages() -> dict:
+    """Этапы текущего профиля ({} вне profiled())."""
+    p=_current.get()
+    return p.as_dict() if p is not None else {}
+
+
+@contextmanager
+def stage(name: str):
+    p=_current.get()
+    if p is None:
+        yield
+        return
+    import tracemalloc
+    tracing=tracemalloc.is_tracing()
+    if tracing:
+        p._fold_peak(tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        p._peaks.append(0)
+    rss0=peak_rss_mb()
+    t0=time.perf_counter(); c0=time.process_time()
+    try:
+        yield
+    finally:
+        traced=None
+        if tracing:
+            traced=max(p._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            p._fold_peak(traced)
+        p.add(name, time.perf_counter()-t0, time.process_time()-c0, rss0, traced)
+
+
+def count(name: str, **items):
+    """Прибавить счётчики этапа name (points=…, cells=…); вне profiled() — ничего."""
+    p=_current.get()
+    if p is not None:
+        p.count(name, **items)
+
+
+@contextmanager
+def dump_profile(directory: str | None, name: str, frames: int = 8):
+    """
+    Снимки блока в directory (None — выключено): <name>.prof — cProfile
+    (pstats/snakeviz), <name>.tracemalloc — tracemalloc.Snapshot в конце
+    блока (frames кадров стека на аллокацию) и <name>.top.txt — крупнейшие
+    места аллокаций. tracemalloc заметно замедляет расчёт.
+    """
+    if not directory:
+        yield
+        return
+    import cProfile, tracemalloc
+    os.makedirs(directory, exist_ok=True)
+    base=os.path.join(directory, name)
+    prof=cProfile.Profile()
+    tracemalloc.start(frames)
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        snap=tracemalloc.take_snapshot()
+        # общий пик stage сбрасывает; пики этапов — в профиле (traced_peak_mb)
+        traced=tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        prof.dump_stats(base+".prof")
+        snap.dump(base+".tracemalloc")
+        with open(base+".top.txt", "w", encoding="utf-8") as f:
+            f.write(f"traced at the end: {traced/2**20:.1f} MB\n")
+            for s in snap.statistics("lineno")[:30]:
+                f.write(f"{s}\n")
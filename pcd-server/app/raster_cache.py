@@ -0,0 +1,75 @@
+"""
+Локальный кэш промежуточных данных очистки (точки, 2.5D сетка, «земля»,
+клетки точек) — по каталогу на содержимое оригинала (sha256). Содержимое каталога
+пишет и читает сам алгоритм (clearing_algorithm.cached_points/cached_ground),
+здесь — только размещение и вытеснение давно не использованных каталогов.
+"""
+import hashlib
+import os
+import shutil
+from functools import lru_cache
+from typing import Optional
+
+from .clearing_algorithm import POINTS_CACHE
+from .settings import get_settings
+
+
+class RasterCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def name_for(file_id: str, sha256: Optional[str], version: str) -> str:
+        """Имя каталога: sha256 содержимого (общий для одинаковых файлов) или версия оригинала файла."""
+        return sha256 or f"{file_id}-{hashlib.sha1(version.encode('utf-8')).hexdigest()[:12]}"
+
+    def dir_for(self, name: str) -> str:
+        """Каталог кэша; отметка времени каталога — время последнего использования."""
+        d = os.path.join(self.root, name)
+        os.makedirs(d, exist_ok=True)
+        os.utime(d)
+        return d
+
+    @staticmethod
+    def has_points(d: str) -> bool:
+        return os.path.exists(os.path.join(d, POINTS_CACHE))
+
+    def drop(self, name: str):
+        """Удалить кэш содержимого (sha256) или всех версий файла (file_id)."""
+        if not os.path.isdir(self.root):
+            return
+        for d in os.listdir(self.root):
+            if d == name or d.startswith(name + "-"):
+                shutil.rmtree(os.path.join(self.root, d), ignore_errors=True)
+
+    def evict(self, keep: Optional[str] = None):
+        """Удалять самые давно использованные каталоги, пока кэш больше max_bytes."""
+        if not os.path.isdir(self.root):
+            return
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            d = os.path.join(self.root, name)
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(d) if e.is_file())
+                entries.append((os.stat(d).st_mtime, size, d))
+            except OSError:
+                continue
+            total += size
+        for _, size, d in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if d == keep:
+                continue
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+
+
+@lru_cache()
+def get_raster_cache() -> Optional[RasterCache]:
+    """None, если кэш отключён (RASTER_CACHE_MAX_MB=0)."""
+    settings = get_settings()
+    if settings.raster_cache_max_mb <= 0:
+        return None
+    return RasterCache(settings.raster_cache_dir, int(settings.raster_cache_max_mb * 1024 * 1024))
@@ -1,55 +1,37 @@
-import io
+import base64
 import json
 import os
-import sqlite3
-import tempfile
+import re
 import uuid
+from contextlib import ExitStack
 from datetime import datetime
 from typing import Optional, List
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Response
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import PlainTextResponse
-
-from ..storage import get_minio_client, ensure_bucket, presigned_get_object, upload_bytes
-from ..settings import Settings, get_settings
-from ..schemas import FileRecord, CleanRequest, CleanResponse
-from ..worker import run_clean_process
+from minio.error import S3Error
+
+from ..storage import get_minio_client, ensure_bucket, presigned_get_object, remove_keys, upload_stream
+from ..settings import get_settings
+from ..db import get_db, init_db
+from ..schemas import (FileRecord, CleanRequest, JobRecord, SweepRequest, CloudKind, EditKind, LodRequest, PatchRecord,
+                       BatchCleanRequest)
+from ..worker import sweep_variants, apply_cached_clean, lod_index, OriginalChanged
+from ..masks import Cloud, file_cloud, cloud_etag, cloud_pcd, open_cloud
+from ..patches import (EDIT_KINDS, PatchConflict, apply_file_patch, reset_patches, list_patches,
+                       chain_base, version_pcd)
+from ..blobs import new_blob_key, acquire_blob, release_blob, purge, lod_prefix
+from ..jobs import get_job, get_job_manager, job_record
+from ..raster_cache import get_raster_cache
+from ..preview import voxel_downsample, get_preview_cache
+from ..pcd_io import read_pcd, xyz, PCDStream
+from ..metrics import record_transfer
 
 
 router = APIRouter()
 
 
-def get_db(settings: Settings):
-    con = sqlite3.connect(settings.sqlite_path)
-    con.row_factory = sqlite3.Row
-    return con
-
-
-def init_db(settings: Settings):
-    os.makedirs(os.path.dirname(settings.sqlite_path), exist_ok=True)
-    con = get_db(settings)
-    try:
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS files (
-                id TEXT PRIMARY KEY,
-                filename TEXT NOT NULL,
-                content_type TEXT,
-                size INTEGER,
-                created_at TEXT NOT NULL,
-                s3_key_original TEXT NOT NULL,
-                s3_key_cleaned TEXT,
-                s3_key_delta TEXT,
-                summary_json TEXT
-            )
-            """
-        )
-        con.commit()
-    finally:
-        con.close()
-
-
 @router.on_event("startup")
 def on_startup():
     settings = get_settings()
@@ -58,32 +40,46 @@ def on_startup():
     ensure_bucket(client, settings.minio_bucket)
 
 
+async def _upload(client, bucket: str, key: str, file: UploadFile):
+    """
+    Stream an uploaded file into MinIO part by part (Starlette spools the
+    request body to a temp file, we never hold the whole file in memory).
+    Returns (size, sha256).
+    """
+    await file.seek(0)
+    return await run_in_threadpool(upload_stream, client, bucket, key, file.file, file.content_type)
+
+
 @router.post("/upload", response_model=FileRecord)
 async def upload_file(file: UploadFile = File(...)):
     settings = get_settings()
     if not file.filename or not file.filename.lower().endswith(".pcd"):
         raise HTTPException(status_code=400, detail="Only .pcd files are supported")
 
-    data = await file.read()
     file_id = str(uuid.uuid4())
-    key = f"pcd/{file_id}/original/{file.filename}"
+    key = new_blob_key()
 
     client = get_minio_client(settings)
-    upload_bytes(client, settings.minio_bucket, key, data, file.content_type or "application/octet-stream")
+    size, sha256 = await _upload(client, settings.minio_bucket, key, file)
 
     con = get_db(settings)
     try:
+        # identical content is stored once; our copy is dropped if it already exists
+        stored_key = acquire_blob(con, sha256, key, size)
         now = datetime.utcnow().isoformat()
         con.execute(
-            "INSERT INTO files (id, filename, content_type, size, created_at, s3_key_original) VALUES (?,?,?,?,?,?)",
-            (file_id, file.filename, file.content_type, len(data), now, key),
+            "INSERT INTO files (id, filename, content_type, size, created_at, s3_key_original, sha256) VALUES (?,?,?,?,?,?,?)",
+            (file_id, file.filename, file.content_type, size, now, stored_key, sha256),
         )
         con.commit()
         rec = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
     finally:
         con.close()
+    if stored_key != key:
+        purge([key])
+    _submit_lod(file_id, ["original"])
 
-    url = presigned_get_object(client, settings.minio_bucket, key, expiry_seconds=3600)
+    url = presigned_get_object(client, settings.minio_bucket, stored_key, expiry_seconds=3600)
     return FileRecord(
         id=file_id,
         filename=rec["filename"],
@@ -93,28 +89,86 @@ async def upload_file(file: UploadFile = File(...)):
         cleaned_url=None,
         delta_url=None,
         summary=None,
+        sha256=rec["sha256"],
     )
 
 
+def _cloud_urls(r):
+    """Download URLs of the file's clouds (cleaned/delta may be derived from a removal mask)."""
+    return tuple(f"/api/files/{r['id']}/{kind}" if file_cloud(r, kind) else None
+                 for kind in ("original", "cleaned", "delta"))
+
+
+# columns a FileRecord is built from (listings do not need the rest)
+_RECORD_COLUMNS = "id, filename, size, created_at, s3_key_original, s3_key_cleaned, s3_key_delta, s3_key_mask, summary_json, sha256"
+# page size of GET /files
+LIST_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+
+def _file_record(r) -> FileRecord:
+    original_url, cleaned_url, delta_url = _cloud_urls(r)
+    summary = json.loads(r["summary_json"]) if r["summary_json"] else None
+    return FileRecord(
+        id=r["id"], filename=r["filename"], size=r["size"], created_at=r["created_at"],
+        original_url=original_url, cleaned_url=cleaned_url, delta_url=delta_url, summary=summary,
+        sha256=r["sha256"],
+    )
+
+
+def _encode_cursor(r) -> str:
+    return base64.urlsafe_b64encode(json.dumps([r["created_at"], r["id"]]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, file_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(file_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/files", response_model=List[FileRecord])
-def list_files():
+def list_files(request: Request, response: Response,
+               limit: int = Query(LIST_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+               cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+               filename: Optional[str] = Query(None, description="case-insensitive filename prefix"),
+               sha256: Optional[str] = None,
+               cleaned: Optional[bool] = Query(None, description="only files with (true) or without (false) a clean result")):
+    """
+    Newest files first, one page at a time. The next page is requested with the
+    cursor from the X-Next-Cursor header (also given as a Link rel="next"); the
+    header is absent on the last page. Keyset pagination: a page costs the same
+    at any depth.
+    """
+    where, args = [], []
+    if cursor:
+        where.append("(created_at, id) < (?, ?)")
+        args += _decode_cursor(cursor)
+    if filename:
+        where.append("filename LIKE ? ESCAPE '\\'")
+        args.append(re.sub(r"([\\%_])", r"\\\1", filename) + "%")
+    if sha256:
+        where.append("sha256 = ?")
+        args.append(sha256)
+    if cleaned is not None:
+        where.append(("" if cleaned else "NOT ") + "(s3_key_cleaned IS NOT NULL OR s3_key_mask IS NOT NULL)")
+    sql = f"SELECT {_RECORD_COLUMNS} FROM files"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     settings = get_settings()
     con = get_db(settings)
     try:
-        rows = con.execute("SELECT * FROM files ORDER BY created_at DESC").fetchall()
+        rows = con.execute(sql, (*args, limit + 1)).fetchall()
     finally:
         con.close()
-    out: List[FileRecord] = []
-    for r in rows:
-        original_url = f"/api/files/{r['id']}/original" if r["s3_key_original"] else None
-        cleaned_url = f"/api/files/{r['id']}/cleaned" if r["s3_key_cleaned"] else None
-        delta_url = f"/api/files/{r['id']}/delta" if r["s3_key_delta"] else None
-        summary = json.loads(r["summary_json"]) if r["summary_json"] else None
-        out.append(FileRecord(
-            id=r["id"], filename=r["filename"], size=r["size"], created_at=r["created_at"],
-            original_url=original_url, cleaned_url=cleaned_url, delta_url=delta_url, summary=summary
-        ))
-    return out
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1])
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return [_file_record(r) for r in rows]
 
 
 @router.get("/files/{file_id}", response_model=FileRecord)
@@ -122,25 +176,22 @@ def get_file(file_id: str):
     settings = get_settings()
     con = get_db(settings)
     try:
-        r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
+        r = con.execute(f"SELECT {_RECORD_COLUMNS} FROM files WHERE id=?", (file_id,)).fetchone()
     finally:
         con.close()
     if not r:
         raise HTTPException(status_code=404, detail="Not found")
-    original_url = f"/api/files/{r['id']}/original" if r["s3_key_original"] else None
-    cleaned_url = f"/api/files/{r['id']}/cleaned" if r["s3_key_cleaned"] else None
-    delta_url = f"/api/files/{r['id']}/delta" if r["s3_key_delta"] else None
-    summary = json.loads(r["summary_json"]) if r["summary_json"] else None
-    return FileRecord(
-        id=r["id"], filename=r["filename"], size=r["size"], created_at=r["created_at"],
-        original_url=original_url, cleaned_url=cleaned_url, delta_url=delta_url, summary=summary
-    )
+    return _file_record(r)
 
 
-@router.post("/files/{file_id}/clean", response_model=CleanResponse)
-def clean_file(file_id: str, req: CleanRequest):
+@router.post("/files/{file_id}/clean", response_model=JobRecord, status_code=202)
+def clean_file(file_id: str, req: CleanRequest, response: Response):
+    """
+    Ставит очистку в очередь; статус и результат — GET /api/jobs/{id}. Если
+    это содержимое уже очищалось с теми же параметрами, результат привязывается
+    сразу и возвращается завершённая задача (200).
+    """
     settings = get_settings()
-    # fetch db
     con = get_db(settings)
     try:
         r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
@@ -148,79 +199,175 @@ def clean_file(file_id: str, req: CleanRequest):
         con.close()
     if not r:
         raise HTTPException(status_code=404, detail="Not found")
-
-    client = get_minio_client(settings)
-    # download original to temp
-    import minio
-    tmpdir = tempfile.mkdtemp(prefix="pcd_")
-    original_local = os.path.join(tmpdir, os.path.basename(r["s3_key_original"]))
-    with open(original_local, "wb") as f:
-        data = client.get_object(settings.minio_bucket, r["s3_key_original"]).read()
-        f.write(data)
-
-    cleaned_local = os.path.join(tmpdir, "cleaned.pcd")
-    delta_local = os.path.join(tmpdir, "delta.pcd")
-    # run cleaning directly
-    summary = run_clean_process(original_local, cleaned_local, req, delta_out_path=delta_local)
-
-    # prepare delta: points removed saved by algorithm as cleaned vs original; we will try reading optional removed file
-    delta_key: Optional[str] = None
-    if os.path.exists(delta_local):
-        with open(delta_local, "rb") as f:
-            delta_data = f.read()
-        delta_key = f"pcd/{file_id}/delta/delta.pcd"
-        upload_bytes(client, settings.minio_bucket, delta_key, delta_data, "application/octet-stream")
-
-    # upload cleaned and summary
-    with open(cleaned_local, "rb") as f:
-        cleaned_data = f.read()
-    cleaned_key = f"pcd/{file_id}/cleaned/cleaned.pcd"
-    upload_bytes(client, settings.minio_bucket, cleaned_key, cleaned_data, "application/octet-stream")
-
-    summary_key = f"pcd/{file_id}/cleaned/summary.json"
-    upload_bytes(client, settings.minio_bucket, summary_key, json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8"), "application/json")
-
-    # update db
+    try:
+        cached = apply_cached_clean(r, req)
+    except OriginalChanged as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if cached:
+        response.status_code = 200
+        return job_record(get_job(get_job_manager().record_done(file_id, req, cached)))
+    job_id = get_job_manager().submit(file_id, req)
+    return job_record(get_job(job_id))
+
+
+@router.post("/files/{file_id}/sweep", response_model=JobRecord, status_code=202)
+def sweep_file(file_id: str, req: SweepRequest):
+    """Перебор параметров очистки как задача; сводки вариантов — в result задачи."""
+    settings = get_settings()
     con = get_db(settings)
     try:
-        con.execute(
-            "UPDATE files SET s3_key_cleaned=?, s3_key_delta=?, summary_json=? WHERE id=?",
-            (cleaned_key, delta_key, json.dumps(summary, ensure_ascii=False), file_id),
-        )
-        con.commit()
+        r = con.execute("SELECT id FROM files WHERE id=?", (file_id,)).fetchone()
+    finally:
+        con.close()
+    if not r:
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        sweep_variants(req)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job_id = get_job_manager().submit(file_id, req, kind="sweep")
+    return job_record(get_job(job_id))
+
+
+@router.post("/batch/clean", response_model=JobRecord, status_code=202)
+def clean_batch(req: BatchCleanRequest):
+    """
+    Очистка многих файлов одной задачей (kind=batch) в пуле из req.jobs процессов
+    со скачиванием следующих оригиналов впрок; итоги по файлам и общая
+    пропускная способность — в result задачи.
+    """
+    ids = list(dict.fromkeys(req.file_ids))
+    settings = get_settings()
+    con = get_db(settings)
+    try:
+        found = {r["id"] for r in con.execute(
+            f"SELECT id FROM files WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()}
     finally:
         con.close()
+    missing = [i for i in ids if i not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Not found: {', '.join(missing)}")
+    job_id = get_job_manager().submit("", req, kind="batch")
+    return job_record(get_job(job_id))
 
-    cleaned_url = f"/api/files/{file_id}/cleaned"
-    delta_url = f"/api/files/{file_id}/delta" if delta_key else None
-    original_url = f"/api/files/{file_id}/original"
 
-    return CleanResponse(
-        id=file_id,
-        original_url=original_url,
-        cleaned_url=cleaned_url,
-        delta_url=delta_url,
-        summary=summary,
-    )
+# streaming chunk size: ~1/16 of the response, clamped to [64 KiB, 1 MiB]
+_CHUNK_MIN = 64 * 1024
+_CHUNK_MAX = 1024 * 1024
+# the URLs are stable while their content may be replaced, so browsers keep the body but revalidate
+_CACHE_CONTROL = "private, no-cache"
+
+
+def _chunk_size(length: int) -> int:
+    return max(_CHUNK_MIN, min(_CHUNK_MAX, length // 16))
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match / If-Range comparison (weak, as If-None-Match requires)."""
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+def _parse_range(header: Optional[str], size: int):
+    """
+    (start, end) inclusive for a single 'bytes=' range, None to serve the whole object
+    (no header, other units or several ranges); 416 if the range is unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # suffix range: the last N bytes
+            start = max(0, size - int(last))
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end and first and last:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def _stat_object(client, bucket: str, key: str):
+    try:
+        return client.stat_object(bucket, key)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject"):
+            raise HTTPException(status_code=404, detail="Not found")
+        raise
+
+
+def _cloud_etag(client, bucket: str, cloud: Cloud) -> str:
+    try:
+        return cloud_etag(client, bucket, cloud)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject"):
+            raise HTTPException(status_code=404, detail="Not found")
+        raise
+
 
+def _stream_minio_object(request: Request, bucket: str, key: str, filename: Optional[str] = None):
+    """
+    Object download with Content-Length, a strong ETag (MinIO's), If-None-Match -> 304
+    and single byte ranges forwarded to MinIO as ranged GETs.
+    """
+    from starlette.responses import StreamingResponse
 
-def _stream_minio_object(bucket: str, key: str, filename: Optional[str] = None):
     settings = get_settings()
     client = get_minio_client(settings)
-    response = client.get_object(bucket, key)
+    stat = _stat_object(client, bucket, key)
+    etag = f'"{stat.etag}"'
+    resolved_filename = filename or os.path.basename(key)
+    headers = {
+        'Content-Disposition': f'attachment; filename="{resolved_filename}"',
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Cache-Control': _CACHE_CONTROL,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={k: headers[k] for k in ('ETag', 'Cache-Control')})
+
+    size = stat.size
+    rng = _parse_range(request.headers.get("range"), size)
+    # If-Range: a resumed download of a changed object gets the whole new object
+    if_range = request.headers.get("if-range")
+    if rng and if_range and if_range != etag:
+        rng = None
+    status_code = 200
+    offset, length = 0, size
+    if rng:
+        offset, length = rng[0], rng[1] - rng[0] + 1
+        status_code = 206
+        headers['Content-Range'] = f'bytes {rng[0]}-{rng[1]}/{size}'
+    headers['Content-Length'] = str(length)
+    if length == 0:
+        return Response(status_code=status_code, headers=headers,
+                        media_type=stat.content_type or 'application/octet-stream')
+
+    response = client.get_object(bucket, key, offset=offset, length=length if rng else 0)
     try:
-        import types
-        from starlette.responses import StreamingResponse
-        resolved_filename = filename or os.path.basename(key)
+        chunk = _chunk_size(length)
         def iterator():
-            for d in response.stream(amt=8*1024):
-                yield d
+            try:
+                for d in response.stream(amt=chunk):
+                    yield d
+            finally:
+                record_transfer("download", response.tell())
+                response.close()
+                response.release_conn()
         return StreamingResponse(
             iterator(),
-            media_type=response.getheader('Content-Type') or 'application/octet-stream',
-            headers={
-                'Content-Disposition': f'attachment; filename="{resolved_filename}"'
-            }
+            status_code=status_code,
+            media_type=stat.content_type or 'application/octet-stream',
+            headers=headers,
         )
     except Exception:
         response.close()
@@ -228,8 +375,40 @@ def _stream_minio_object(bucket: str, key: str, filename: Optional[str] = None):
         raise
 
 
+def _stream_cloud(request: Request, cloud: Cloud, filename: str):
+    """
+    Download of a cloud: stored objects as above; clouds derived from a removal
+    mask are assembled from the original on the fly as binary PCD, with
+    Content-Length and an ETag of both sources but without range support.
+    """
+    from starlette.responses import StreamingResponse
+
+    settings = get_settings()
+    if cloud.mask is None:
+        return _stream_minio_object(request, settings.minio_bucket, cloud.key, filename=filename)
+    client = get_minio_client(settings)
+    etag = f'"{_cloud_etag(client, settings.minio_bucket, cloud)}"'
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Accept-Ranges': 'none',
+        'ETag': etag,
+        'Cache-Control': _CACHE_CONTROL,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={k: headers[k] for k in ('ETag', 'Cache-Control')})
+
+    # the MinIO responses stay open until the body is sent
+    stack = ExitStack()
+    size, chunks = stack.enter_context(cloud_pcd(client, settings.minio_bucket, cloud))
+    headers['Content-Length'] = str(size)
+    def iterator():
+        with stack:
+            yield from chunks
+    return StreamingResponse(iterator(), media_type='application/octet-stream', headers=headers)
+
+
 @router.get("/files/{file_id}/original")
-def download_original(file_id: str):
+def download_original(file_id: str, request: Request):
     settings = get_settings()
     con = get_db(settings)
     try:
@@ -241,22 +420,23 @@ def download_original(file_id: str):
     original_name = r["filename"] or "file.pcd"
     if not original_name.lower().endswith(".pcd"):
         original_name = f"{original_name}.pcd"
-    return _stream_minio_object(settings.minio_bucket, r["s3_key_original"], filename=original_name)
+    return _stream_minio_object(request, settings.minio_bucket, r["s3_key_original"], filename=original_name)
 
 
 @router.get("/files/{file_id}/cleaned")
-def download_cleaned(file_id: str):
+def download_cleaned(file_id: str, request: Request):
     settings = get_settings()
     con = get_db(settings)
     try:
         r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
     finally:
         con.close()
-    if not r or not r["s3_key_cleaned"]:
+    cloud = file_cloud(r, "cleaned") if r else None
+    if not cloud:
         raise HTTPException(status_code=404, detail="Not found")
     base, _ = os.path.splitext((r["filename"] or "file").rstrip())
     cleaned_name = f"{base}_cleaned.pcd"
-    return _stream_minio_object(settings.minio_bucket, r["s3_key_cleaned"], filename=cleaned_name)
+    return _stream_cloud(request, cloud, filename=cleaned_name)
 
 
 @router.get("/parameters", response_class=PlainTextResponse)
@@ -275,18 +455,117 @@ def get_parameters_description():
 
 
 @router.get("/files/{file_id}/delta")
-def download_delta(file_id: str):
+def download_delta(file_id: str, request: Request):
     settings = get_settings()
     con = get_db(settings)
     try:
         r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
     finally:
         con.close()
-    if not r or not r["s3_key_delta"]:
+    cloud = file_cloud(r, "delta") if r else None
+    if not cloud:
         raise HTTPException(status_code=404, detail="Not found")
     base, _ = os.path.splitext((r["filename"] or "file").rstrip())
     delta_name = f"{base}_delta.pcd"
-    return _stream_minio_object(settings.minio_bucket, r["s3_key_delta"], filename=delta_name)
+    return _stream_cloud(request, cloud, filename=delta_name)
+
+
+# octree node names: "r" followed by octant digits
+_LOD_NODE = re.compile(r"^r[0-7]*$")
+
+
+def _submit_lod(file_id: str, kinds: List[str]):
+    """Queue an octree build after the file's clouds changed (LOD_AUTO)."""
+    if get_settings().lod_auto:
+        get_job_manager().submit(file_id, LodRequest(kinds=kinds), kind="lod")
+
+
+def _cloud(file_id: str, kind: str) -> Cloud:
+    settings = get_settings()
+    con = get_db(settings)
+    try:
+        r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
+    finally:
+        con.close()
+    cloud = file_cloud(r, kind) if r else None
+    if not cloud:
+        raise HTTPException(status_code=404, detail="Not found")
+    return cloud
+
+
+@router.post("/files/{file_id}/lod", response_model=JobRecord, status_code=202)
+def build_file_lod(file_id: str, req: LodRequest):
+    """Queue an octree build for the file's clouds; status via GET /api/jobs/{id}."""
+    settings = get_settings()
+    con = get_db(settings)
+    try:
+        r = con.execute("SELECT id FROM files WHERE id=?", (file_id,)).fetchone()
+    finally:
+        con.close()
+    if not r:
+        raise HTTPException(status_code=404, detail="Not found")
+    job_id = get_job_manager().submit(file_id, req, kind="lod")
+    return job_record(get_job(job_id))
+
+
+@router.get("/files/{file_id}/lod/{kind}")
+def get_file_lod(file_id: str, kind: CloudKind):
+    """
+    Octree hierarchy: cube, root spacing and point count per node. Nodes are
+    fetched from node_url with {name} substituted; 404 until the octree is built.
+    """
+    index = lod_index(_cloud(file_id, kind))
+    if index is None:
+        raise HTTPException(status_code=404, detail="LOD not built")
+    index.pop("source_etag", None)
+    index["node_url"] = f"/api/files/{file_id}/lod/{kind}/nodes/{{name}}"
+    return index
+
+
+@router.get("/files/{file_id}/lod/{kind}/nodes/{name}")
+def download_lod_node(file_id: str, kind: CloudKind, name: str, request: Request):
+    """One octree node as binary PCD (x y z float32)."""
+    if not _LOD_NODE.match(name):
+        raise HTTPException(status_code=404, detail="Not found")
+    settings = get_settings()
+    key = f"{lod_prefix(_cloud(file_id, kind).key)}nodes/{name}.pcd"
+    return _stream_minio_object(request, settings.minio_bucket, key, filename=f"{name}.pcd")
+
+
+# upper bound of the preview point budget
+PREVIEW_MAX_POINTS = 5_000_000
+
+
+@router.get("/files/{file_id}/preview")
+def preview_file(file_id: str, request: Request,
+                 max_points: int = Query(200_000, ge=1, le=PREVIEW_MAX_POINTS),
+                 kind: CloudKind = Query("original")):
+    """
+    Spatially uniform voxel-downsampled cloud as binary PCD (all fields), at most
+    max_points points. Cached in memory per (object version, budget).
+    """
+    settings = get_settings()
+    cloud = _cloud(file_id, kind)
+    client = get_minio_client(settings)
+    etag = _cloud_etag(client, settings.minio_bucket, cloud)
+    headers = {
+        'ETag': f'"{etag}-{max_points}"',
+        'Cache-Control': _CACHE_CONTROL,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), headers['ETag']):
+        return Response(status_code=304, headers=headers)
+
+    cache = get_preview_cache()
+    cache_key = (cloud.key, etag, max_points)
+    data = cache.get(cache_key)
+    if data is None:
+        with open_cloud(client, settings.minio_bucket, cloud) as f:
+            rec = read_pcd(f)
+        data = PCDStream(rec[voxel_downsample(xyz(rec), max_points)], data="binary").read()
+        del rec
+        cache.put(cache_key, data)
+    headers['Content-Disposition'] = f'inline; filename="{kind}_preview.pcd"'
+    return Response(content=data, media_type="application/octet-stream", headers=headers)
 
 
 @router.delete("/files/{file_id}", status_code=204)
@@ -301,26 +580,29 @@ def delete_file_and_data(file_id: str):
     if not row:
         raise HTTPException(status_code=404, detail="Not found")
 
-    # Delete all S3 objects under this file's prefix
-    client = get_minio_client(settings)
-    prefix = f"pcd/{file_id}/"
-    try:
-        for obj in client.list_objects(settings.minio_bucket, prefix=prefix, recursive=True):
-            try:
-                client.remove_object(settings.minio_bucket, obj.object_name)
-            except Exception:
-                pass
-    except Exception:
-        # proceed to try to remove DB row regardless
-        pass
+    # Stop pending cleaning so it does not re-create objects after deletion
+    get_job_manager().cancel_file(file_id)
+    cache = get_raster_cache()
+    if cache:
+        cache.drop(file_id)
+
+    # Delete all S3 objects under this file's prefixes (shared blobs/results live elsewhere) in batches.
+    # Keep the DB row if some could not be deleted, so that the delete can be retried.
+    failed = remove_keys(get_minio_client(settings), settings.minio_bucket,
+                         [f"pcd/{file_id}/", lod_prefix(f"pcd/{file_id}")])
+    if failed:
+        raise HTTPException(status_code=502, detail=f"Storage error: could not delete {len(failed)} object(s)")
 
-    # Remove DB row
+    # Remove DB row; the shared original and its cached results go with the last reference
     con = get_db(settings)
     try:
+        orphaned = release_blob(con, row["sha256"], row["s3_key_original"])
+        orphaned += reset_patches(con, file_id, EDIT_KINDS)
         con.execute("DELETE FROM files WHERE id=?", (file_id,))
         con.commit()
     finally:
         con.close()
+    purge(orphaned)
 
     return Response(status_code=204)
 
@@ -339,24 +621,34 @@ async def save_original(file_id: str, file: UploadFile = File(...)):
     finally:
         con.close()
 
-    data = await file.read()
+    # Results of pending cleaning would belong to the replaced original
+    get_job_manager().cancel_file(file_id)
+    cache = get_raster_cache()
+    if cache:
+        cache.drop(file_id)
+
     client = get_minio_client(settings)
     # Upload new original
-    key = f"pcd/{file_id}/original/{file.filename}"
-    upload_bytes(client, settings.minio_bucket, key, data, file.content_type or "application/octet-stream")
+    key = new_blob_key()
+    size, sha256 = await _upload(client, settings.minio_bucket, key, file)
 
-    # Update DB: set original, clear cleaned and delta because they are invalidated
+    # Update DB: set original, clear cleaned, delta and mask because they are invalidated
     con = get_db(settings)
     try:
+        stored_key = acquire_blob(con, sha256, key, size)
+        orphaned = release_blob(con, r["sha256"], r["s3_key_original"])
+        orphaned += reset_patches(con, file_id, EDIT_KINDS)
         now = datetime.utcnow().isoformat()
         con.execute(
-            "UPDATE files SET filename=?, size=?, created_at=?, s3_key_original=?, s3_key_cleaned=NULL, s3_key_delta=NULL, summary_json=NULL WHERE id=?",
-            (file.filename, len(data), now, key, file_id),
+            "UPDATE files SET filename=?, size=?, created_at=?, s3_key_original=?, sha256=?, s3_key_cleaned=NULL, s3_key_delta=NULL, s3_key_mask=NULL, summary_json=NULL WHERE id=?",
+            (file.filename, size, now, stored_key, sha256, file_id),
         )
         con.commit()
         r2 = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
     finally:
         con.close()
+    purge(orphaned + ([key] if stored_key != key else []))
+    _submit_lod(file_id, ["original"])
 
     original_url = f"/api/files/{file_id}/original"
     cleaned_url = None
@@ -370,6 +662,7 @@ async def save_original(file_id: str, file: UploadFile = File(...)):
         cleaned_url=cleaned_url,
         delta_url=delta_url,
         summary=None,
+        sha256=r2["sha256"],
     )
 
 
@@ -387,11 +680,10 @@ async def save_cleaned(file_id: str, file: UploadFile = File(...)):
     finally:
         con.close()
 
-    data = await file.read()
     client = get_minio_client(settings)
     # Upload new cleaned
     key = f"pcd/{file_id}/cleaned/{file.filename}"
-    upload_bytes(client, settings.minio_bucket, key, data, file.content_type or "application/octet-stream")
+    await _upload(client, settings.minio_bucket, key, file)
 
     # Preserve delta when cleaned is replaced
     con = get_db(settings)
@@ -400,14 +692,15 @@ async def save_cleaned(file_id: str, file: UploadFile = File(...)):
             "UPDATE files SET s3_key_cleaned=? WHERE id=?",
             (key, file_id),
         )
+        orphaned = reset_patches(con, file_id, ["cleaned"])
         con.commit()
         r2 = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
     finally:
         con.close()
+    purge(orphaned)
+    _submit_lod(file_id, ["cleaned"])
 
-    original_url = f"/api/files/{file_id}/original" if r2["s3_key_original"] else None
-    cleaned_url = f"/api/files/{file_id}/cleaned"
-    delta_url = f"/api/files/{file_id}/delta" if r2["s3_key_delta"] else None
+    original_url, cleaned_url, delta_url = _cloud_urls(r2)
     summary = json.loads(r2["summary_json"]) if r2["summary_json"] else None
     return FileRecord(
         id=file_id,
@@ -418,4 +711,126 @@ async def save_cleaned(file_id: str, file: UploadFile = File(...)):
         cleaned_url=cleaned_url,
         delta_url=delta_url,
         summary=summary,
+        sha256=r2["sha256"],
     )
+
+
+# a patch carries the edit only, but appended points are raw xyz: keep a sane upper bound
+PATCH_MAX_BYTES = 512 * 1024 * 1024
+
+
+async def _read_body(request: Request, limit: int) -> bytes:
+    """
+    Request body of at most limit bytes. A larger body is rejected with 413 by
+    its Content-Length before reading, or as soon as the stream passes the
+    limit, so it is never held in memory whole.
+    """
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail="Patch too large")
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail="Patch too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _patch_record(row) -> PatchRecord:
+    base = f"/api/files/{row['file_id']}/patches/{row['kind']}/{row['seq']}"
+    return PatchRecord(
+        file_id=row["file_id"], kind=row["kind"], seq=row["seq"], points_before=row["points_before"],
+        removed=row["removed"], added=row["added"], created_at=row["created_at"],
+        patch_url=base, cloud_url=f"{base}/cloud",
+    )
+
+
+@router.post("/files/{file_id}/patch/{kind}", response_model=FileRecord)
+async def patch_cloud(file_id: str, kind: EditKind, request: Request):
+    """
+    Apply an edit (removed point indices or mask + appended xyz points, see
+    patches.py for the binary layout) to the stored original or cleaned cloud
+    instead of re-uploading it. Indices refer to the point order of the cloud
+    as downloaded. If-Match with the cloud's ETag guards against editing a
+    stale version (412); a patch for a different point count gives 409.
+    """
+    settings = get_settings()
+    con = get_db(settings)
+    try:
+        r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
+    finally:
+        con.close()
+    cloud = file_cloud(r, kind) if r else None
+    if not cloud:
+        raise HTTPException(status_code=404, detail="Not found")
+    if_match = request.headers.get("if-match")
+    if if_match:
+        etag = f'"{_cloud_etag(get_minio_client(settings), settings.minio_bucket, cloud)}"'
+        if if_match.strip() != "*" and etag not in [t.strip() for t in if_match.split(",")]:
+            raise HTTPException(status_code=412, detail="Cloud changed since it was downloaded")
+    data = await _read_body(request, PATCH_MAX_BYTES)
+
+    if kind == "original":
+        # Results of pending cleaning would belong to the replaced original
+        get_job_manager().cancel_file(file_id)
+    try:
+        await run_in_threadpool(apply_file_patch, file_id, kind, data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Not found")
+    except PatchConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if kind == "original":
+        cache = get_raster_cache()
+        if cache:
+            cache.drop(file_id)
+    _submit_lod(file_id, [kind])
+    return get_file(file_id)
+
+
+@router.get("/files/{file_id}/patches", response_model=List[PatchRecord])
+def get_patches(file_id: str, kind: Optional[EditKind] = None):
+    """Patch log of the file's clouds since they were last replaced or re-cleaned."""
+    return [_patch_record(row) for row in list_patches(file_id, kind)]
+
+
+def _patch_chain(file_id: str, kind: str, seq: int):
+    rows = [row for row in list_patches(file_id, kind) if row["seq"] <= seq]
+    if not rows or rows[-1]["seq"] != seq:
+        raise HTTPException(status_code=404, detail="Not found")
+    return rows
+
+
+@router.get("/files/{file_id}/patches/{kind}/{seq}")
+def download_patch(file_id: str, kind: EditKind, seq: int, request: Request):
+    """Body of one patch as it was uploaded."""
+    settings = get_settings()
+    row = _patch_chain(file_id, kind, seq)[-1]
+    return _stream_minio_object(request, settings.minio_bucket, row["patch_key"], filename=f"{kind}-{seq}.patch")
+
+
+@router.get("/files/{file_id}/patches/{kind}/{seq}/cloud")
+def download_patched_version(file_id: str, kind: EditKind, seq: int, request: Request):
+    """
+    The cloud as it was after patch seq (0: before the first patch), rebuilt
+    from the chain base and the logged patches as binary PCD.
+    """
+    from starlette.responses import StreamingResponse
+
+    filename = f"{kind}-v{seq}.pcd"
+    if seq == 0:
+        return _stream_cloud(request, chain_base(_patch_chain(file_id, kind, 1)), filename=filename)
+    rows = _patch_chain(file_id, kind, seq)
+    settings = get_settings()
+    client = get_minio_client(settings)
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    stack = ExitStack()
+    size, chunks = stack.enter_context(version_pcd(client, settings.minio_bucket, rows))
+    headers['Content-Length'] = str(size)
+    def iterator():
+        with stack:
+            yield from chunks
+    return StreamingResponse(iterator(), media_type='application/octet-stream', headers=headers)
+
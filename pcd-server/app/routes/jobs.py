@@ -0,0 +1,53 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from ..db import get_db
+from ..jobs import get_job, get_job_manager, job_record, FINAL
+from ..schemas import JobRecord
+from ..settings import get_settings
+
+
+router = APIRouter()
+
+
+@router.get("/jobs", response_model=List[JobRecord])
+def list_jobs(file_id: Optional[str] = None, status: Optional[str] = None, kind: Optional[str] = None,
+              limit: int = Query(100, ge=1, le=1000)):
+    settings = get_settings()
+    sql = "SELECT * FROM jobs"
+    where, args = [], []
+    if file_id:
+        where.append("file_id=?"); args.append(file_id)
+    if status:
+        where.append("status=?"); args.append(status)
+    if kind:
+        where.append("kind=?"); args.append(kind)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    args.append(limit)
+    con = get_db(settings)
+    try:
+        rows = con.execute(sql, args).fetchall()
+    finally:
+        con.close()
+    return [job_record(r) for r in rows]
+
+
+@router.get("/jobs/{job_id}", response_model=JobRecord)
+def get_job_status(job_id: str):
+    r = get_job(job_id)
+    if not r:
+        raise HTTPException(status_code=404, detail="Not found")
+    return job_record(r)
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobRecord)
+def cancel_job(job_id: str):
+    r = get_job(job_id)
+    if not r:
+        raise HTTPException(status_code=404, detail="Not found")
+    if r["status"] in FINAL or not get_job_manager().cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job already {get_job(job_id)['status']}")
+    return job_record(get_job(job_id))
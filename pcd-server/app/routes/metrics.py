@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..jobs import get_job_manager
+from ..metrics import REGISTRY
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of the API process and of finished jobs."""
+    stats = get_job_manager().stats()
+    text = REGISTRY.render(gauges={
+        "pcd_jobs_queued": ("Jobs waiting in the queue", stats["queued"]),
+        "pcd_jobs_running": ("Jobs with a running worker process", stats["running"]),
+    })
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,4 +1,4 @@
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Literal, Union
 from pydantic import BaseModel, Field
 
 
@@ -11,6 +11,7 @@ class FileRecord(BaseModel):
     cleaned_url: Optional[str]
     delta_url: Optional[str]
     summary: Optional[Dict[str, Any]]
+    sha256: Optional[str] = None     # sha256 оригинала
 
 
 class CleanRequest(BaseModel):
@@ -34,6 +35,16 @@ class CleanRequest(BaseModel):
     hough_max_w: float = Field(4.5)
     hough_dilate: int = Field(1)
     debug_dump: bool = Field(False)
+    memory_budget_mb: Optional[float] = Field(None)
+    tile_halo: Optional[float] = Field(None)
+    workers: int = Field(1, ge=1)
+    # шаг int32-квантования координат, м (coords.py); None — координаты во float32 полях файла
+    coord_quantum: Optional[float] = Field(None, gt=0)
+    # хранить только маску удаления (masks.py), cleaned/delta собираются из оригинала при чтении
+    store_mask: bool = Field(False)
+    # сохранить состояние очистки для инкрементальной переочистки после правки оригинала
+    # (incremental.py; в памяти при workers=1)
+    keep_state: bool = Field(False)
 
 
 class CleanResponse(BaseModel):
@@ -44,3 +55,97 @@ class CleanResponse(BaseModel):
     summary: Optional[Dict[str, Any]]
 
 
+class SweepRequest(BaseModel):
+    base: CleanRequest = Field(default_factory=CleanRequest)
+    # переопределения base; каждое комбинируется со всеми сочетаниями grid
+    variants: List[Dict[str, Any]] = Field(default_factory=list)
+    # параметр -> список значений (декартово произведение)
+    grid: Dict[str, List[Any]] = Field(default_factory=dict)
+    # индекс варианта, результат которого сохранить как cleaned/delta
+    persist: Optional[int] = Field(None, ge=0)
+
+
+class SweepVariant(BaseModel):
+    index: int
+    params: Dict[str, Any]
+    input_points: int
+    removed_points: int
+    seconds: float
+    timings: Dict[str, float]
+
+
+class SweepResponse(BaseModel):
+    id: str
+    variants: List[SweepVariant]
+    persisted: Optional[CleanResponse] = None
+
+
+CloudKind = Literal["original", "cleaned", "delta"]
+
+
+# облака, которые правятся патчами
+EditKind = Literal["original", "cleaned"]
+
+
+class PatchRecord(BaseModel):
+    file_id: str
+    kind: EditKind
+    seq: int
+    points_before: int              # точек в версии, к которой применён патч
+    removed: int
+    added: int
+    created_at: str
+    patch_url: str                  # тело патча
+    cloud_url: str                  # версия после патча (восстанавливается из журнала)
+
+
+class LodRequest(BaseModel):
+    kinds: List[CloudKind] = Field(default_factory=lambda: ["original", "cleaned", "delta"])
+    # перестроить, даже если октодерево актуально
+    force: bool = Field(False)
+
+
+class LodResponse(BaseModel):
+    id: str
+    # облако -> число узлов октодерева (облака, которых у файла нет, отсутствуют)
+    nodes: Dict[str, int]
+
+
+class BatchCleanRequest(BaseModel):
+    file_ids: List[str] = Field(min_length=1, max_length=10000)
+    params: CleanRequest = Field(default_factory=CleanRequest)
+    # файлов, очищаемых одновременно (процессов); столько же оригиналов скачивается впрок
+    jobs: int = Field(2, ge=1, le=32)
+
+
+class BatchFileResult(BaseModel):
+    id: str
+    status: str                      # done | cached | failed
+    error: Optional[str] = None
+    input_points: Optional[int] = None
+    removed_points: Optional[int] = None
+    download_seconds: float = 0.0
+    seconds: float = 0.0             # очистка и выгрузка результатов
+    points_per_s: Optional[float] = None
+    result: Optional[CleanResponse] = None
+
+
+class BatchCleanResponse(BaseModel):
+    files: List[BatchFileResult]
+    input_points: int                # очищенных в пакете (без cached)
+    seconds: float
+    points_per_s: float
+
+
+class JobRecord(BaseModel):
+    id: str
+    file_id: str
+    kind: str = "clean"              # clean | sweep | lod | batch
+    status: str                      # queued | running | done | failed | cancelled
+    progress: float = 0.0
+    stage: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    result: Optional[Union[CleanResponse, SweepResponse, LodResponse, BatchCleanResponse]] = None
@@ -13,8 +13,28 @@ class Settings(BaseSettings):
     minio_secure: bool = Field(default=False, validation_alias="MINIO_SECURE")
     minio_bucket: str = Field(default="pcd", validation_alias="MINIO_BUCKET")
     public_minio_url: str | None = Field(default=None, validation_alias="PUBLIC_MINIO_URL")
+    # соединений keep-alive на хост в пуле клиента MinIO процесса
+    minio_pool_size: int = Field(default=32, validation_alias="MINIO_POOL_SIZE")
 
-    @field_validator("minio_secure", mode="before")
+    # сколько задач очистки выполняется одновременно (остальные ждут в очереди)
+    clean_max_jobs: int = Field(default=2, validation_alias="CLEAN_MAX_JOBS")
+
+    # локальный кэш точек и 2.5D сетки для повторной очистки с другими порогами; 0 — выключен
+    raster_cache_dir: str = Field(default="/data/cache", validation_alias="RASTER_CACHE_DIR")
+    raster_cache_max_mb: float = Field(default=4096, validation_alias="RASTER_CACHE_MAX_MB")
+
+    # октодерево LOD строится после загрузки, очистки и сохранения облака
+    lod_auto: bool = Field(default=True, validation_alias="LOD_AUTO")
+    # точек в листе октодерева
+    lod_node_points: int = Field(default=20000, validation_alias="LOD_NODE_POINTS")
+
+    # кэш превью (/files/{id}/preview) в памяти процесса API, МБ
+    preview_cache_mb: float = Field(default=256, validation_alias="PREVIEW_CACHE_MB")
+
+    # каталог профилей задач (<вид>-<id>.prof, .tracemalloc, .top.txt); пусто — без профилирования
+    profile_dir: str | None = Field(default=None, validation_alias="PROFILE_DIR")
+
+    @field_validator("minio_secure", "lod_auto", mode="before")
     @classmethod
     def _coerce_bool(cls, v):
         if isinstance(v, bool):
@@ -1,21 +1,67 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import timedelta
+from typing import BinaryIO, Dict, Iterable, List, Tuple
 from urllib.parse import urlparse
+
+import certifi
+import urllib3
 from minio import Minio
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+from urllib3.util import Retry, Timeout
+
+from .metrics import record_transfer
 from .settings import Settings
 
+log = logging.getLogger(__name__)
+
+# таймауты HTTP: установка соединения и ожидание данных (части multipart до 16 МБ)
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+
+_clients: Dict[tuple, Minio] = {}
+_clients_lock = threading.Lock()
+
 
 def get_minio_client(settings: Settings) -> Minio:
+    """
+    Клиент MinIO процесса: один на настройки, с общим пулом keep-alive
+    соединений (settings.minio_pool_size на хост) и повтором идемпотентных
+    запросов при сетевых ошибках и 5xx. Клиент потокобезопасен.
+    """
     endpoint = settings.minio_endpoint
     if endpoint.startswith("http://"):
         endpoint = endpoint[len("http://"):]
     if endpoint.startswith("https://"):
         endpoint = endpoint[len("https://"):]
-    client = Minio(
-        endpoint,
-        access_key=settings.minio_access_key,
-        secret_key=settings.minio_secret_key,
-        secure=settings.minio_secure,
-    )
+    # после fork пул соединений родителя не используется: ключ включает pid
+    key = (os.getpid(), endpoint, settings.minio_access_key, settings.minio_secret_key,
+           settings.minio_secure, settings.minio_pool_size)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http = urllib3.PoolManager(
+                timeout=Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+                maxsize=settings.minio_pool_size,
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                retries=Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+            )
+            client = Minio(
+                endpoint,
+                access_key=settings.minio_access_key,
+                secret_key=settings.minio_secret_key,
+                secure=settings.minio_secure,
+                http_client=http,
+            )
+            _clients[key] = client
     return client
 
 
@@ -29,6 +75,141 @@ def upload_bytes(client: Minio, bucket: str, key: str, data: bytes, content_type
     from io import BytesIO
     bio = BytesIO(data)
     client.put_object(bucket, key, bio, length=len(data), content_type=content_type)
+    record_transfer("upload", len(data))
+
+
+@contextmanager
+def open_object(client: Minio, bucket: str, key: str):
+    """Объект MinIO как буферизованный поток; соединение возвращается в пул при выходе."""
+    resp = client.get_object(bucket, key)
+    # иначе urllib3 закрывает ответ на конце тела и BufferedReader падает с "read of closed file"
+    resp.auto_close = False
+    try:
+        yield io.BufferedReader(resp, buffer_size=1 << 20)
+    finally:
+        # tell() — байт, принятых из сети (поток могли дочитать не до конца)
+        record_transfer("download", resp.tell())
+        resp.close()
+        resp.release_conn()
+
+
+# размер части multipart-загрузки потока неизвестной длины (минимум S3 — 5 МБ);
+# в памяти одновременно не больше (UPLOAD_PARALLEL + 1) частей
+UPLOAD_PART_SIZE = 16 * 1024 * 1024
+UPLOAD_PARALLEL = 3
+
+
+class _HashingReader:
+    """Файловый объект-обёртка: считает размер и sha256 прочитанных данных."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._h = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n: int = -1) -> bytes:
+        b = self._f.read(n)
+        self.size += len(b)
+        self._h.update(b)
+        return b
+
+    @property
+    def sha256(self) -> str:
+        return self._h.hexdigest()
+
+
+def upload_stream(client: Minio, bucket: str, key: str, f: BinaryIO, content_type: str | None = None) -> Tuple[int, str]:
+    """
+    Потоковая загрузка файла неизвестной длины multipart-частями; память
+    ограничена размером частей, а не файла. Возвращает (размер, sha256).
+    """
+    reader = _HashingReader(f)
+    client.put_object(bucket, key, reader, length=-1, part_size=UPLOAD_PART_SIZE,
+                      num_parallel_uploads=UPLOAD_PARALLEL,
+                      content_type=content_type or "application/octet-stream")
+    record_transfer("upload", reader.size)
+    return reader.size, reader.sha256
+
+
+# коды S3, при которых пакет удаления повторяется (с паузой RETRY_DELAY, 2·RETRY_DELAY, …)
+_RETRYABLE = {"SlowDown", "InternalError", "ServiceUnavailable", "RequestTimeout", "RequestTimeTooSkewed"}
+DELETE_RETRIES = 3
+RETRY_DELAY = 0.2
+# объектов в одном запросе DeleteObjects (предел S3) и потоков листинга/удаления
+DELETE_BATCH = 1000
+TRANSFER_THREADS = 4
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, S3Error):
+        return e.code in _RETRYABLE
+    return isinstance(e, (urllib3.exceptions.HTTPError, ConnectionError))
+
+
+def with_retry(fn, *args, retries: int = DELETE_RETRIES, **kwargs):
+    """fn(*args, **kwargs) с повтором при временных ошибках S3 и сети (экспоненциальная пауза)."""
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not _retryable(e):
+                raise
+            log.warning("MinIO: %s, retry %d/%d", e, attempt + 1, retries)
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def _list_names(client: Minio, bucket: str, prefix: str) -> List[str]:
+    return with_retry(lambda: [o.object_name for o in client.list_objects(bucket, prefix=prefix, recursive=True)])
+
+
+def _delete_batch(client: Minio, bucket: str, names: List[str]) -> List[str]:
+    """Один запрос DeleteObjects; объекты с временной ошибкой удаляются повторно. Возвращает неудалённые."""
+    failed: List[str] = []
+    for attempt in range(DELETE_RETRIES + 1):
+        errors = with_retry(lambda: list(client.remove_objects(bucket, [DeleteObject(n) for n in names])))
+        names = []
+        for e in errors:
+            if e.code in _RETRYABLE and attempt < DELETE_RETRIES:
+                names.append(e.name)
+            else:
+                log.error("MinIO: cannot delete %s: %s %s", e.name, e.code, e.message)
+                failed.append(e.name)
+        if not names:
+            break
+        time.sleep(RETRY_DELAY * 2 ** attempt)
+    return failed
+
+
+def remove_keys(client: Minio, bucket: str, keys: Iterable[str]) -> List[str]:
+    """
+    Удалить объекты и префиксы (ключи на '/') пакетами DeleteObjects по
+    DELETE_BATCH; префиксы листаются и пакеты удаляются параллельно
+    (TRANSFER_THREADS). Временные ошибки повторяются; возвращает ключи и
+    префиксы, которые удалить не удалось (ошибки пишутся в лог).
+    """
+    keys = list(dict.fromkeys(keys))
+    prefixes = [k for k in keys if k.endswith("/")]
+    names = [k for k in keys if not k.endswith("/")]
+    failed: List[str] = []
+    with ThreadPoolExecutor(TRANSFER_THREADS) as pool:
+        for prefix, listed in zip(prefixes, pool.map(lambda p: _try(_list_names, client, bucket, p), prefixes)):
+            if listed is None:
+                failed.append(prefix)
+            else:
+                names += listed
+        batches = [names[i:i + DELETE_BATCH] for i in range(0, len(names), DELETE_BATCH)]
+        for batch, res in zip(batches, pool.map(lambda b: _try(_delete_batch, client, bucket, b), batches)):
+            failed += batch if res is None else res
+    return failed
+
+
+def _try(fn, *args):
+    """fn(*args) или None с записью ошибки в лог (для задач пула)."""
+    try:
+        return fn(*args)
+    except Exception as e:
+        log.error("MinIO: %s", e)
+        return None
 
 
 def _rewrite_public(url: str, settings: Settings) -> str:
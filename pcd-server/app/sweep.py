@@ -0,0 +1,155 @@
+"""
+Перебор параметров очистки на одном облаке.
+
+process представлен как цепочка этапов; у каждого этапа — свои параметры,
+результат запоминается по значениям параметров этапа и всех предыдущих:
+
+    points → grid (grid, q_low, q_high) → ground (+smooth_cells)
+           → candidates (+h_min, h_max, density_min)
+           → components (+min_len, min_width, max_width, min_elong)
+           → hough (+use_hough, hough_*)                  [от candidates]
+           → mask (components ∪ hough → точки)
+
+Варианты, отличающиеся только порогами, переиспользуют сетку и «землю»,
+варианты с одинаковыми порогами компонент — и разметку компонент.
+"""
+from __future__ import annotations
+import inspect, itertools, os, time
+from typing import Dict, List, Tuple
+import numpy as np
+
+try:
+    from .clearing_algorithm import (log, report, Progress, Source, process, cached_coords, ground_cache_name,
+                                     load_ground, save_ground, grid_cells, nanmean_filter,
+                                     candidate_cells, select_components, detect_hough_bands, removal_mask, Coords)
+except ImportError:  # запуск как скрипта
+    from clearing_algorithm import (log, report, Progress, Source, process, cached_coords, ground_cache_name,
+                                    load_ground, save_ground, grid_cells, nanmean_filter,
+                                    candidate_cells, select_components, detect_hough_bands, removal_mask, Coords)
+
+# этап: (собственные параметры, предыдущие этапы)
+STAGES: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "grid":       (("grid", "q_low", "q_high"), ()),
+    "ground":     (("smooth_cells",), ("grid",)),
+    "candidates": (("h_min", "h_max", "density_min"), ("ground",)),
+    "components": (("min_len", "min_width", "max_width", "min_elong"), ("candidates",)),
+    "hough":      (("use_hough", "hough_theta_step", "hough_rho_bin", "hough_topk",
+                    "hough_min_len", "hough_min_w", "hough_max_w", "hough_dilate"), ("candidates",)),
+    "mask":       ((), ("components", "hough")),
+}
+PARAMS = tuple(dict.fromkeys(p for own, _ in STAGES.values() for p in own))
+DEFAULTS = {k: v.default for k, v in inspect.signature(process).parameters.items() if k in PARAMS}
+
+
+def stage_key(stage: str, params: dict) -> tuple:
+    """Значения параметров этапа и всех этапов до него."""
+    own, parents = STAGES[stage]
+    names = set(own)
+    todo = list(parents)
+    while todo:
+        s = todo.pop()
+        names.update(STAGES[s][0]); todo.extend(STAGES[s][1])
+    return tuple((k, params[k]) for k in PARAMS if k in names)
+
+
+def expand_variants(base: dict, variants: List[dict] | None = None,
+                    grid: Dict[str, list] | None = None) -> List[dict]:
+    """base с переопределениями из variants × декартово произведение значений grid."""
+    variants = variants or [{}]
+    keys = list(grid or {})
+    combos = list(itertools.product(*[grid[k] for k in keys])) if keys else [()]
+    return [{**base, **v, **dict(zip(keys, c))} for v in variants for c in combos]
+
+
+class StageMemo:
+    """Результаты этапов для одного облака C; память — только на уникальные ключи."""
+
+    def __init__(self, C: Coords, cache_dir: str | None = None):
+        self.C = C
+        self.cache_dir = cache_dir
+        self.memo: Dict[str, dict] = {s: {} for s in STAGES}
+
+    def _get(self, stage: str, params: dict, timings: dict, compute):
+        key = stage_key(stage, params)
+        m = self.memo[stage]
+        if key in m:
+            timings.setdefault(stage, 0.0)
+            return m[key]
+        t = time.perf_counter()
+        m[key] = compute()
+        timings[stage] = round(time.perf_counter() - t, 4)
+        return m[key]
+
+    def grid(self, p: dict, timings: dict):
+        return self._get("grid", p, timings, lambda: grid_cells(self.C, p["grid"], p["q_low"], p["q_high"]))
+
+    def ground(self, p: dict, timings: dict) -> np.ndarray:
+        def compute():
+            path = (os.path.join(self.cache_dir, ground_cache_name(p["grid"], p["q_low"], p["q_high"], p["smooth_cells"]))
+                    if self.cache_dir else None)
+            if path and os.path.exists(path):
+                G, z_ground, cell = load_ground(path)
+                self.memo["grid"].setdefault(stage_key("grid", p), (G, cell))
+                return z_ground
+            G, cell = self.grid(p, timings)
+            z_ground = nanmean_filter(G.z_low, radius=p["smooth_cells"])
+            if path: save_ground(path, G, z_ground, cell)
+            return z_ground
+        return self._get("ground", p, timings, compute)
+
+    def candidates(self, p: dict, timings: dict) -> np.ndarray:
+        z_ground = self.ground(p, timings)
+        G = self.grid(p, timings)[0]
+        return self._get("candidates", p, timings,
+                         lambda: candidate_cells(G, z_ground, p["h_min"], p["h_max"], p["density_min"]))
+
+    def components(self, p: dict, timings: dict) -> np.ndarray:
+        cand = self.candidates(p, timings)
+        G = self.grid(p, timings)[0]
+        return self._get("components", p, timings,
+                         lambda: select_components(G, cand, p["min_len"], p["min_width"], p["max_width"], p["min_elong"])[0])
+
+    def hough(self, p: dict, timings: dict) -> np.ndarray | None:
+        cand = self.candidates(p, timings)
+        G = self.grid(p, timings)[0]
+        def compute():
+            if not p["use_hough"]: return None
+            return detect_hough_bands(G, cand, theta_step_deg=p["hough_theta_step"], rho_bin_m=p["hough_rho_bin"],
+                                      topk=p["hough_topk"], min_len_m=p["hough_min_len"], min_width_m=p["hough_min_w"],
+                                      max_width_m=p["hough_max_w"], dilate_cells=p["hough_dilate"])
+        return self._get("hough", p, timings, compute)
+
+    def mask(self, p: dict, timings: dict) -> np.ndarray:
+        """Маска удаления точек; не запоминается (размер облака), см. sweep."""
+        keep = self.components(p, timings)
+        band = self.hough(p, timings)
+        if band is not None: keep = keep | band
+        G, cell = self.grid(p, timings)
+        z_ground = self.ground(p, timings)
+        t = time.perf_counter()
+        m = removal_mask(self.C, cell, keep, z_ground, p["h_min"], p["h_max"])
+        timings["mask"] = round(time.perf_counter() - t, 4)
+        return m
+
+
+def sweep(source: Source, variants: List[dict], cache_dir: str | None = None,
+          progress: Progress | None = None) -> List[dict]:
+    """
+    Сводка по каждому варианту (полный набор параметров, как у process):
+    число удалённых точек и время этапов, с (0 — результат переиспользован;
+    время ground включает построение сетки, если её не было).
+    """
+    report(progress, 0.0, "read")
+    C = cached_coords(source, cache_dir)
+    memo = StageMemo(C, cache_dir)
+    out = []
+    for i, v in enumerate(variants):
+        p = {**DEFAULTS, **{k: v[k] for k in PARAMS if k in v}}
+        timings: Dict[str, float] = {}
+        t = time.perf_counter()
+        removed = int(memo.mask(p, timings).sum())
+        log(f"Вариант {i}: удалено {removed}")
+        out.append({"index": i, "params": p, "input_points": C.n, "removed_points": removed,
+                    "seconds": round(time.perf_counter() - t, 4), "timings": timings})
+        report(progress, (i + 1) / len(variants), "sweep")
+    return out
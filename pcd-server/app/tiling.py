@@ -0,0 +1,240 @@
+"""
+Тайловый (out-of-core) режим очистки для облаков, не помещающихся в память.
+
+Экстент XY делится на квадратные тайлы глобальной 2.5D-сетки. Каждый тайл
+обрабатывается со своим перекрытием (halo): сглаживание «земли», компоненты и
+Hough видят соседние клетки, а решение об удалении принимается только для
+точек ядра тайла. Точки раскладываются по тайлам во временные файлы за один
+проход, результаты дописываются в итоговые PCD потоково.
+"""
+from __future__ import annotations
+import math, os, shutil, tempfile
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Tuple
+import numpy as np
+
+try:
+    from .clearing_algorithm import (log, report, Progress, grid_shape, cell_index, grid_from_cells,
+                                     nanmean_filter, classify_cells, removal_mask, Coords)
+    from .pcd_io import iter_xyz, PCDWriter
+    from .profiling import count, stage
+except ImportError:  # запуск clearing_algorithm.py как скрипта
+    from clearing_algorithm import (log, report, Progress, grid_shape, cell_index, grid_from_cells,
+                                    nanmean_filter, classify_cells, removal_mask, Coords)
+    from pcd_io import iter_xyz, PCDWriter
+    from profiling import count, stage
+
+# грубая оценка пикового расхода памяти на точку и на клетку растра при обработке тайла
+_BYTES_PER_POINT=160
+_BYTES_PER_CELL=128
+_MIN_TILE=16
+
+
+@dataclass
+class TilePlan:
+    grid: float; origin: Tuple[float,float]; W:int; H:int
+    tile: int            # сторона ядра тайла, клеток
+    halo: int            # перекрытие с каждой стороны, клеток
+
+    @property
+    def nx(self) -> int: return -(-self.W // self.tile)
+    @property
+    def ny(self) -> int: return -(-self.H // self.tile)
+    @property
+    def ntiles(self) -> int: return self.nx*self.ny
+
+    def core(self, t: int) -> Tuple[int,int,int,int]:
+        """(x0, y0, x1, y1) ядра тайла t в клетках глобальной сетки."""
+        ty,tx=divmod(t, self.nx)
+        return (tx*self.tile, ty*self.tile,
+                min(self.W,(tx+1)*self.tile), min(self.H,(ty+1)*self.tile))
+
+    def window(self, t: int) -> Tuple[int,int,int,int]:
+        """Ядро тайла t, расширенное на halo и обрезанное по сетке."""
+        x0,y0,x1,y1=self.core(t)
+        h=self.halo
+        return max(0,x0-h), max(0,y0-h), min(self.W,x1+h), min(self.H,y1+h)
+
+    def tiles_of(self, ix: np.ndarray, iy: np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+        """
+        Все пары (тайл, номер точки), где клетка точки попадает в окно тайла
+        (ядро + halo). Точка входит в один тайл ядром и, возможно, в соседние — перекрытием.
+        Номера — int32 (номера точек — если их меньше 2**31): пар в ~(1+2*halo/tile)**2 раз больше точек.
+        """
+        k=-(-self.halo // self.tile)
+        tx0=ix//self.tile; ty0=iy//self.tile
+        pid_t=np.int32 if ix.size<2**31 else np.int64
+        tids=[]; pids=[]
+        for dy in range(-k, k+1):
+            ty=ty0+dy
+            my=(ty>=0)&(ty<self.ny)&(iy>=ty*self.tile-self.halo)&(iy<(ty+1)*self.tile+self.halo)
+            for dx in range(-k, k+1):
+                tx=tx0+dx
+                m=my&(tx>=0)&(tx<self.nx)&(ix>=tx*self.tile-self.halo)&(ix<(tx+1)*self.tile+self.halo)
+                idx=np.flatnonzero(m)
+                tids.append((ty[idx]*self.nx+tx[idx]).astype(np.int32)); pids.append(idx.astype(pid_t))
+        return np.concatenate(tids), np.concatenate(pids)
+
+
+def halo_cells(grid: float, smooth_cells: int, tile_halo: float | None,
+               min_len: float, max_width: float,
+               use_hough: bool, hough_min_len: float, hough_dilate: int) -> int:
+    """
+    Перекрытие тайлов в клетках: радиус сглаживания плюс запас на протяжённость
+    объектов (tile_halo, м; по умолчанию — по порогам длины/ширины компонент и полос).
+    """
+    if tile_halo is None:
+        tile_halo=max(2.0*min_len, 2.0*max_width, hough_min_len if use_hough else 0.0)
+    return max(0,smooth_cells) + int(math.ceil(tile_halo/grid)) + (max(0,hough_dilate) if use_hough else 0)
+
+
+def plan_tiles(n: int, mn, mx, grid: float, halo: int, memory_budget_mb: float) -> TilePlan:
+    """Сторона тайла из бюджета памяти и средней плотности точек на клетку."""
+    W,H=grid_shape(mn, mx, grid)
+    per_cell=_BYTES_PER_POINT*n/float(W*H) + _BYTES_PER_CELL
+    side=int(math.sqrt(memory_budget_mb*2**20/per_cell))
+    tile=side-2*halo
+    if tile<max(_MIN_TILE, halo):
+        log(f"Бюджет {memory_budget_mb} МБ мал для перекрытия {halo} клеток, тайлы будут больше бюджета")
+        tile=max(_MIN_TILE, halo)
+    tile=min(tile, max(W,H))
+    return TilePlan(grid, (float(mn[0]),float(mn[1])), W, H, tile, halo)
+
+
+def scan_bounds(in_path: str, chunk_points: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    """Первый проход: число точек и XY-экстент конечных точек."""
+    n=0
+    mn=np.array([np.inf,np.inf]); mx=-mn
+    for P in iter_xyz(in_path, chunk_points):
+        n+=P.shape[0]
+        xy=P[:,:2]
+        if P.shape[0]:
+            mn=np.fmin(mn, np.nanmin(xy, axis=0)); mx=np.fmax(mx, np.nanmax(xy, axis=0))
+    return n, mn, mx
+
+
+def spill_tiles(in_path: str, plan: TilePlan, scratch: str, chunk_points: int) -> int:
+    """Второй проход: раскладка точек (float64 xyz) по файлам тайлов; возвращает число отброшенных не-финитных."""
+    dropped=0
+    for P in iter_xyz(in_path, chunk_points):
+        finite=np.isfinite(P).all(axis=1)
+        if not finite.all():
+            dropped+=int((~finite).sum()); P=P[finite]
+        ix,iy=cell_index(P[:,:2], plan.origin, plan.grid, plan.W, plan.H)
+        tids,pids=plan.tiles_of(ix, iy)
+        order=np.argsort(tids, kind="stable")
+        tids=tids[order]; pids=pids[order]
+        bounds=np.flatnonzero(np.r_[True, tids[1:]!=tids[:-1]]) if tids.size else np.zeros(0, dtype=np.int64)
+        for b,e in zip(bounds, np.r_[bounds[1:], tids.size]):
+            with open(_tile_path(scratch, int(tids[b])), "ab") as f:
+                np.ascontiguousarray(P[pids[b:e]]).tofile(f)
+    return dropped
+
+
+def _tile_path(scratch: str, t: int) -> str:
+    return os.path.join(scratch, f"tile_{t}.bin")
+
+
+def clean_tile(P: np.ndarray, plan: TilePlan, t: int, q_low: float, q_high: float,
+               smooth_cells: int, cell_params: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Очистка одного тайла по его точкам (ядро + halo) в глобальной сетке.
+    Возвращает (маска точек ядра среди P, маска удаления для точек ядра).
+    """
+    x0,y0,x1,y1=plan.window(t)
+    cx0,cy0,cx1,cy1=plan.core(t)
+    ix,iy=cell_index(P[:,:2], plan.origin, plan.grid, plan.W, plan.H)
+    origin=(plan.origin[0]+x0*plan.grid, plan.origin[1]+y0*plan.grid)
+    lx=ix-x0; ly=iy-y0
+    G=grid_from_cells(lx, ly, P[:,2], plan.grid, origin, x1-x0, y1-y0, q_low, q_high)
+    z_ground=nanmean_filter(G.z_low, radius=smooth_cells)
+    keep=classify_cells(G, z_ground, **cell_params)
+    core=(ix>=cx0)&(ix<cx1)&(iy>=cy0)&(iy<cy1)
+    del_mask=removal_mask(Coords.of(P[core]), ly[core]*(x1-x0)+lx[core], keep, z_ground,
+                          cell_params["h_min"], cell_params["h_max"])
+    return core, del_mask
+
+
+def _clean_spilled_tile(scratch: str, plan: TilePlan, t: int, q_low: float, q_high: float,
+                        smooth_cells: int, cell_params: dict) -> int:
+    """Тайл из файла раскладки -> файлы cleaned/delta тайла в scratch; возвращает число удалённых."""
+    path=_tile_path(scratch, t)
+    P=np.fromfile(path, dtype=np.float64).reshape(-1,3)
+    os.remove(path)
+    log(f"Тайл {t+1}/{plan.ntiles}: {P.shape[0]} точек")
+    core, del_mask=clean_tile(P, plan, t, q_low, q_high, smooth_cells, cell_params)
+    Pc=P[core]
+    del P
+    Pc[~del_mask].astype(np.float32).tofile(path+".cleaned")
+    Pc[del_mask].astype(np.float32).tofile(path+".delta")
+    return int(del_mask.sum())
+
+
+def process_tiled(in_path: str, out_path: str, delta_out_path: str | None,
+                  grid: float, q_low: float, q_high: float, smooth_cells: int,
+                  memory_budget_mb: float, tile_halo: float | None = None, workers: int = 1,
+                  progress: Progress | None = None, **cell_params) -> Tuple[int, int, dict]:
+    """
+    Очистка облака по тайлам с ограничением памяти. Возвращает
+    (число точек на входе, удалено, доп. поля summary). Порядок точек на выходе —
+    по тайлам, а не как во входном файле. При workers>1 тайлы обрабатываются
+    в пуле процессов, бюджет памяти делится между ними.
+    """
+    workers=max(1, int(workers))
+    chunk=int(min(1<<22, max(1<<16, memory_budget_mb*2**20/4/_BYTES_PER_POINT)))
+    log(f"Чтение (тайловый режим): {in_path}")
+    report(progress, 0.0, "read")
+    with stage("read"):
+        n, mn, mx=scan_bounds(in_path, chunk)
+    count("read", points=n)
+    if n==0 or not np.isfinite(mn).all(): raise RuntimeError("Пустое облако")
+    halo=halo_cells(grid, smooth_cells, tile_halo, cell_params["min_len"], cell_params["max_width"],
+                    cell_params["use_hough"], cell_params["hough_min_len"], cell_params["hough_dilate"])
+    plan=plan_tiles(n, mn, mx, grid, halo, memory_budget_mb/workers)
+    log(f"Тайлы: {plan.nx}x{plan.ny} по {plan.tile} клеток, перекрытие {plan.halo} клеток")
+
+    removed=0
+    scratch=tempfile.mkdtemp(prefix="pcd_tiles_")
+    try:
+        report(progress, 0.05, "spill")
+        with stage("spill"):
+            dropped=spill_tiles(in_path, plan, scratch, chunk)
+        if dropped:
+            log(f"Предупреждение: удаляем не-финитные точки: {dropped}")
+        tiles=[t for t in range(plan.ntiles) if os.path.exists(_tile_path(scratch, t))]
+        args=(q_low, q_high, smooth_cells, cell_params)
+        count("tiles", tiles=len(tiles))
+        with stage("tiles"), PCDWriter(out_path) as wc, \
+             (PCDWriter(delta_out_path) if delta_out_path is not None else nullcontext()) as wd:
+            def collect(i: int, t: int):
+                path=_tile_path(scratch, t)
+                for suffix, w in ((".cleaned", wc), (".delta", wd)):
+                    if w is not None: w.write(np.fromfile(path+suffix, dtype=np.float32).reshape(-1,3))
+                    os.remove(path+suffix)
+                report(progress, 0.15 + 0.8*(i+1)/len(tiles), "tiles")
+            if workers==1:
+                for i,t in enumerate(tiles):
+                    removed+=_clean_spilled_tile(scratch, plan, t, *args)
+                    collect(i, t)
+            else:
+                try:
+                    from .parallel import make_pool
+                except ImportError:  # запуск как скрипта
+                    from parallel import make_pool
+                with make_pool(workers) as pool:
+                    futs=[pool.submit(_clean_spilled_tile, scratch, plan, t, *args) for t in tiles]
+                    # дописываем в порядке тайлов по мере готовности
+                    for i,(t,fut) in enumerate(zip(tiles, futs)):
+                        removed+=fut.result()
+                        collect(i, t)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    # как и в обычном режиме, пустую delta не оставляем
+    if delta_out_path is not None and removed==0 and os.path.exists(delta_out_path):
+        os.remove(delta_out_path)
+    log(f"К удалению намечено точек: {removed}")
+    log(f"Сохранение: {out_path}")
+    return n, removed, {"tiled": True, "tiles": plan.ntiles, "tile_cells": plan.tile,
+                        "tile_halo_cells": plan.halo, "memory_budget_mb": memory_budget_mb,
+                        "workers": workers}
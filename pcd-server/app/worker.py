@@ -1,10 +1,50 @@
+import contextvars
+import hashlib
 import json
 import os
-from .schemas import CleanRequest
-from .clearing_algorithm import process as process_pcd
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import BinaryIO, Deque, Dict, List, Optional, Tuple, Union
 
+import numpy as np
+from minio.error import S3Error
 
-def run_clean_process(in_path: str, out_path: str, params: CleanRequest, delta_out_path: str | None = None) -> dict:
+from .schemas import (CleanRequest, CleanResponse, SweepRequest, SweepResponse, SweepVariant, LodRequest, LodResponse,
+                      BatchCleanRequest, BatchCleanResponse, BatchFileResult)
+from .clearing_algorithm import process as process_pcd, clean_mask, Progress, report, POINTS_CACHE
+from .coords import Coords, from_records
+from .incremental import CleanState
+from .octree import build_octree
+from .pcd_io import PCDStream, iter_xyz
+from .settings import get_settings
+from .storage import get_minio_client, open_object, upload_bytes, upload_stream
+from .metrics import REGISTRY, record_stages, record_transfer
+from .profiling import count, profiled, stage, stages
+from .db import get_db
+from .raster_cache import get_raster_cache
+from .blobs import content_sha, lookup_clean_result, store_clean_result, params_key, result_prefix, lod_prefix, purge
+from .parallel import make_pool
+from .patches import reset_patches
+from .masks import Cloud, encode_mask, file_cloud, mask_cloud, cloud_etag, open_cloud
+from .sweep import expand_variants, sweep as run_sweep
+
+# верхняя граница числа вариантов одного перебора
+SWEEP_MAX_VARIANTS = 256
+
+# порция точек при построении октодерева
+_LOD_CHUNK = 1 << 20
+# поля CleanRequest, которые не передаются в clearing_algorithm.clean/clean_mask
+_NOT_CLEAN_ARGS = {"debug_dump", "memory_budget_mb", "store_mask", "keep_state"}
+# поля CleanRequest, от которых зависит сетка состояния очистки (incremental.reclean)
+_STATE_FIELDS = ("grid", "q_low", "q_high", "coord_quantum")
+
+
+def run_clean_process(in_path: str, out_path: str, params: CleanRequest, delta_out_path: str | None = None,
+                      progress: Progress | None = None, cache_dir: str | None = None) -> dict:
     """
     Call clearing_algorithm.process directly and return the summary dict it returns.
     """
@@ -32,6 +72,12 @@ def run_clean_process(in_path: str, out_path: str, params: CleanRequest, delta_o
         hough_dilate=params.hough_dilate,
         debug_dump=params.debug_dump,
         delta_out_path=delta_out_path,
+        memory_budget_mb=params.memory_budget_mb,
+        tile_halo=params.tile_halo,
+        workers=params.workers,
+        progress=progress,
+        cache_dir=cache_dir,
+        coord_quantum=params.coord_quantum,
     )
     # Ensure summary.json exists for parity
     summary_path = os.path.splitext(out_path)[0] + "_summary.json"
@@ -43,3 +89,494 @@ def run_clean_process(in_path: str, out_path: str, params: CleanRequest, delta_o
     return summary or {}
 
 
+class OriginalChanged(Exception):
+    """Оригинал файла заменён или файл удалён, пока шла очистка: её результат к файлу не относится."""
+
+
+def _get_file(file_id: str):
+    settings = get_settings()
+    con = get_db(settings)
+    try:
+        r = con.execute("SELECT * FROM files WHERE id=?", (file_id,)).fetchone()
+    finally:
+        con.close()
+    if not r:
+        raise LookupError(f"file {file_id} not found")
+    return r
+
+
+def _cache_dir(r, use_cache: bool):
+    """(cache, cache_dir) — каталог кэша растров файла или (None, None)."""
+    cache = get_raster_cache() if use_cache else None
+    cache_dir = cache.dir_for(cache.name_for(r["id"], r["sha256"], f"{r['s3_key_original']}@{r['created_at']}")) if cache else None
+    return cache, cache_dir
+
+
+def _object_stream(key: str):
+    settings = get_settings()
+    return open_object(get_minio_client(settings), settings.minio_bucket, key)
+
+
+def _original_source(r):
+    """Источник для clearing_algorithm: оригинал читается из MinIO потоком, только если точек нет в кэше."""
+    return lambda: _object_stream(r["s3_key_original"])
+
+
+def _upload_results(client, prefix: str, cleaned: BinaryIO, delta: Optional[BinaryIO], summary: dict) -> Tuple[str, Optional[str]]:
+    """Выгрузить cleaned/delta (потоково) и summary под prefix; возвращает (cleaned_key, delta_key)."""
+    settings = get_settings()
+    delta_key: Optional[str] = None
+    with stage("upload"):
+        if delta is not None:
+            delta_key = f"{prefix}delta/delta.pcd"
+            upload_stream(client, settings.minio_bucket, delta_key, delta)
+        cleaned_key = f"{prefix}cleaned/cleaned.pcd"
+        upload_stream(client, settings.minio_bucket, cleaned_key, cleaned)
+        summary_key = f"{prefix}cleaned/summary.json"
+        upload_bytes(client, settings.minio_bucket, summary_key, json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8"), "application/json")
+    return cleaned_key, delta_key
+
+
+def _upload_mask(client, prefix: str, drop: np.ndarray, nonfinite: np.ndarray, summary: dict) -> str:
+    """Выгрузить маску удаления (с не-финитными точками nonfinite, masks.py) и summary под prefix; возвращает ключ маски."""
+    settings = get_settings()
+    mask_key = f"{prefix}mask.bin"
+    with stage("upload"):
+        upload_bytes(client, settings.minio_bucket, mask_key, encode_mask(drop, nonfinite), "application/octet-stream")
+        summary_key = f"{prefix}cleaned/summary.json"
+        upload_bytes(client, settings.minio_bucket, summary_key, json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8"), "application/json")
+    return mask_key
+
+
+def _state_key(file_id: str, params: CleanRequest) -> str:
+    """
+    Состояние последней очистки файла (incremental.py) — по файлу, а не по
+    содержимому, и только по полям сетки: пороги, Hough и прочие параметры
+    его не меняют.
+    """
+    data = json.dumps(params.model_dump(include=set(_STATE_FIELDS)), sort_keys=True)
+    return f"pcd/{file_id}/state/{hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]}.npz"
+
+
+def _load_state(client, file_id: str, params: CleanRequest) -> Optional[CleanState]:
+    """Состояние прежней очистки файла или None (без params.keep_state и при workers > 1: растров целиком там нет)."""
+    if not params.keep_state or params.workers > 1:
+        return None
+    settings = get_settings()
+    try:
+        with open_object(client, settings.minio_bucket, _state_key(file_id, params)) as f:
+            return CleanState.load(f)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+
+
+def _upload_state(client, file_id: str, params: CleanRequest, state: Optional[CleanState]):
+    if state is None:
+        return
+    settings = get_settings()
+    with stage("upload"):
+        upload_bytes(client, settings.minio_bucket, _state_key(file_id, params), state.to_bytes(),
+                     "application/octet-stream")
+
+
+def _set_clean_result(r, cleaned_key: Optional[str], delta_key: Optional[str], summary: dict,
+                      mask_key: Optional[str] = None) -> CleanResponse:
+    """
+    Привязать результат очистки к файлу r (запись, прочитанная до очистки).
+    Сравнение с прочитанным оригиналом, как в apply_file_patch: если его
+    заменили (save_original, патч) или файл удалили — OriginalChanged.
+    """
+    settings = get_settings()
+    file_id = r["id"]
+    con = get_db(settings)
+    try:
+        cur = con.execute(
+            "UPDATE files SET s3_key_cleaned=?, s3_key_delta=?, s3_key_mask=?, summary_json=?"
+            " WHERE id=? AND s3_key_original=?",
+            (cleaned_key, delta_key, mask_key, json.dumps(summary, ensure_ascii=False), file_id,
+             r["s3_key_original"]),
+        )
+        if cur.rowcount == 0:
+            con.rollback()
+            raise OriginalChanged(f"original of file {file_id} changed while it was cleaned")
+        # manual edits of the previous cleaned cloud no longer apply
+        orphaned = reset_patches(con, file_id, ["cleaned"])
+        con.commit()
+    finally:
+        con.close()
+    purge(orphaned)
+    return CleanResponse(
+        id=file_id,
+        original_url=f"/api/files/{file_id}/original",
+        cleaned_url=f"/api/files/{file_id}/cleaned",
+        delta_url=f"/api/files/{file_id}/delta" if delta_key or (mask_key and summary.get("removed_points")) else None,
+        summary=summary,
+    )
+
+
+def apply_cached_clean(r, params: CleanRequest) -> Optional[CleanResponse]:
+    """Если очистка этого содержимого с этими параметрами уже есть — привязать её к файлу."""
+    hit = lookup_clean_result(content_sha(r), params)
+    if not hit:
+        return None
+    return _set_clean_result(r, hit["s3_key_cleaned"], hit["s3_key_delta"], json.loads(hit["summary_json"]),
+                             hit["s3_key_mask"])
+
+
+@profiled()
+def clean_and_store(file_id: str, params: CleanRequest, progress: Progress | None = None,
+                    original: Optional[str] = None) -> CleanResponse:
+    """
+    Полный цикл очистки файла: прочитать оригинал из MinIO, очистить, выгрузить
+    cleaned/delta/summary, построить их октодеревья LOD (settings.lod_auto) и
+    обновить запись в БД. Прогресс: чтение 0..0.1, очистка 0.1..0.75, выгрузка
+    0.75..0.8, LOD 0.8..1. Результаты для оригиналов с sha256
+    кэшируются (blobs.py); повторная очистка тех же данных с теми же
+    параметрами только привязывает готовый результат.
+
+    Обычный режим не использует диск: оригинал разбирается прямо из ответа
+    MinIO, результат выгружается из памяти; с params.store_mask выгружается
+    только маска удаления (masks.py). Тайловому режиму (memory_budget_mb)
+    нужны файлы — он работает во временном каталоге, который удаляется по
+    выходе, и всегда хранит cleaned/delta целиком (store_mask игнорируется).
+
+    С params.keep_state очистка в памяти при workers=1 сохраняет состояние
+    (растры и отпечатки тайлов, incremental.py) под pcd/<id>/state/: когда
+    оригинал файла заменён, следующая такая очистка с теми же grid, квантилями
+    и coord_quantum пересчитывает сетку только в изменившихся тайлах, а «землю»,
+    компоненты и Hough — по всей сетке, без перекрытий (summary["incremental"]).
+
+    original — уже скачанная локальная копия оригинала (пакетная очистка
+    скачивает файлы впрок), тогда MinIO не читается.
+
+    summary["stages"] — профиль этапов (profiling.py) от скачивания до LOD.
+    """
+    settings = get_settings()
+    r = _get_file(file_id)
+    cached = apply_cached_clean(r, params)
+    if cached:
+        return cached
+    sha256 = content_sha(r)
+    client = get_minio_client(settings)
+    # results of content-addressed originals are shared between files
+    if sha256:
+        prefix = result_prefix(sha256, params_key(params))
+    else:
+        prefix = f"pcd/{file_id}/"
+
+    def scaled(frac: float, stage: str):
+        report(progress, 0.1 + 0.65 * frac, stage)
+    def lod_progress(lo: float, hi: float):
+        return lambda frac: report(progress, lo + (hi - lo) * frac, "lod")
+    report(progress, 0.0, "download")
+    mask_key = None
+    if params.memory_budget_mb:
+        # tiled mode reads the file twice and streams its output to disk; it does not use the cache
+        with tempfile.TemporaryDirectory(prefix="pcd_") as tmpdir:
+            original_local = original or os.path.join(tmpdir, "original.pcd")
+            cleaned_local = os.path.join(tmpdir, "cleaned.pcd")
+            delta_local = os.path.join(tmpdir, "delta.pcd")
+            if not original:
+                with stage("download"):
+                    client.fget_object(settings.minio_bucket, r["s3_key_original"], original_local)
+                record_transfer("download", os.path.getsize(original_local))
+            summary = run_clean_process(original_local, cleaned_local, params, delta_out_path=delta_local,
+                                        progress=scaled)
+            report(progress, 0.75, "upload")
+            with open(cleaned_local, "rb") as fc, \
+                 (open(delta_local, "rb") if os.path.exists(delta_local) else nullcontext()) as fd:
+                cleaned_key, delta_key = _upload_results(client, prefix, fc, fd, summary)
+            if settings.lod_auto:
+                build_lod(Cloud(cleaned_key), path=cleaned_local, progress=lod_progress(0.8, 0.95))
+                if delta_key:
+                    build_lod(Cloud(delta_key), path=delta_local, progress=lod_progress(0.95, 1.0))
+    elif params.store_mask:
+        cache, cache_dir = _cache_dir(r, use_cache=True)
+        # для маски прочие поля точек не нужны: в памяти только координаты
+        res = clean_mask(original or _original_source(r), progress=scaled, cache_dir=cache_dir, records=False,
+                         prev_state=_load_state(client, file_id, params), return_state=params.keep_state,
+                         **params.model_dump(exclude=_NOT_CLEAN_ARGS))
+        C, drop, summary = res[:3]
+        state = res[3] if params.keep_state else None
+        if cache:
+            cache.evict(keep=cache_dir)
+        report(progress, 0.75, "upload")
+        # не-финитные точки удалены, но, как в обычном режиме, ни в cleaned, ни в delta
+        finite = C.finite()
+        mask_key = _upload_mask(client, prefix, drop, ~finite, summary)
+        _upload_state(client, file_id, params, state)
+        cleaned_key = delta_key = None
+        if settings.lod_auto:
+            build_lod(mask_cloud(r["s3_key_original"], mask_key, "cleaned"), points=C, select=~drop,
+                      progress=lod_progress(0.8, 0.95))
+            if summary.get("removed_points"):
+                build_lod(mask_cloud(r["s3_key_original"], mask_key, "delta"), points=C, select=drop & finite,
+                          progress=lod_progress(0.95, 1.0))
+        del res, C, drop, finite
+    else:
+        cache, cache_dir = _cache_dir(r, use_cache=True)
+        res = clean_mask(original or _original_source(r), progress=scaled, cache_dir=cache_dir,
+                         prev_state=_load_state(client, file_id, params), return_state=params.keep_state,
+                         **params.model_dump(exclude=_NOT_CLEAN_ARGS))
+        rec, drop, summary = res[:3]
+        state = res[3] if params.keep_state else None
+        if cache:
+            cache.evict(keep=cache_dir)
+        report(progress, 0.75, "upload")
+        # cleaned и delta — выборки из rec при записи, без копий; не-финитные точки — ни в одном
+        C = from_records(rec)
+        keep = ~drop
+        removed = drop & C.finite()
+        cleaned_key, delta_key = _upload_results(client, prefix, PCDStream(rec, select=keep),
+                                                 PCDStream(rec, select=removed) if removed.any() else None, summary)
+        _upload_state(client, file_id, params, state)
+        if settings.lod_auto:
+            build_lod(Cloud(cleaned_key), points=C, select=keep, progress=lod_progress(0.8, 0.95))
+            if delta_key:
+                build_lod(Cloud(delta_key), points=C, select=removed, progress=lod_progress(0.95, 1.0))
+        del res, rec, C, drop, keep, removed
+
+    summary["stages"] = stages()
+    if sha256:
+        # результат общий для файлов с этим содержимым: история правок этого файла в него не входит
+        shared = {k: v for k, v in summary.items() if k != "incremental"}
+        store_clean_result(sha256, params, cleaned_key, delta_key, shared, mask_key)
+    return _set_clean_result(r, cleaned_key, delta_key, summary, mask_key)
+
+
+def lod_index(cloud: Cloud) -> Optional[dict]:
+    """Индекс октодерева облака, если оно построено для текущей версии облака."""
+    settings = get_settings()
+    client = get_minio_client(settings)
+    try:
+        with _object_stream(f"{lod_prefix(cloud.key)}index.json") as f:
+            index = json.load(f)
+        etag = cloud_etag(client, settings.minio_bucket, cloud)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    return index if index.get("source_etag") == etag else None
+
+
+def build_lod(cloud: Cloud, points: Optional[Union[np.ndarray, Coords]] = None, path: Optional[str] = None,
+              select: Optional[np.ndarray] = None, progress=None) -> dict:
+    """
+    Построить октодерево LOD облака и выгрузить под lod_prefix(cloud.key):
+    nodes/<имя>.pcd (binary x y z) и index.json. Точки берутся из points
+    (структурный массив или Coords в памяти; select — маска выбранных точек),
+    локального файла path или самого облака (скачивается во временный каталог).
+    Прежнее октодерево удаляется.
+    """
+    settings = get_settings()
+    client = get_minio_client(settings)
+    prefix = lod_prefix(cloud.key)
+    etag = cloud_etag(client, settings.minio_bucket, cloud)
+    purge([prefix])
+
+    def put_node(name: str, P: np.ndarray):
+        upload_bytes(client, settings.minio_bucket, f"{prefix}nodes/{name}.pcd",
+                     PCDStream(P, data="binary").read(), "application/octet-stream")
+
+    with tempfile.TemporaryDirectory(prefix="lod_") as tmpdir:
+        if points is not None:
+            C = points if isinstance(points, Coords) else from_records(points)
+            chunks = lambda: (C.xyz(i, j, None if select is None else select[i:j]) for i, j in C.spans(_LOD_CHUNK))
+        else:
+            if path is None:
+                path = os.path.join(tmpdir, "source.pcd")
+                with open_cloud(client, settings.minio_bucket, cloud) as src, open(path, "wb") as f:
+                    shutil.copyfileobj(src, f, 1 << 20)
+            chunks = lambda: iter_xyz(path, _LOD_CHUNK)
+        workdir = os.path.join(tmpdir, "buckets")
+        os.makedirs(workdir)
+        with stage("lod"):
+            index = build_octree(chunks, put_node, workdir, node_points=settings.lod_node_points, progress=progress)
+        count("lod", nodes=len(index["nodes"]))
+    index["source_etag"] = etag
+    upload_bytes(client, settings.minio_bucket, f"{prefix}index.json",
+                 json.dumps(index).encode("utf-8"), "application/json")
+    return index
+
+
+def build_lod_file(file_id: str, req: LodRequest, progress: Progress | None = None) -> LodResponse:
+    """Октодеревья LOD облаков файла (req.kinds); актуальные не перестраиваются без req.force."""
+    r = _get_file(file_id)
+    clouds = [(k, c) for k in req.kinds for c in [file_cloud(r, k)] if c]
+    nodes: Dict[str, int] = {}
+    for i, (kind, cloud) in enumerate(clouds):
+        report(progress, i / len(clouds), kind)
+        index = None if req.force else lod_index(cloud)
+        if index is None:
+            index = build_lod(cloud, progress=lambda frac: report(progress, (i + frac) / len(clouds), kind))
+        nodes[kind] = len(index["nodes"])
+    return LodResponse(id=file_id, nodes=nodes)
+
+
+def sweep_variants(req: SweepRequest) -> List[CleanRequest]:
+    """Варианты перебора как CleanRequest; ValueError при неизвестных параметрах или слишком большом переборе."""
+    for ov in [*req.variants, req.grid]:
+        unknown = set(ov) - set(CleanRequest.model_fields)
+        if unknown:
+            raise ValueError(f"unknown parameters: {', '.join(sorted(unknown))}")
+    n = max(1, len(req.variants))
+    for values in req.grid.values():
+        n *= len(values)
+    if n > SWEEP_MAX_VARIANTS:
+        raise ValueError(f"too many variants: {n} > {SWEEP_MAX_VARIANTS}")
+    variants = [CleanRequest(**v) for v in expand_variants(req.base.model_dump(), req.variants, req.grid)]
+    if req.persist is not None and req.persist >= len(variants):
+        raise ValueError(f"persist index {req.persist} out of range (variants: {len(variants)})")
+    return variants
+
+
+def sweep_file(file_id: str, req: SweepRequest, progress: Progress | None = None) -> SweepResponse:
+    """
+    Перебор параметров на файле: сводки вариантов без выгрузки результатов;
+    при req.persist результат выбранного варианта сохраняется как обычная очистка.
+    Прогресс: скачивание 0..0.1, перебор 0.1..0.8 (0.1..1 без persist), сохранение до 1.
+    """
+    variants = sweep_variants(req)
+    r = _get_file(file_id)
+    report(progress, 0.0, "download")
+    cache, cache_dir = _cache_dir(r, use_cache=True)
+    end = 0.8 if req.persist is not None else 1.0
+    def scaled(frac: float, stage: str):
+        report(progress, 0.1 + (end - 0.1) * frac, stage)
+    results = run_sweep(_original_source(r), [v.model_dump() for v in variants], cache_dir=cache_dir, progress=scaled)
+    if cache:
+        cache.evict(keep=cache_dir)
+
+    persisted = None
+    if req.persist is not None:
+        def tail(frac: float, stage: str):
+            report(progress, end + (1.0 - end) * frac, stage)
+        persisted = clean_and_store(file_id, variants[req.persist], tail)
+    return SweepResponse(id=file_id, variants=[SweepVariant(**x) for x in results], persisted=persisted)
+
+
+def _batch_clean_file(file_id: str, params_json: str, original: Optional[str]) -> Tuple[str, float, list]:
+    """Задача процесса пула пакетной очистки: (CleanResponse JSON, секунды, метрики процесса для merge)."""
+    t = time.perf_counter()
+    res = clean_and_store(file_id, CleanRequest.model_validate_json(params_json), original=original)
+    record_stages("batch", res.summary.get("stages", {}))
+    return res.model_dump_json(), time.perf_counter() - t, REGISTRY.take()
+
+
+def _batch_item(file_id: str, status: str, res: Optional[CleanResponse] = None, seconds: float = 0.0,
+                download_seconds: float = 0.0, error: Optional[str] = None) -> BatchFileResult:
+    summary = (res.summary or {}) if res else {}
+    points = summary.get("input_points")
+    return BatchFileResult(id=file_id, status=status, error=error, input_points=points,
+                           removed_points=summary.get("removed_points"), download_seconds=round(download_seconds, 3),
+                           seconds=round(seconds, 3),
+                           points_per_s=round(points / seconds) if points and seconds > 0 else None, result=res)
+
+
+def clean_batch(file_id: str, req: BatchCleanRequest, progress: Progress | None = None) -> BatchCleanResponse:
+    """
+    Пакетная очистка файлов req.file_ids с одними параметрами (file_id пакетной
+    задачи не используется). Файлы очищаются в пуле из req.jobs процессов
+    (clean_and_store целиком: очистка, выгрузка, LOD), поэтому выгрузка одного
+    файла идёт параллельно с очисткой других; оригиналы следующих файлов
+    (до req.jobs впрок) тем временем скачиваются во временный каталог.
+    Оригиналы, точки которых уже есть в кэше растров, не скачиваются.
+
+    Результаты из кэша очистки привязываются без расчёта; файлы с одинаковым
+    содержимым считаются один раз. Ошибка одного файла не прерывает пакет —
+    она в его BatchFileResult. cancel_file пакет не отменяет: файл, оригинал
+    которого заменили, пока шёл пакет, результат прежней версии не получает
+    (OriginalChanged в _set_clean_result).
+    """
+    settings = get_settings()
+    client = get_minio_client(settings)
+    params = req.params
+    t0 = time.perf_counter()
+    results: Dict[str, BatchFileResult] = {}
+    todo, same_content = [], []
+    seen = set()
+    for fid in dict.fromkeys(req.file_ids):
+        try:
+            r = _get_file(fid)
+            cached = apply_cached_clean(r, params)
+        except Exception as e:
+            results[fid] = _batch_item(fid, "failed", error=f"{type(e).__name__}: {e}")
+            continue
+        sha256 = content_sha(r)
+        if cached:
+            results[fid] = _batch_item(fid, "cached", cached)
+        elif sha256 and sha256 in seen:
+            # результат первого файла с этим содержимым привяжется после его очистки
+            same_content.append(r)
+        else:
+            seen.add(sha256)
+            todo.append(r)
+
+    def fetch(r) -> Tuple[Optional[str], float]:
+        t = time.perf_counter()
+        if not params.memory_budget_mb:
+            _, cache_dir = _cache_dir(r, use_cache=True)
+            if cache_dir and os.path.exists(os.path.join(cache_dir, POINTS_CACHE)):
+                return None, 0.0
+        path = os.path.join(tmpdir, f"{r['id']}.pcd")
+        with stage("download"):
+            client.fget_object(settings.minio_bucket, r["s3_key_original"], path)
+        record_transfer("download", os.path.getsize(path))
+        return path, time.perf_counter() - t
+
+    report(progress, 0.0, "clean")
+    pending = deque(todo)
+    fetched: Deque[tuple] = deque()
+    running: Dict[Future, tuple] = {}
+    finished = 0
+    params_json = params.model_dump_json()
+    with tempfile.TemporaryDirectory(prefix="batch_") as tmpdir, \
+         ThreadPoolExecutor(1, thread_name_prefix="batch-fetch") as fetcher, \
+         make_pool(min(req.jobs, max(1, len(todo)))) as pool:
+        while pending or fetched or running:
+            while pending and len(fetched) < req.jobs:
+                r = pending.popleft()
+                # в контексте задачи: stage("download") пишет в её профиль
+                fetched.append((r, fetcher.submit(contextvars.copy_context().run, fetch, r)))
+            while fetched and len(running) < req.jobs:
+                r, fut = fetched.popleft()
+                try:
+                    path, download_s = fut.result()
+                except Exception as e:
+                    results[r["id"]] = _batch_item(r["id"], "failed", error=f"{type(e).__name__}: {e}")
+                    finished += 1
+                    continue
+                running[pool.submit(_batch_clean_file, r["id"], params_json, path)] = (r, path, download_s)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                r, path, download_s = running.pop(fut)
+                if path:
+                    os.remove(path)
+                try:
+                    res_json, seconds, state = fut.result()
+                    REGISTRY.merge(state)
+                    results[r["id"]] = _batch_item(r["id"], "done", CleanResponse.model_validate_json(res_json),
+                                                   seconds, download_s)
+                except Exception as e:
+                    results[r["id"]] = _batch_item(r["id"], "failed", download_seconds=download_s,
+                                                   error=f"{type(e).__name__}: {e}")
+                finished += 1
+                report(progress, finished / len(todo), "clean")
+
+    for r in same_content:
+        try:
+            cached = apply_cached_clean(r, params)
+        except OriginalChanged as e:
+            results[r["id"]] = _batch_item(r["id"], "failed", error=f"{type(e).__name__}: {e}")
+            continue
+        results[r["id"]] = (_batch_item(r["id"], "cached", cached) if cached else
+                            _batch_item(r["id"], "failed", error="file with the same content was not cleaned"))
+    files = [results[fid] for fid in dict.fromkeys(req.file_ids)]
+    seconds = time.perf_counter() - t0
+    points = sum(f.input_points or 0 for f in files if f.status == "done")
+    return BatchCleanResponse(files=files, input_points=points, seconds=round(seconds, 3),
+                              points_per_s=round(points / seconds) if seconds > 0 else 0.0)
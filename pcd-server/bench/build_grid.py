@@ -0,0 +1,73 @@
+"""
+Бенчмарк build_grid: векторный движок квантилей против прежнего цикла по клеткам.
+
+    python -m bench.build_grid --sizes 1e6 1e7 1e8
+"""
+from __future__ import annotations
+import argparse
+import numpy as np
+
+from app.clearing_algorithm import Grid2p5D, build_grid, _segment_quantile
+from .common import make_points, timed
+
+
+def build_grid_loop(points: np.ndarray, grid: float, q_low=0.02, q_high=0.90) -> Grid2p5D:
+    """Прежняя реализация (цикл Python + np.quantile на клетку) — эталон для сравнения."""
+    xy=points[:,:2]; z=points[:,2]
+    mn=xy.min(axis=0); mx=xy.max(axis=0); origin=mn
+    W=int(np.ceil((mx[0]-mn[0])/grid))+1
+    H=int(np.ceil((mx[1]-mn[1])/grid))+1
+    ix=np.clip(np.floor((xy[:,0]-origin[0])/grid).astype(np.int64),0,W-1)
+    iy=np.clip(np.floor((xy[:,1]-origin[1])/grid).astype(np.int64),0,H-1)
+    gid=iy*W+ix
+    order=np.argsort(gid); gid_s=gid[order]; z_s=z[order]
+    uniq, start, cnt=np.unique(gid_s, return_index=True, return_counts=True)
+    z_low=np.full((H,W), np.nan, dtype=np.float32)
+    z_high=np.full((H,W), np.nan, dtype=np.float32)
+    count=np.zeros((H,W), dtype=np.int32)
+    for u,s,c in zip(uniq,start,cnt):
+        seg=z_s[s:s+c]
+        iyc=int(u//W); ixc=int(u%W)
+        z_low[iyc,ixc]=np.quantile(seg, q_low); z_high[iyc,ixc]=np.quantile(seg, q_high); count[iyc,ixc]=c
+    return Grid2p5D(grid,(origin[0],origin[1]),W,H,z_low,z_high,count)
+
+
+def check_segment_quantile(segments: int = 20000, seed: int = 0):
+    """_segment_quantile против np.quantile на float32-сегментах разной длины, до бита после float32."""
+    rng=np.random.default_rng(seed)
+    cnt=rng.integers(1, 64, segments); start=np.concatenate(([0], np.cumsum(cnt)[:-1]))
+    z=rng.normal(0.0, 1.0, int(cnt.sum())).astype(np.float32)
+    for s,c in zip(start,cnt): z[s:s+c].sort()
+    for q in (0.02, 0.10, 0.50, 0.90, 0.98):
+        out=_segment_quantile(z, start, cnt, q).astype(np.float32)
+        ref=np.array([np.quantile(z[s:s+c], q) for s,c in zip(start,cnt)]).astype(np.float32)
+        bad=int((out!=ref).sum())
+        if bad: raise SystemExit(f"_segment_quantile расходится с np.quantile: q={q}, {bad} сегментов из {segments}")
+
+
+def main():
+    ap=argparse.ArgumentParser(description="build_grid: vectorized vs loop")
+    ap.add_argument("--sizes", type=float, nargs="+", default=[1e6, 1e7, 1e8])
+    ap.add_argument("--density", type=float, default=200.0, help="точек на м²")
+    ap.add_argument("--grid", type=float, default=0.35)
+    ap.add_argument("--loop_max", type=float, default=1e7, help="не гонять цикл на облаках больше этого")
+    args=ap.parse_args()
+
+    check_segment_quantile()
+    print(f"{'points':>12} {'cells':>10} {'vector, s':>10} {'loop, s':>10} {'speedup':>8}")
+    for n in map(int, args.sizes):
+        P=make_points(n, args.density)
+        G, tv=timed(build_grid, P, args.grid)
+        cells=int((G.count>0).sum())
+        if n<=args.loop_max:
+            G0, tl=timed(build_grid_loop, P, args.grid)
+            same=all(np.array_equal(getattr(G,f), getattr(G0,f), equal_nan=True) for f in ("z_low","z_high","count"))
+            if not same: raise SystemExit(f"результаты расходятся на n={n}")
+            print(f"{n:>12} {cells:>10} {tv:>10.2f} {tl:>10.2f} {tl/tv:>7.1f}x")
+        else:
+            print(f"{n:>12} {cells:>10} {tv:>10.2f} {'-':>10} {'-':>8}")
+        del P, G
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,18 @@
+"""Общие помощники бенчмарков."""
+from __future__ import annotations
+import time
+import numpy as np
+
+
+def make_points(n: int, density: float, seed: int = 42) -> np.ndarray:
+    """Равномерное облако n точек с плотностью density точек/м² и шумной «землёй»."""
+    rng=np.random.default_rng(seed)
+    side=float(np.sqrt(n/density))
+    P=np.empty((n,3), dtype=np.float64)
+    P[:,0]=rng.uniform(0.0, side, n); P[:,1]=rng.uniform(0.0, side, n)
+    P[:,2]=0.02*P[:,0] + rng.normal(0.0, 0.3, n)
+    return P
+
+
+def timed(fn, *a, **kw):
+    t0=time.perf_counter(); r=fn(*a, **kw); return r, time.perf_counter()-t0
@@ -0,0 +1,92 @@
+"""
+Нагрузочный тест списка файлов: время GET /api/files на растущей таблице files
+(временная база SQLite, MinIO не нужен).
+
+    python -m bench.list_files --sizes 1e3 1e4 1e5 3e5
+
+Для каждого размера: первая страница, страница в середине таблицы (по курсору),
+фильтр по префиксу имени и, для сравнения, прежний SELECT * всей таблицы.
+Время страницы не должно расти с размером таблицы.
+"""
+from __future__ import annotations
+import argparse, os, statistics, sys, tempfile, time, uuid
+from datetime import datetime, timedelta
+
+
+def _fill(con, start: int, n: int):
+    t0=datetime(2024, 1, 1)
+    rows=[(str(uuid.uuid4()), f"scan_{i:07d}.pcd", 1000+i, (t0+timedelta(seconds=i)).isoformat(), f"blobs/{i}.pcd",
+           '{"input_points": 1, "removed_points": 0}' if i%3==0 else None, f"{i:064x}")
+          for i in range(start, start+n)]
+    con.executemany("INSERT INTO files (id, filename, size, created_at, s3_key_original, summary_json, sha256)"
+                    " VALUES (?,?,?,?,?,?,?)", rows)
+    con.commit()
+
+
+def _ms(fn, repeat: int) -> float:
+    ts=[]
+    for _ in range(repeat):
+        t=time.perf_counter(); fn(); ts.append(time.perf_counter()-t)
+    return statistics.median(ts)*1000
+
+
+def main():
+    ap=argparse.ArgumentParser(description="GET /files latency vs table size")
+    ap.add_argument("--sizes", type=float, nargs="+", default=[1e3, 1e4, 1e5, 3e5])
+    ap.add_argument("--limit", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--full_max", type=float, default=1e5, help="не гонять SELECT * на таблицах больше этого")
+    args=ap.parse_args()
+
+    tmp=tempfile.mkdtemp(prefix="bench_list_")
+    os.environ["SQLITE_PATH"]=os.path.join(tmp, "pcd.sqlite3")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.db import get_db, init_db
+    from app.routes.files import router, _encode_cursor
+    from app.settings import get_settings
+
+    settings=get_settings()
+    init_db(settings)
+    app=FastAPI(); app.include_router(router, prefix="/api")
+    client=TestClient(app)
+
+    def page(**params):
+        r=client.get("/api/files", params={"limit": args.limit, **params})
+        r.raise_for_status()
+        return r
+
+    def full():
+        con=get_db(settings)
+        try:
+            con.execute("SELECT * FROM files ORDER BY created_at DESC").fetchall()
+        finally:
+            con.close()
+
+    print(f"{'rows':>9} {'first':>9} {'middle':>9} {'filter':>9} {'SELECT *':>9}  (ms, median of {args.repeat})")
+    have=0
+    for size in (int(s) for s in args.sizes):
+        con=get_db(settings)
+        try:
+            _fill(con, have, size-have)
+        finally:
+            con.close()
+        have=size
+        # курсор на середину таблицы: страница, начинающаяся с записи size/2
+        con=get_db(settings)
+        try:
+            mid=con.execute("SELECT created_at, id FROM files ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+                            (size//2,)).fetchone()
+        finally:
+            con.close()
+        cursor=_encode_cursor(mid)
+        t_first=_ms(lambda: page(), args.repeat)
+        t_mid=_ms(lambda: page(cursor=cursor), args.repeat)
+        t_filter=_ms(lambda: page(filename=f"scan_{size//2:07d}"[:-2]), args.repeat)
+        t_full=_ms(full, max(1, args.repeat//10)) if size<=args.full_max else float("nan")
+        print(f"{size:>9} {t_first:>9.2f} {t_mid:>9.2f} {t_filter:>9.2f} {t_full:>9.1f}")
+        sys.stdout.flush()
+
+
+if __name__=="__main__":
+    main()
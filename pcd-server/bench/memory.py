@@ -0,0 +1,72 @@
+"""
+Пиковая память очистки в памяти относительно объёма точек файла: только
+координаты (store_mask), все поля (cleaned/delta) и int32-квантование.
+
+    python -m bench.memory --points 2e7
+
+Каждый режим — отдельный процесс, запущенный из процесса без облака в памяти
+(ru_maxrss не сбрасывается и наследуется при fork); облако — синтетическое
+binary PCD x y z intensity во временном каталоге.
+"""
+from __future__ import annotations
+import argparse, json, os, subprocess, sys, tempfile, time
+import numpy as np
+
+from .common import make_points
+
+MODES={"coords": dict(records=False), "records": dict(records=True),
+       "quantized": dict(records=False, coord_quantum=0.001)}
+
+
+def _child(mode: str, path: str):
+    from app.clearing_algorithm import clean_mask, peak_rss_mb
+    base=peak_rss_mb()
+    t=time.perf_counter()
+    _, drop, summary=clean_mask(lambda: open(path, "rb"), **MODES[mode])
+    print(json.dumps({"base_mb": base, "peak_mb": summary["peak_rss_mb"], "removed": int(drop.sum()),
+                      "seconds": time.perf_counter()-t}))
+
+
+def _write_scene(path: str, n: int, density: float):
+    from app.pcd_io import write_pcd
+    P=make_points(n, density)
+    P[:,2]=0.02*P[:,0]+np.random.default_rng(5).normal(0.0, 0.03, n)
+    # ленты 10x3 м через 20 м, поднятые на 1 м: им есть что удалять
+    up=(P[:,0]%20<10)&(P[:,1]%20<3)
+    P[up,2]+=1.0
+    rec=np.empty(n, dtype=[("x","<f4"),("y","<f4"),("z","<f4"),("intensity","<f4")])
+    rec["x"]=P[:,0]; rec["y"]=P[:,1]; rec["z"]=P[:,2]; rec["intensity"]=np.arange(n)%255
+    del P
+    write_pcd(path, rec, data="binary")
+
+
+def main():
+    ap=argparse.ArgumentParser(description="cleaning peak RSS vs raw point payload")
+    ap.add_argument("--points", type=float, default=2e7)
+    ap.add_argument("--density", type=float, default=200.0, help="точек на м²")
+    ap.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    ap.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    ap.add_argument("--scene", help=argparse.SUPPRESS)
+    args=ap.parse_args()
+    if args.child:
+        return _child(*args.child)
+    if args.scene:
+        return _write_scene(args.scene, int(args.points), args.density)
+
+    with tempfile.TemporaryDirectory(prefix="bench_mem_") as tmp:
+        path=os.path.join(tmp, "scene.pcd")
+        subprocess.run([sys.executable, "-m", "bench.memory", "--scene", path, "--points", str(args.points),
+                        "--density", str(args.density)], check=True)
+        raw=os.path.getsize(path)/2**20
+        print(f"points: {int(args.points)}, file: {raw:.1f} MB")
+        print(f"{'mode':<10} {'peak, MB':>9} {'over base':>10} {'x raw':>6} {'time, s':>8} {'removed':>9}")
+        for mode in args.modes:
+            out=subprocess.run([sys.executable, "-m", "bench.memory", "--child", mode, path],
+                               check=True, capture_output=True, text=True).stdout
+            r=json.loads(out.strip().splitlines()[-1])
+            print(f"{mode:<10} {r['peak_mb']:>9.0f} {r['peak_mb']-r['base_mb']:>10.0f} {(r['peak_mb']-r['base_mb'])/raw:>6.2f}"
+                  f" {r['seconds']:>8.1f} {r['removed']:>9}")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Накладные расходы запросов к MinIO: клиент на каждый вызов (как было) против
+общего клиента процесса с пулом keep-alive соединений, и удаление объектов
+по одному против пакетного storage.remove_keys.
+
+    python -m bench.minio_client                      # встроенная заглушка S3
+    python -m bench.minio_client --endpoint localhost:9000 --bucket bench
+
+Без --endpoint поднимается заглушка S3 в процессе (потоковый http.server,
+объекты в памяти, подпись не проверяется) с задержкой --latency_ms на ответ,
+имитирующей сеть до хранилища; с --endpoint — настоящий MinIO (ключи из
+MINIO_ROOT_USER / MINIO_ROOT_PASSWORD), бакет создаётся и очищается.
+"""
+from __future__ import annotations
+import argparse, hashlib, os, re, socket, threading, time, uuid
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+_NS='xmlns="http://s3.amazonaws.com/doc/2006-03-01/"'
+
+
+class _S3(BaseHTTPRequestHandler):
+    """Минимальный S3: бакеты, PUT/GET/HEAD/DELETE объекта, ListObjectsV2, DeleteObjects, multipart."""
+    protocol_version="HTTP/1.1"
+    store: dict={}
+    # незавершённые multipart-загрузки: uploadId -> {номер части: данные}
+    uploads: dict={}
+    buckets: set=set()
+    latency=0.0
+    requests=0
+    connections=0
+
+    def setup(self):
+        super().setup()
+        # заголовки и тело уходят отдельными write: без NODELAY — задержка ACK на каждом ответе
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        type(self).connections+=1
+
+    def log_message(self, *a):
+        pass
+
+    def _send(self, code: int, body: bytes=b"", headers: dict | None=None, head=False):
+        time.sleep(self.latency)
+        type(self).requests+=1
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _xml(self, code: int, body: str):
+        self._send(code, f'<?xml version="1.0" encoding="UTF-8"?>{body}'.encode(), {"Content-Type": "application/xml"})
+
+    def _error(self, code: int, s3code: str, head=False):
+        if head:
+            return self._send(code, head=True)
+        self._xml(code, f"<Error><Code>{s3code}</Code><Message>{s3code}</Message><RequestId>0</RequestId>"
+                        f"<HostId>0</HostId><Resource>{escape(self.path)}</Resource></Error>")
+
+    def _parse(self):
+        u=urlparse(self.path)
+        parts=unquote(u.path).lstrip("/").split("/", 1)
+        return parts[0], (parts[1] if len(parts)>1 else ""), parse_qs(u.query, keep_blank_values=True)
+
+    def _body(self) -> bytes:
+        n=int(self.headers.get("Content-Length") or 0)
+        data=self.rfile.read(n)
+        if "aws-chunked" in (self.headers.get("Content-Encoding") or "") or self.headers.get("x-amz-decoded-content-length"):
+            out, i=b"", 0
+            while True:
+                j=data.index(b"\r\n", i); size=int(data[i:j].split(b";")[0], 16)
+                if size==0:
+                    return out
+                out+=data[j+2:j+2+size]; i=j+2+size+2
+        return data
+
+    def do_HEAD(self):
+        bucket, key, _=self._parse()
+        if not key:
+            return self._send(200 if bucket in self.buckets else 404, head=True)
+        obj=self.store.get((bucket, key))
+        if obj is None:
+            return self._error(404, "NoSuchKey", head=True)
+        self._send(200, obj[0], {"ETag": f'"{obj[1]}"', "Last-Modified": formatdate(obj[2], usegmt=True),
+                                 "Content-Type": "application/octet-stream"}, head=True)
+
+    def do_GET(self):
+        bucket, key, q=self._parse()
+        if not key and "location" in q:
+            return self._xml(200, f"<LocationConstraint {_NS}></LocationConstraint>")
+        if not key:
+            prefix=q.get("prefix", [""])[0]
+            items="".join(
+                f"<Contents><Key>{escape(k)}</Key><LastModified>"
+                f"{datetime.fromtimestamp(o[2], timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+                f"<ETag>&quot;{o[1]}&quot;</ETag><Size>{len(o[0])}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+                for (b, k), o in sorted(self.store.items()) if b==bucket and k.startswith(prefix))
+            return self._xml(200, f"<ListBucketResult {_NS}><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>"
+                                  f"<KeyCount>{items.count('<Contents>')}</KeyCount><MaxKeys>1000</MaxKeys>"
+                                  f"<IsTruncated>false</IsTruncated>{items}</ListBucketResult>")
+        obj=self.store.get((bucket, key))
+        if obj is None:
+            return self._error(404, "NoSuchKey")
+        self._send(200, obj[0], {"ETag": f'"{obj[1]}"', "Last-Modified": formatdate(obj[2], usegmt=True),
+                                 "Content-Type": "application/octet-stream"})
+
+    def do_PUT(self):
+        bucket, key, q=self._parse()
+        data=self._body()
+        if not key:
+            self.buckets.add(bucket)
+            return self._send(200)
+        etag=hashlib.md5(data).hexdigest()
+        if "uploadId" in q:
+            self.uploads[q["uploadId"][0]][int(q["partNumber"][0])]=data
+            return self._send(200, headers={"ETag": f'"{etag}"'})
+        self.store[(bucket, key)]=(data, etag, time.time())
+        self._send(200, headers={"ETag": f'"{etag}"'})
+
+    def do_DELETE(self):
+        bucket, key, q=self._parse()
+        if "uploadId" in q:
+            self.uploads.pop(q["uploadId"][0], None)
+        else:
+            self.store.pop((bucket, key), None)
+        self._send(204)
+
+    def do_POST(self):
+        bucket, key, q=self._parse()
+        body=self._body().decode()
+        if "uploads" in q:
+            upload_id=uuid.uuid4().hex
+            self.uploads[upload_id]={}
+            return self._xml(200, f"<InitiateMultipartUploadResult {_NS}><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                                  f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        if "uploadId" in q:
+            parts=self.uploads.pop(q["uploadId"][0])
+            data=b"".join(parts[i] for i in sorted(parts))
+            etag=f"{hashlib.md5(data).hexdigest()}-{len(parts)}"
+            self.store[(bucket, key)]=(data, etag, time.time())
+            return self._xml(200, f"<CompleteMultipartUploadResult {_NS}><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                                  f"<ETag>&quot;{etag}&quot;</ETag></CompleteMultipartUploadResult>")
+        if "delete" not in q:
+            return self._error(501, "NotImplemented")
+        for k in re.findall(r"<Key>(.*?)</Key>", body):
+            self.store.pop((bucket, unquote(k).replace("&amp;", "&")), None)
+        self._xml(200, f"<DeleteResult {_NS}></DeleteResult>")
+
+
+def _standin(latency_ms: float):
+    _S3.latency=latency_ms/1000
+    server=ThreadingHTTPServer(("127.0.0.1", 0), _S3)
+    server.daemon_threads=True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}"
+
+
+def _ms(fn, n: int) -> float:
+    t=time.perf_counter(); fn(); return (time.perf_counter()-t)*1000/n
+
+
+def main():
+    ap=argparse.ArgumentParser(description="MinIO client overhead: per-call vs shared client, single vs batched deletes")
+    ap.add_argument("--endpoint", help="host:port настоящего MinIO (иначе встроенная заглушка)")
+    ap.add_argument("--bucket", default="bench-minio-client")
+    ap.add_argument("--latency_ms", type=float, default=1.0, help="задержка ответа заглушки")
+    ap.add_argument("--calls", type=int, default=200, help="запросов stat/get на вариант")
+    ap.add_argument("--objects", type=int, default=2000, help="объектов на вариант удаления")
+    args=ap.parse_args()
+
+    if args.endpoint:
+        os.environ["MINIO_ENDPOINT"]=args.endpoint
+    else:
+        server, endpoint=_standin(args.latency_ms)
+        os.environ.update(MINIO_ENDPOINT=endpoint, MINIO_SECURE="false")
+    from minio import Minio
+    from app.settings import Settings
+    from app.storage import ensure_bucket, get_minio_client, remove_keys, upload_bytes
+
+    settings=Settings()
+    shared=get_minio_client(settings)
+    ensure_bucket(shared, args.bucket)
+
+    def fresh():
+        # прежний get_minio_client: новый клиент (пул, соединения, запрос региона) на каждый вызов
+        return Minio(shared._base_url.host, access_key=settings.minio_access_key,
+                     secret_key=settings.minio_secret_key, secure=settings.minio_secure)
+
+    upload_bytes(shared, args.bucket, "small.bin", os.urandom(4096))
+    def stat(get_client):
+        for _ in range(args.calls):
+            get_client().stat_object(args.bucket, "small.bin")
+    def get(get_client):
+        for _ in range(args.calls):
+            r=get_client().get_object(args.bucket, "small.bin")
+            try:
+                r.read()
+            finally:
+                r.close(); r.release_conn()
+
+    print(f"{'operation':<28} {'per-call client':>16} {'shared client':>14}  (ms per request)")
+    for name, fn in (("stat_object", stat), ("get_object 4 KB", get)):
+        t_fresh=_ms(lambda: fn(fresh), args.calls)
+        t_shared=_ms(lambda: fn(lambda: get_minio_client(settings)), args.calls)
+        print(f"{name:<28} {t_fresh:>16.2f} {t_shared:>14.2f}")
+
+    def fill(prefix: str):
+        for i in range(args.objects):
+            upload_bytes(shared, args.bucket, f"{prefix}/{i:06d}.bin", b"x")
+
+    fill("single")
+    def single():
+        for o in shared.list_objects(args.bucket, prefix="single/", recursive=True):
+            shared.remove_object(args.bucket, o.object_name)
+    t_single=_ms(single, args.objects)
+    fill("batch")
+    failed=[]
+    t_batch=_ms(lambda: failed.extend(remove_keys(shared, args.bucket, ["batch/"])), args.objects)
+    left=sum(1 for _ in shared.list_objects(args.bucket, recursive=True, prefix="batch/"))
+    print(f"{'delete (per object)':<28} {t_single:>16.3f} {t_batch:>14.3f}  (remove_object loop vs remove_keys;"
+          f" failed {len(failed)}, left {left})")
+    if not args.endpoint:
+        print(f"stand-in: {_S3.requests} requests over {_S3.connections} connections")
+    remove_keys(shared, args.bucket, ["small.bin"])
+
+
+if __name__=="__main__":
+    main()
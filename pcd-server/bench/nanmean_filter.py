@@ -0,0 +1,60 @@
+"""
+Бенчмарк nanmean_filter: интегральные изображения против прежних (2r+1)² сдвигов.
+
+    python -m bench.nanmean_filter --size 2000 --radii 1 3 7 15 31
+"""
+from __future__ import annotations
+import argparse
+import numpy as np
+
+from app.clearing_algorithm import nanmean_filter
+from .common import timed
+
+
+def nanmean_filter_shift(A: np.ndarray, radius: int) -> np.ndarray:
+    """Прежняя реализация — сумма по (2r+1)² сдвинутым срезам; эталон для сравнения."""
+    if radius<=0: return A.copy()
+    H,W=A.shape
+    acc=np.zeros((H,W), dtype=np.float64)
+    cnt=np.zeros((H,W), dtype=np.float64)
+    for dy in range(-radius, radius+1):
+        y0=max(0,-dy); y1=min(H,H-dy)
+        for dx in range(-radius, radius+1):
+            x0=max(0,-dx); x1=min(W,W-dx)
+            src=A[y0:y1, x0:x1]
+            tgt=acc[y0+dy:y1+dy, x0+dx:x1+dx]
+            tcnt=cnt[y0+dy:y1+dy, x0+dx:x1+dx]
+            m=~np.isnan(src)
+            tgt[m]+=src[m]; tcnt[m]+=1.0
+    out=np.full_like(A, np.nan, dtype=np.float64)
+    m=cnt>0; out[m]=acc[m]/cnt[m]
+    return out
+
+
+def main():
+    ap=argparse.ArgumentParser(description="nanmean_filter: summed-area table vs shifted slices")
+    ap.add_argument("--size", type=int, default=2000, help="сторона растра в клетках")
+    ap.add_argument("--radii", type=int, nargs="+", default=[1, 3, 7, 15, 31])
+    ap.add_argument("--nan_frac", type=float, default=0.3)
+    ap.add_argument("--shift_max", type=int, default=15, help="не гонять старую версию на радиусах больше этого")
+    args=ap.parse_args()
+
+    rng=np.random.default_rng(42)
+    A=rng.normal(100.0, 2.0, (args.size, args.size)).astype(np.float32)
+    A[rng.random(A.shape)<args.nan_frac]=np.nan
+
+    print(f"{'radius':>6} {'SAT, s':>8} {'shift, s':>9} {'speedup':>8} {'max |diff|':>11}")
+    for r in args.radii:
+        out, ts=timed(nanmean_filter, A, r)
+        if r<=args.shift_max:
+            ref, tr=timed(nanmean_filter_shift, A, r)
+            if not np.array_equal(np.isnan(out), np.isnan(ref)):
+                raise SystemExit(f"маски NaN расходятся при r={r}")
+            diff=float(np.nanmax(np.abs(out-ref))) if np.isfinite(ref).any() else 0.0
+            print(f"{r:>6} {ts:>8.3f} {tr:>9.3f} {tr/ts:>7.1f}x {diff:>11.2e}")
+        else:
+            print(f"{r:>6} {ts:>8.3f} {'-':>9} {'-':>8} {'-':>11}")
+
+
+if __name__=="__main__":
+    main()
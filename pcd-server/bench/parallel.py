@@ -0,0 +1,52 @@
+"""
+Бенчмарк масштабирования многопроцессной очистки по числу процессов.
+
+    python -m bench.parallel --points 2e7 --workers 1 2 4 8 16 32
+"""
+from __future__ import annotations
+import argparse, os
+import numpy as np
+
+from app.clearing_algorithm import grid_cells, nanmean_filter, classify_cells, removal_mask
+from app.coords import Coords
+from app.parallel import clean_points_parallel
+from .common import make_points, timed
+
+CELL_PARAMS=dict(h_min=0.20, h_max=3.0, min_len=3.0, min_width=1.4, max_width=3.5,
+                 min_elong=2.2, density_min=5, use_hough=False,
+                 hough_theta_step=5.0, hough_rho_bin=0.5, hough_topk=8,
+                 hough_min_len=8.0, hough_min_w=1.0, hough_max_w=4.5, hough_dilate=1)
+
+
+def clean_points_serial(P: np.ndarray, grid: float, smooth_cells: int) -> np.ndarray:
+    C=Coords.of(P)
+    G,cell=grid_cells(C, grid, 0.02, 0.90)
+    z_ground=nanmean_filter(G.z_low, smooth_cells)
+    keep=classify_cells(G, z_ground, **CELL_PARAMS)
+    return removal_mask(C, cell, keep, z_ground, CELL_PARAMS["h_min"], CELL_PARAMS["h_max"])
+
+
+def main():
+    ap=argparse.ArgumentParser(description="parallel cleaning: scaling by worker count")
+    ap.add_argument("--points", type=float, default=2e7)
+    ap.add_argument("--density", type=float, default=200.0, help="точек на м²")
+    ap.add_argument("--grid", type=float, default=0.35)
+    ap.add_argument("--smooth_cells", type=int, default=7)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args=ap.parse_args()
+
+    P=make_points(int(args.points), args.density)
+    print(f"cpu: {os.cpu_count()}, points: {P.shape[0]}")
+    print(f"{'workers':>7} {'time, s':>8} {'speedup':>8} {'removed':>9}")
+    base=None
+    for w in args.workers:
+        if w==1:
+            m, t=timed(clean_points_serial, P, args.grid, args.smooth_cells)
+        else:
+            (m, _), t=timed(clean_points_parallel, P, args.grid, 0.02, 0.90, args.smooth_cells, w, **CELL_PARAMS)
+        base=base or t
+        print(f"{w:>7} {t:>8.2f} {base/t:>7.1f}x {int(m.sum()):>9}")
+
+
+if __name__=="__main__":
+    main()
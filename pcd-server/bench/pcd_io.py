@@ -0,0 +1,91 @@
+"""
+Чтение/запись PCD: Open3D против app.pcd_io — время и пиковый RSS.
+
+    python -m bench.pcd_io --points 2e7
+
+Каждый замер идёт в отдельном процессе, иначе пиковый RSS копился бы между
+замерами. Open3D нужен только для сравнения.
+"""
+from __future__ import annotations
+import argparse, os, resource, subprocess, sys, tempfile
+import numpy as np
+
+from .common import make_points, timed
+
+FORMATS=("binary", "binary_compressed", "ascii")
+
+
+def _o3d_read(path: str) -> np.ndarray:
+    import open3d as o3d
+    return np.asarray(o3d.io.read_point_cloud(path).points, dtype=np.float64)
+
+
+def _o3d_write(path: str, P: np.ndarray, data: str):
+    import open3d as o3d
+    pcd=o3d.geometry.PointCloud(); pcd.points=o3d.utility.Vector3dVector(P)
+    o3d.io.write_point_cloud(path, pcd, write_ascii=data=="ascii", compressed=data=="binary_compressed")
+
+
+def _native_read(path: str) -> np.ndarray:
+    from app.pcd_io import read_pcd, xyz
+    return xyz(read_pcd(path))
+
+
+def _native_write(path: str, rec: np.ndarray, data: str):
+    from app.pcd_io import write_pcd
+    write_pcd(path, rec, data)
+
+
+def run_case(lib: str, op: str, path: str, data: str, npy: str):
+    """Один замер в текущем процессе: печатает 'секунды пиковый_RSS_МБ'."""
+    # импорт библиотек не входит в замер
+    if lib=="open3d": import open3d
+    else: import app.pcd_io
+    if op=="read":
+        _, t=timed(_o3d_read if lib=="open3d" else _native_read, path)
+    else:
+        P=np.load(npy)
+        if lib=="open3d":
+            _, t=timed(_o3d_write, path, P, data)
+        else:
+            from app.pcd_io import as_records
+            _, t=timed(_native_write, path, as_records(P.astype(np.float32)), data)
+    print(f"{t:.3f} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.0f}")
+
+
+def _measure(*case) -> tuple[float, float]:
+    out=subprocess.run([sys.executable, "-m", "bench.pcd_io", "--case", *case],
+                       check=True, capture_output=True, text=True).stdout.split()
+    return float(out[0]), float(out[1])
+
+
+def main():
+    ap=argparse.ArgumentParser(description="PCD I/O: Open3D vs native reader/writer")
+    ap.add_argument("--points", type=float, default=1e7)
+    ap.add_argument("--density", type=float, default=200.0, help="точек на м²")
+    ap.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    ap.add_argument("--case", nargs=5, metavar=("LIB", "OP", "PATH", "DATA", "NPY"), help=argparse.SUPPRESS)
+    args=ap.parse_args()
+    if args.case:
+        run_case(*args.case); return
+
+    n=int(args.points)
+    with tempfile.TemporaryDirectory(prefix="bench_pcd_") as tmp:
+        npy=os.path.join(tmp, "points.npy")
+        np.save(npy, make_points(n, args.density))
+        print(f"points: {n}")
+        print(f"{'format':>17} {'op':>5} {'open3d, s':>10} {'MB':>6} {'native, s':>10} {'MB':>6} {'speedup':>8}")
+        for data in args.formats:
+            for op in ("write", "read"):
+                res={}
+                for lib in ("open3d", "native"):
+                    path=os.path.join(tmp, f"{lib}_{data}.pcd")
+                    # чтение — файла, записанного Open3D: формат не зависит от своего писателя
+                    src=os.path.join(tmp, f"open3d_{data}.pcd") if op=="read" else path
+                    res[lib]=_measure(lib, op, src, data, npy)
+                (to, mo), (tn, mn)=res["open3d"], res["native"]
+                print(f"{data:>17} {op:>5} {to:>10.2f} {mo:>6.0f} {tn:>10.2f} {mn:>6.0f} {to/tn:>7.1f}x")
+
+
+if __name__=="__main__":
+    main()
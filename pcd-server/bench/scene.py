@@ -0,0 +1,161 @@
+"""
+Детерминированная синтетическая сцена LiDAR для бенчмарков: наклонная
+волнистая земля, улицы сеткой с бордюрами, машины на полосах и длинные
+ленты под разными углами.
+
+    python -m bench.scene --points 5e7 --density 200 --out scene.pcd
+
+Сцена — квадрат со стороной sqrt(points/density) м; точки x y z intensity
+(float32, binary PCD) пишутся полосами по 10 м, память генератора не зависит
+от размера сцены (1 млн … 500 млн точек). Одни и те же (points, density,
+seed) дают побайтно одинаковый файл: у каждой полосы свой генератор
+случайных чисел, объекты раскладываются одним генератором заранее.
+
+Машины (4,5×1,8 м, крыша 1,3–1,9 м) и ленты (15–40×2–3 м, 0,8–1,5 м) —
+то, что очистка должна удалять; бордюр (ступень 0,15 м) и рельеф земли —
+то, что должно остаться.
+"""
+from __future__ import annotations
+import argparse, os
+from typing import Iterator, NamedTuple
+import numpy as np
+
+from app.pcd_io import _header_bytes
+
+DTYPE=np.dtype([("x","<f4"),("y","<f4"),("z","<f4"),("intensity","<f4")])
+# intensity точек объектов; у земли — 0..199
+CAR=230.0
+BAND=250.0
+
+# полоса генерации, м
+_STRIP=10.0
+# улицы: ширина и шаг сетки по y и x, м; проезжая часть ниже тротуара на высоту бордюра
+_ROAD_W=12.0
+_ROAD_STEP_Y=80.0
+_ROAD_STEP_X=120.0
+_CURB=0.15
+# машин на 100 м полосы движения, лент на гектар
+_CARS_PER_100M=3.0
+_BANDS_PER_HA=1.5
+
+
+class Objects(NamedTuple):
+    """Прямоугольники объектов: центр, полудлины вдоль/поперёк, угол, высота; отсортированы по cx."""
+    cx: np.ndarray
+    cy: np.ndarray
+    hl: np.ndarray
+    hw: np.ndarray
+    angle: np.ndarray
+    height: np.ndarray
+    # радиус описанной окружности — для отбора по x
+    r: np.ndarray
+    cars: int
+
+
+def scene_side(points: int, density: float) -> float:
+    return float(np.sqrt(points/density))
+
+
+def ground(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Земля: уклон 2 % по x, 1 % по y и волны ±0,3 м."""
+    z=0.02*x+0.01*y+0.3*np.sin(x/40.0)*np.cos(y/55.0)
+    road=((y%_ROAD_STEP_Y)<_ROAD_W)|((x%_ROAD_STEP_X)<_ROAD_W)
+    z[road]-=_CURB
+    return z
+
+
+def scene_objects(side: float, seed: int = 7) -> Objects:
+    rng=np.random.default_rng([seed, 0])
+    cars=[]
+    # машины по полосам горизонтальных и вертикальных улиц, вдоль улицы
+    for horizontal, step in ((True, _ROAD_STEP_Y), (False, _ROAD_STEP_X)):
+        for r0 in np.arange(0.0, side, step):
+            for lane in (r0+3.0, r0+_ROAD_W-3.0):
+                if lane>side:
+                    continue
+                k=rng.poisson(_CARS_PER_100M*side/100.0)
+                along=rng.uniform(0.0, side, k)
+                across=lane+rng.normal(0.0, 0.3, k)
+                cx, cy=(along, across) if horizontal else (across, along)
+                cars.append(np.stack([cx, cy, np.full(k, 2.25), np.full(k, 0.9),
+                                      np.full(k, 0.0 if horizontal else np.pi/2), rng.uniform(1.3, 1.9, k)], 1))
+    k=rng.poisson(_BANDS_PER_HA*side*side/1e4)
+    bands=np.stack([rng.uniform(0.0, side, k), rng.uniform(0.0, side, k), rng.uniform(7.5, 20.0, k),
+                    rng.uniform(1.0, 1.5, k), rng.uniform(0.0, np.pi, k), rng.uniform(0.8, 1.5, k)], 1)
+    cars=np.concatenate(cars) if cars else np.empty((0, 6))
+    O=np.concatenate([cars, bands])
+    O=O[np.argsort(O[:,0], kind="stable")]
+    return Objects(*O.T, r=np.hypot(O[:,2], O[:,3]), cars=len(cars))
+
+
+def _strip_counts(points: int, side: float):
+    """Границы полос по y и число точек в каждой (пропорционально площади, в сумме points)."""
+    edges=np.minimum(np.arange(0.0, side+_STRIP, _STRIP), side)
+    edges=np.unique(edges)
+    counts=np.floor(points*np.diff(edges)/side).astype(np.int64)
+    counts[:points-int(counts.sum())]+=1
+    return edges, counts
+
+
+def scene_chunks(points: int, density: float, seed: int = 7) -> Iterator[np.ndarray]:
+    """Записи сцены полосами по y (точки полосы — по возрастанию x)."""
+    side=scene_side(points, density)
+    O=scene_objects(side, seed)
+    edges, counts=_strip_counts(points, side)
+    for i, n in enumerate(counts):
+        rng=np.random.default_rng([seed, 1, i])
+        x=np.sort(rng.uniform(0.0, side, n))
+        y=rng.uniform(edges[i], edges[i+1], n)
+        z=ground(x, y)+rng.normal(0.0, 0.03, n)
+        intensity=rng.integers(0, 200, n).astype(np.float32)
+        # объекты, задевающие полосу; точки-кандидаты — по x из отсортированного x
+        near=np.flatnonzero((O.cy+O.r>=edges[i])&(O.cy-O.r<=edges[i+1]))
+        for j in near:
+            a, b=np.searchsorted(x, [O.cx[j]-O.r[j], O.cx[j]+O.r[j]])
+            dx=x[a:b]-O.cx[j]; dy=y[a:b]-O.cy[j]
+            c, s=np.cos(O.angle[j]), np.sin(O.angle[j])
+            inside=(np.abs(dx*c+dy*s)<=O.hl[j])&(np.abs(dy*c-dx*s)<=O.hw[j])
+            if inside.any():
+                idx=a+np.flatnonzero(inside)
+                z[idx]=ground(x[idx], y[idx])+O.height[j]+rng.normal(0.0, 0.03, idx.size)
+                intensity[idx]=CAR if j<O.cars else BAND
+        rec=np.empty(n, dtype=DTYPE)
+        rec["x"]=x; rec["y"]=y; rec["z"]=z; rec["intensity"]=intensity
+        yield rec
+
+
+def write_scene(path: str, points: int, density: float, seed: int = 7) -> str:
+    """Сцена в binary PCD path (через временный файл: прерванная запись не оставляет неполный path)."""
+    tmp=path+".part"
+    with open(tmp, "wb") as f:
+        f.write(_header_bytes(DTYPE, points, "binary"))
+        for rec in scene_chunks(points, density, seed):
+            rec.tofile(f)
+    os.replace(tmp, path)
+    return path
+
+
+def scene_path(directory: str, points: int, density: float, seed: int = 7) -> str:
+    """Файл сцены в directory; генерируется, только если его ещё нет."""
+    path=os.path.join(directory, f"scene_{points}_{density:g}_{seed}.pcd")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        write_scene(path, points, density, seed)
+    return path
+
+
+def main():
+    ap=argparse.ArgumentParser(description="deterministic synthetic LiDAR scene")
+    ap.add_argument("--points", type=float, default=1e6)
+    ap.add_argument("--density", type=float, default=200.0, help="точек на м²")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", required=True)
+    args=ap.parse_args()
+    write_scene(args.out, int(args.points), args.density, args.seed)
+    O=scene_objects(scene_side(int(args.points), args.density), args.seed)
+    print(f"{args.out}: {int(args.points)} points, side {scene_side(int(args.points), args.density):.0f} m,"
+          f" {O.cars} cars, {len(O.cx)-O.cars} bands, {os.path.getsize(args.out)/2**20:.1f} MB")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Набор бенчмарков очистки на синтетической сцене (bench/scene.py) с проверкой
+регрессий относительно сохранённой базы.
+
+    python -m bench.suite --points 1e7 --save bench_base.json      # записать базу
+    python -m bench.suite --points 1e7 --baseline bench_base.json  # сравнить; код 1 при регрессии
+
+Случаи (--cases):
+  process  — clearing_algorithm.process в памяти, cleaned + delta в файлы;
+  mask     — clean_mask только по координатам (store_mask);
+  tiled    — тайловый режим (--budget_mb);
+  parallel — многопроцессная очистка (--workers);
+  incremental — как mask, затем переочистка копии сцены с правкой в одном
+             месте по состоянию первой очистки (incremental.py); этапы и
+             время — только переочистки;
+  api      — весь путь через маршруты FastAPI: загрузка, LOD оригинала,
+             задача очистки, скачивание cleaned; MinIO — заглушка S3
+             (bench/minio_client.py) в отдельном процессе.
+
+Этапы алгоритма берутся из summary.stages (profiling.py), у api — время
+запросов и задач. Для каждого этапа — время, пропускная способность (точек
+сцены в секунду) и пиковая память процесса к концу этапа. Каждый случай —
+отдельный процесс (пик RSS не наследуется); из --repeat запусков берётся
+лучший.
+
+Регрессия: пропускная способность этапа ниже базы больше чем на
+--tolerance, пик памяти выше больше чем на --mem_tolerance (и на 32 МБ),
+иное число удалённых точек. Число удалённых точек process, mask и api обязано
+совпадать и между собой — это один и тот же расчёт. Этапы короче
+--min_seconds по времени не сравниваются (шум).
+"""
+from __future__ import annotations
+import argparse, json, multiprocessing, os, shutil, subprocess, sys, tempfile, threading, time
+
+from .scene import DTYPE, scene_path
+
+CASES=("process", "mask", "tiled", "parallel", "incremental", "api")
+# случаи с одинаковым результатом очистки
+SAME_RESULT=("process", "mask", "api")
+CLEAN=dict(use_hough=True)
+# запас по памяти сверх --mem_tolerance, МБ
+_MEM_SLACK=32.0
+
+
+def _edit(path: str, out: str) -> str:
+    """Копия сцены, где блок 5×2 м у начала координат поднят на 1,5 м (как поставленная машина)."""
+    import numpy as np
+    shutil.copyfile(path, out)
+    with open(out, "rb") as f:
+        offset=f.read(4096).index(b"DATA binary\n")+len(b"DATA binary\n")
+    rec=np.memmap(out, dtype=DTYPE, mode="r+", offset=offset)
+    m=(rec["x"]>=10.0)&(rec["x"]<15.0)&(rec["y"]>=10.0)&(rec["y"]<12.0)
+    rec["z"][m]+=1.5
+    rec.flush()
+    return out
+
+
+def _algorithm(case: str, path: str, tmp: str, opts: dict) -> dict:
+    from app.clearing_algorithm import process, clean_mask
+    if case=="incremental":
+        _, _, _, state=clean_mask(path, records=False, return_state=True, **CLEAN)
+        path=_edit(path, os.path.join(tmp, "edited.pcd"))
+    t=time.perf_counter()
+    if case=="mask":
+        _, _, summary=clean_mask(lambda: open(path, "rb"), records=False, **CLEAN)
+    elif case=="incremental":
+        _, _, summary=clean_mask(path, records=False, prev_state=state, **CLEAN)
+    else:
+        extra={"tiled": dict(memory_budget_mb=opts["budget_mb"]),
+               "parallel": dict(workers=opts["workers"])}.get(case, {})
+        summary=process(path, os.path.join(tmp, "cleaned.pcd"), delta_out_path=os.path.join(tmp, "delta.pcd"),
+                        **CLEAN, **extra)
+    stages={k: {"seconds": e["wall_s"], "peak_rss_mb": e.get("peak_rss_mb")} for k, e in summary["stages"].items()}
+    stages["total"]={"seconds": time.perf_counter()-t, "peak_rss_mb": summary["peak_rss_mb"]}
+    return {"removed": summary["removed_points"], "stages": stages}
+
+
+def _serve_s3(conn):
+    from .minio_client import _standin
+    _, endpoint=_standin(0.0)
+    conn.send(endpoint)
+    threading.Event().wait()
+
+
+def _api(path: str, tmp: str, opts: dict) -> dict:
+    # заглушка S3 — в своём процессе: объекты в её памяти не попадают в пик RSS API
+    ctx=multiprocessing.get_context("spawn")
+    parent, child=ctx.Pipe()
+    s3=ctx.Process(target=_serve_s3, args=(child,), daemon=True)
+    s3.start()
+    os.environ.update(MINIO_ENDPOINT=parent.recv(), MINIO_SECURE="false", SQLITE_PATH=os.path.join(tmp, "pcd.sqlite3"),
+                      RASTER_CACHE_DIR=os.path.join(tmp, "cache"))
+    from fastapi.testclient import TestClient
+    from app.jobs import FINAL
+    from app.main import app
+    from app.profiling import peak_rss_mb
+
+    def wait(c, job: dict) -> dict:
+        while job["status"] not in FINAL:
+            time.sleep(0.05)
+            job=c.get(f"/api/jobs/{job['id']}").json()
+        if job["status"]!="done":
+            raise RuntimeError(f"{job['kind']} job {job['status']}: {job['error']}")
+        return job
+
+    stages={}
+    def timed(name: str, fn, peak=None):
+        t=time.perf_counter(); r=fn()
+        stages[name]={"seconds": time.perf_counter()-t, "peak_rss_mb": peak(r) if peak else peak_rss_mb()}
+        return r
+
+    t0=time.perf_counter()
+    try:
+        with TestClient(app) as c:
+            def upload():
+                with open(path, "rb") as f:
+                    r=c.post("/api/upload", files={"file": ("scene.pcd", f, "application/octet-stream")})
+                r.raise_for_status()
+                return r.json()["id"]
+            file_id=timed("upload", upload)
+            lod=c.get("/api/jobs", params={"file_id": file_id, "kind": "lod"}).json()
+            timed("lod", lambda: [wait(c, j) for j in lod])
+            def clean():
+                r=c.post(f"/api/files/{file_id}/clean", json=CLEAN)
+                r.raise_for_status()
+                return wait(c, r.json())["result"]["summary"]
+            # пик процесса задачи — из её summary
+            summary=timed("clean", clean, peak=lambda s: s["peak_rss_mb"])
+            def download():
+                n=0
+                with c.stream("GET", f"/api/files/{file_id}/cleaned") as r:
+                    for chunk in r.iter_bytes():
+                        n+=len(chunk)
+                return n
+            timed("download", download)
+    finally:
+        s3.terminate()
+    stages["total"]={"seconds": time.perf_counter()-t0,
+                     "peak_rss_mb": max(s["peak_rss_mb"] or 0.0 for s in stages.values())}
+    return {"removed": summary["removed_points"], "stages": stages}
+
+
+def _child(case: str, path: str, opts: str):
+    opts=json.loads(opts)
+    with tempfile.TemporaryDirectory(prefix="bench_suite_") as tmp:
+        r=_api(path, tmp, opts) if case=="api" else _algorithm(case, path, tmp, opts)
+    print(json.dumps(r))
+
+
+def _best(runs: list) -> dict:
+    """Лучший из повторов: минимум времени и памяти по каждому этапу."""
+    out={"removed": runs[0]["removed"], "removed_all": sorted({r["removed"] for r in runs}), "stages": {}}
+    for name in runs[0]["stages"]:
+        xs=[r["stages"][name] for r in runs if name in r["stages"]]
+        mem=[x["peak_rss_mb"] for x in xs if x["peak_rss_mb"] is not None]
+        out["stages"][name]={"seconds": min(x["seconds"] for x in xs), "peak_rss_mb": min(mem) if mem else None}
+    return out
+
+
+def compare(result: dict, base: dict, tolerance: float, mem_tolerance: float, min_seconds: float) -> list:
+    """Регрессии result относительно base: список строк-описаний."""
+    bad=[]
+    if result["scene"]!=base["scene"]:
+        return [f"scene {result['scene']} differs from baseline scene {base['scene']}"]
+    for case, r in result["cases"].items():
+        b=base["cases"].get(case)
+        if b is None:
+            continue
+        if r["removed"]!=b["removed"]:
+            bad.append(f"{case}: removed {r['removed']} points, baseline {b['removed']}")
+        for name, s in r["stages"].items():
+            bs=b["stages"].get(name)
+            if bs is None:
+                continue
+            if max(s["seconds"], bs["seconds"])>=min_seconds and s["pts_per_s"]<bs["pts_per_s"]*(1.0-tolerance):
+                bad.append(f"{case}/{name}: {s['pts_per_s']:.3g} points/s, baseline {bs['pts_per_s']:.3g}")
+            if (s["peak_rss_mb"] is not None and bs["peak_rss_mb"] is not None
+                    and s["peak_rss_mb"]>bs["peak_rss_mb"]*(1.0+mem_tolerance)+_MEM_SLACK):
+                bad.append(f"{case}/{name}: peak {s['peak_rss_mb']:.0f} MB, baseline {bs['peak_rss_mb']:.0f} MB")
+    return bad
+
+
+def main():
+    ap=argparse.ArgumentParser(description="cleaning benchmark suite with baseline regression check")
+    ap.add_argument("--points", type=float, default=2e6, help="точек сцены (1e6 … 5e8)")
+    ap.add_argument("--density", type=float, default=200.0, help="точек на м²")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES)
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--budget_mb", type=float, default=256.0, help="memory_budget_mb случая tiled")
+    ap.add_argument("--workers", type=int, default=4, help="процессов случая parallel")
+    ap.add_argument("--scene_dir", help="каталог сцен (сцена генерируется один раз); по умолчанию временный")
+    ap.add_argument("--baseline", help="JSON базы: сравнить и вернуть код 1 при регрессии")
+    ap.add_argument("--save", help="записать результат в JSON (новая база)")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="допустимое падение пропускной способности")
+    ap.add_argument("--mem_tolerance", type=float, default=0.1, help="допустимый рост пика памяти")
+    ap.add_argument("--min_seconds", type=float, default=0.05)
+    ap.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args=ap.parse_args()
+    if args.child:
+        return _child(*args.child)
+
+    points=int(args.points)
+    opts=json.dumps({"budget_mb": args.budget_mb, "workers": args.workers})
+    with tempfile.TemporaryDirectory(prefix="bench_scene_") as tmp:
+        t=time.perf_counter()
+        path=scene_path(args.scene_dir or tmp, points, args.density, args.seed)
+        print(f"scene: {points} points, {os.path.getsize(path)/2**20:.1f} MB ({time.perf_counter()-t:.1f} s)")
+        result={"scene": {"points": points, "density": args.density, "seed": args.seed},
+                "cpu_count": os.cpu_count(), "cases": {}}
+        print(f"{'case':<11} {'stage':<13} {'time, s':>8} {'Mpts/s':>8} {'peak, MB':>9}")
+        for case in args.cases:
+            runs=[]
+            for _ in range(args.repeat):
+                p=subprocess.run([sys.executable, "-m", "bench.suite", "--child", case, path, opts],
+                                 capture_output=True, text=True)
+                if p.returncode:
+                    sys.stderr.write(p.stderr)
+                    sys.exit(f"case {case} failed")
+                runs.append(json.loads(p.stdout.strip().splitlines()[-1]))
+            r=result["cases"][case]=_best(runs)
+            for name, s in r["stages"].items():
+                s["pts_per_s"]=points/max(s["seconds"], 1e-9)
+                peak=f"{s['peak_rss_mb']:.0f}" if s["peak_rss_mb"] is not None else "-"
+                print(f"{case:<11} {name:<13} {s['seconds']:>8.2f} {s['pts_per_s']/1e6:>8.2f} {peak:>9}")
+            print(f"{case:<11} removed {r['removed']}")
+
+    bad=[f"{case}: removed point count differs between repeats: {r['removed_all']}"
+         for case, r in result["cases"].items() if len(r["removed_all"])>1]
+    same={case: result["cases"][case]["removed"] for case in SAME_RESULT if case in result["cases"]}
+    if len(set(same.values()))>1:
+        bad.append(f"removed point counts differ between cases: {same}")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            bad+=compare(result, json.load(f), args.tolerance, args.mem_tolerance, args.min_seconds)
+    for line in bad:
+        print(f"REGRESSION {line}")
+    if bad:
+        sys.exit(1)
+    if args.baseline:
+        print("no regressions against baseline")
+
+
+if __name__=="__main__":
+    main()
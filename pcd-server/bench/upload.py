@@ -0,0 +1,84 @@
+"""
+Потоковая загрузка в MinIO: синтетический файл в несколько ГБ под ограничением
+памяти. Нужен доступный MinIO (переменные окружения как у бэкенда).
+
+    MINIO_ENDPOINT=localhost:9002 python -m bench.upload --gb 3 --cap_mb 256
+
+Проверяет размер и sha256 загруженного объекта и что пиковый RSS процесса
+не превысил --cap_mb; при превышении код возврата 1.
+"""
+from __future__ import annotations
+import argparse, hashlib, resource, sys, time, uuid
+import numpy as np
+
+from app.settings import get_settings
+from app.storage import get_minio_client, ensure_bucket, upload_stream
+
+_BLOCK=1<<20
+
+
+class SyntheticPCD:
+    """Файловый объект: заголовок binary PCD и n байт псевдослучайных данных, без хранения файла."""
+
+    def __init__(self, nbytes: int, seed: int = 42):
+        n=nbytes//12
+        self.head=("# .PCD v0.7 - Point Cloud Data file format\nVERSION 0.7\nFIELDS x y z\nSIZE 4 4 4\n"
+                   f"TYPE F F F\nCOUNT 1 1 1\nWIDTH {n}\nHEIGHT 1\nVIEWPOINT 0 0 0 1 0 0 0\nPOINTS {n}\nDATA binary\n").encode()
+        self.size=len(self.head)+n*12
+        self.block=np.random.default_rng(seed).bytes(_BLOCK)
+        self.pos=0
+
+    def _at(self, pos: int, n: int) -> bytes:
+        """Байты [pos, pos+n): заголовок, затем блок, сдвинутый на номер блока (данные не периодичны)."""
+        out=bytearray()
+        while n>0 and pos<self.size:
+            if pos<len(self.head):
+                b=self.head[pos:pos+n]
+            else:
+                k,off=divmod(pos-len(self.head), _BLOCK)
+                r=k%_BLOCK
+                b=(self.block[r:]+self.block[:r])[off:off+min(n, _BLOCK-off, self.size-pos)]
+            out+=b; pos+=len(b); n-=len(b)
+        return bytes(out)
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n<0: n=self.size-self.pos
+        b=self._at(self.pos, n); self.pos+=len(b)
+        return b
+
+    def sha256(self) -> str:
+        h=hashlib.sha256(); pos=0
+        while pos<self.size:
+            b=self._at(pos, 8*_BLOCK); h.update(b); pos+=len(b)
+        return h.hexdigest()
+
+
+def main():
+    ap=argparse.ArgumentParser(description="streaming upload to MinIO under a memory cap")
+    ap.add_argument("--gb", type=float, default=3.0)
+    ap.add_argument("--cap_mb", type=float, default=256.0, help="допустимый пиковый RSS, МБ")
+    args=ap.parse_args()
+
+    settings=get_settings()
+    client=get_minio_client(settings)
+    ensure_bucket(client, settings.minio_bucket)
+    src=SyntheticPCD(int(args.gb*(1<<30)))
+    key=f"bench/upload-{uuid.uuid4()}.pcd"
+    t0=time.perf_counter()
+    try:
+        size, sha=upload_stream(client, settings.minio_bucket, key, src)
+        t=time.perf_counter()-t0
+        rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+        stat=client.stat_object(settings.minio_bucket, key)
+    finally:
+        client.remove_object(settings.minio_bucket, key)
+    ok_size=size==src.size==stat.size
+    ok_hash=sha==src.sha256()
+    print(f"size: {size} ({size/(1<<30):.2f} GB), {size/(1<<20)/t:.0f} MB/s")
+    print(f"size matches: {ok_size}, sha256 matches: {ok_hash}")
+    print(f"peak RSS: {rss:.0f} MB (cap {args.cap_mb:.0f} MB)")
+    sys.exit(0 if ok_size and ok_hash and rss<=args.cap_mb else 1)
+
+
+if __name__=="__main__":
+    main()
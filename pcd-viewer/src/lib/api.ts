@@ -7,6 +7,7 @@ export type FileRecord = {
   cleaned_url?: string | null
   delta_url?: string | null
   summary?: Record<string, any> | null
+  sha256?: string | null
 }
 
 export type CleanParams = {
@@ -42,10 +43,27 @@ export async function apiUploadPCD(file: File): Promise<FileRecord> {
   return await res.json()
 }
 
-export async function apiListFiles(): Promise<FileRecord[]> {
-  const res = await fetch(`${API}/files`)
+// Newest files first; the list is paginated, the next page is requested with `next`
+export async function apiListFilesPage(opts: { limit?: number; cursor?: string; filename?: string } = {}): Promise<{ items: FileRecord[]; next: string | null }> {
+  const q = new URLSearchParams()
+  if (opts.limit) q.set('limit', String(opts.limit))
+  if (opts.cursor) q.set('cursor', opts.cursor)
+  if (opts.filename) q.set('filename', opts.filename)
+  const res = await fetch(`${API}/files?${q}`)
   if (!res.ok) throw new Error(await res.text())
-  return await res.json()
+  return { items: await res.json(), next: res.headers.get('X-Next-Cursor') }
+}
+
+// All files, newest first: follows X-Next-Cursor page by page until the last page
+export async function apiListFiles(limit = 200): Promise<FileRecord[]> {
+  const files: FileRecord[] = []
+  let cursor: string | undefined
+  do {
+    const page = await apiListFilesPage({ limit, cursor })
+    files.push(...page.items)
+    cursor = page.next ?? undefined
+  } while (cursor)
+  return files
 }
 
 export async function apiGetFile(id: string): Promise<FileRecord> {
@@ -54,14 +72,49 @@ export async function apiGetFile(id: string): Promise<FileRecord> {
   return await res.json()
 }
 
-export async function apiClean(id: string, params: CleanParams): Promise<FileRecord & { summary?: any }>{
+export type JobRecord = {
+  id: string
+  file_id: string
+  kind: 'clean' | 'sweep' | 'lod'
+  status: 'queued' | 'running' | 'done' | 'failed' | 'cancelled'
+  progress: number
+  stage?: string | null
+  created_at: string
+  started_at?: string | null
+  finished_at?: string | null
+  error?: string | null
+  result?: { id: string, original_url?: string, cleaned_url?: string, delta_url?: string | null, summary?: any } | null
+}
+
+export async function apiGetJob(jobId: string): Promise<JobRecord> {
+  const res = await fetch(`${API}/jobs/${jobId}`)
+  if (!res.ok) throw new Error(await res.text())
+  return await res.json()
+}
+
+export async function apiCancelJob(jobId: string): Promise<JobRecord> {
+  const res = await fetch(`${API}/jobs/${jobId}/cancel`, { method: 'POST' })
+  if (!res.ok) throw new Error(await res.text())
+  return await res.json()
+}
+
+// Cleaning runs as a background job: submit, then poll until it finishes
+export async function apiClean(id: string, params: CleanParams, onProgress?: (job: JobRecord) => void): Promise<FileRecord & { summary?: any }>{
   const res = await fetch(`${API}/files/${id}/clean`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify(params ?? {})
   })
   if (!res.ok) throw new Error(await res.text())
-  const data = await res.json()
+  let job: JobRecord = await res.json()
+  while (job.status === 'queued' || job.status === 'running') {
+    onProgress?.(job)
+    await new Promise(r => setTimeout(r, 1000))
+    job = await apiGetJob(job.id)
+  }
+  onProgress?.(job)
+  if (job.status !== 'done' || !job.result) throw new Error(job.error || `Очистка: ${job.status}`)
+  const data = job.result
   // normalize to FileRecord shape
   return {
     id: data.id,
@@ -96,3 +149,65 @@ export async function apiSaveCleaned(id: string, file: Blob, filename = 'cleaned
 }
 
 
+// Edit of a loaded cloud: indices of removed points (ascending, in the order the cloud was
+// downloaded) and appended x y z; the upload scales with the edit, not with the cloud
+export type CloudEdit = { baseCount: number; removed: Uint32Array; added: Float32Array }
+
+// Binary patch body (little-endian): "PCDP", version 1, removal kind 0 (uint32 indices),
+// base point count, removal bytes, appended point count (u64 each), indices, float32 xyz
+function encodePatch(edit: CloudEdit): Uint8Array {
+  const head = 30
+  const out = new Uint8Array(head + edit.removed.byteLength + edit.added.byteLength)
+  const view = new DataView(out.buffer)
+  out.set([0x50, 0x43, 0x44, 0x50], 0)
+  view.setUint8(4, 1)
+  view.setUint8(5, 0)
+  view.setBigUint64(6, BigInt(edit.baseCount), true)
+  view.setBigUint64(14, BigInt(edit.removed.byteLength), true)
+  view.setBigUint64(22, BigInt(edit.added.length / 3), true)
+  let off = head
+  edit.removed.forEach(i => { view.setUint32(off, i, true); off += 4 })
+  edit.added.forEach(v => { view.setFloat32(off, v, true); off += 4 })
+  return out
+}
+
+export async function apiPatchCloud(id: string, kind: 'original' | 'cleaned', edit: CloudEdit): Promise<FileRecord> {
+  const res = await fetch(`${API}/files/${id}/patch/${kind}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/octet-stream' },
+    body: encodePatch(edit),
+  })
+  if (!res.ok) throw new Error(await res.text())
+  return await res.json()
+}
+
+
+
+// Octree of a cloud: nodes "r", "r0".."r7", "r00"...; each point is in exactly one node,
+// so drawing the root and then visible children refines the view within a point budget
+export type LodIndex = {
+  points: number
+  node_points: number
+  grid: number
+  bounds?: { min: number[], max: number[] }
+  cube?: { min: number[], size: number }
+  spacing?: number
+  nodes: Record<string, number>
+  node_url: string
+}
+
+export async function apiGetLod(id: string, kind: 'original' | 'cleaned' | 'delta'): Promise<LodIndex | null> {
+  const res = await fetch(`${API}/files/${id}/lod/${kind}`)
+  if (res.status === 404) return null
+  if (!res.ok) throw new Error(await res.text())
+  return await res.json()
+}
+
+// Voxel-downsampled cloud (binary PCD, at most maxPoints points) for quick looks
+export function previewUrl(id: string, kind: 'original' | 'cleaned' | 'delta' = 'original', maxPoints = 200000): string {
+  return `${API}/files/${id}/preview?kind=${kind}&max_points=${maxPoints}`
+}
+
+export function lodNodeUrl(index: LodIndex, name: string): string {
+  return index.node_url.replace('{name}', name)
+}